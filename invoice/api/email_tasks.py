@@ -2,16 +2,36 @@
 Otomatik email sync için scheduled tasks
 """
 
+import time
+
 import frappe
 
+from invoice.api.imap_idle import is_idle_listener_active
+from invoice.api.invoice_ingest import is_ingest_backlogged
+from invoice.api.invoice_locks import invoice_lock
+
+logger = frappe.logger("invoice.email_tasks", allow_site=frappe.local.site)
+
+# Her hesap ayrı işte çekilir; bir hesabın yavaşlığı diğerlerini bekletmez
+EMAIL_SYNC_QUEUE = "short"
+EMAIL_SYNC_TIMEOUT = 600
+
+# Adaptif polling: boş gelen her turda bekleme ikiye katlanır (saniye)
+MIN_POLL_INTERVAL = 0
+MAX_POLL_INTERVAL = 30 * 60
+IDLE_BACKOFF_BASE = 2 * 60
+
+SYNC_STATE_KEY = "invoice_email_sync_state"
+
+
 def sync_gmail_invoices():
     """
-    Her 5 dakikada bir Gmail'den email'leri çeker
-    Cron: */5 * * * * (her 5 dakika)
+    Scheduler ("all") her tetiklendiğinde hesap başına sync işi kuyruğa ekler
+    Boşta olan hesaplar backoff süresi dolana kadar atlanır
     """
     try:
         print(f">>>>>> [SCHEDULER] Email sync başlatılıyor... {frappe.utils.now()}")
-        
+
         # Tüm aktif Email Account'ları al
         email_accounts = frappe.get_all("Email Account",
             filters={
@@ -19,36 +39,129 @@ def sync_gmail_invoices():
             },
             fields=["name", "email_id"]
         )
-        
+
         if not email_accounts:
             print(">>>>>> [SCHEDULER] Aktif Email Account bulunamadı")
             return
         
-        # Her hesap için email çek
+        # Backpressure: PDF kuyrukları doluyken yeni mail çekip yükü artırma
+        if is_ingest_backlogged():
+            print(">>>>>> [SCHEDULER] Ingest kuyrukları dolu, mail çekme bu tur atlandı")
+            logger.warning("Ingest kuyrukları dolu, mail çekme bu tur atlandı")
+            return
+
+        now = time.time()
         for account in email_accounts:
-            try:
-                print(f">>>>>> [SCHEDULER] Email çekiliyor: {account.email_id} ({account.name})")
-                
-                email_doc = frappe.get_doc("Email Account", account.name)
-                
-                # Email'leri çek
-                email_doc.receive()
-                
-                print(f"✅ [SCHEDULER] {account.email_id} için email'ler çekildi")
-                
-            except Exception as e:
-                print(f"❌ [SCHEDULER] {account.name} hatası: {str(e)}")
-                frappe.log_error(
-                    title=f"Email Sync Error - {account.name}",
-                    message=str(e)
-                )
-        
-        frappe.db.commit()
-        print(f">>>>>> [SCHEDULER] Email sync tamamlandı! {frappe.utils.now()}")
-        
+            # IMAP IDLE listener'ı çalışan hesaplar push ile alınıyor
+            if is_idle_listener_active(account.name):
+                continue
+
+            state = get_account_sync_state(account.name)
+            if state.get("next_poll_at", 0) > now:
+                print(f">>>>>> [SCHEDULER] {account.email_id} boşta, sonraki kontrol: {int(state['next_poll_at'] - now)} sn sonra")
+                continue
+
+            frappe.enqueue(
+                "invoice.api.email_tasks.sync_email_account",
+                queue=EMAIL_SYNC_QUEUE,
+                timeout=EMAIL_SYNC_TIMEOUT,
+                job_id=f"invoice_email_sync::{account.name}",
+                deduplicate=True,
+                account_name=account.name
+            )
+            print(f">>>>>> [SCHEDULER] Email sync kuyruğa eklendi: {account.email_id} ({account.name})")
+
     except Exception as e:
         print(f"❌ [SCHEDULER] Genel hata: {str(e)}")
         frappe.log_error(
             title="Scheduler Email Sync Error",
             message=str(e)
         )
+
+
+def sync_email_account(account_name):
+    """Tek bir Email Account için email'leri çek (arka plan işi)"""
+    # Önceki tur hâlâ sürüyorsa üst üste binmek yerine bu turu atla
+    with invoice_lock(f"email_sync:{account_name}", timeout=EMAIL_SYNC_TIMEOUT, blocking_timeout=0) as acquired:
+        if not acquired:
+            print(f">>>>>> [SCHEDULER] {account_name} zaten çekiliyor, tur atlandı")
+            logger.info(f"{account_name} zaten çekiliyor, tur atlandı")
+            return
+
+        started = time.time()
+        started_at = frappe.utils.now()
+        try:
+            print(f">>>>>> [SCHEDULER] Email çekiliyor: {account_name}")
+
+            email_doc = frappe.get_doc("Email Account", account_name)
+
+            # Email'leri çek
+            email_doc.receive()
+            frappe.db.commit()
+
+            new_emails = frappe.db.count("Communication", {
+                "email_account": account_name,
+                "sent_or_received": "Received",
+                "creation": [">=", started_at]
+            })
+            duration = time.time() - started
+            update_account_sync_state(account_name, duration, new_emails)
+
+            print(f"✅ [SCHEDULER] {account_name} için {new_emails} email çekildi ({duration:.1f} sn)")
+            logger.info(f"{account_name}: {new_emails} email, {duration:.2f} sn")
+
+        except Exception as e:
+            update_account_sync_state(account_name, time.time() - started, 0, error=str(e))
+            print(f"❌ [SCHEDULER] {account_name} hatası: {str(e)}")
+            frappe.log_error(
+                title=f"Email Sync Error - {account_name}",
+                message=str(e)
+            )
+
+
+def get_account_sync_state(account_name):
+    return frappe.cache.hget(SYNC_STATE_KEY, account_name) or {}
+
+
+def update_account_sync_state(account_name, duration, new_emails, error=None):
+    """Hesabın sync metriklerini ve sonraki polling zamanını güncelle"""
+    state = get_account_sync_state(account_name)
+
+    if new_emails or error:
+        idle_streak = 0
+        interval = MIN_POLL_INTERVAL
+    else:
+        idle_streak = state.get("idle_streak", 0) + 1
+        interval = min(IDLE_BACKOFF_BASE * 2 ** (idle_streak - 1), MAX_POLL_INTERVAL)
+
+    runs = state.get("runs", 0) + 1
+    state.update({
+        "last_run": frappe.utils.now(),
+        "last_duration": round(duration, 3),
+        "avg_duration": round(((state.get("avg_duration", 0) * (runs - 1)) + duration) / runs, 3),
+        "last_new_emails": new_emails,
+        "total_new_emails": state.get("total_new_emails", 0) + new_emails,
+        "runs": runs,
+        "idle_streak": idle_streak,
+        "next_poll_at": time.time() + interval,
+        "last_error": error,
+    })
+    frappe.cache.hset(SYNC_STATE_KEY, account_name, state)
+
+
+@frappe.whitelist()
+def get_email_sync_metrics():
+    """Server method: Hesap bazlı sync metrikleri"""
+    frappe.only_for("System Manager")
+    # RedisWrapper.hgetall anahtarları bytes döndürür (JSON yanıtı için decode)
+    return {frappe.safe_decode(account_name): state for account_name, state in frappe.cache.hgetall(SYNC_STATE_KEY).items()}
+
+
+@frappe.whitelist()
+def reset_email_sync_backoff(account_name=None):
+    """Server method: Backoff'u sıfırla, hesap(lar) bir sonraki turda hemen çekilsin"""
+    frappe.only_for("System Manager")
+    if account_name:
+        frappe.cache.hdel(SYNC_STATE_KEY, account_name)
+    else:
+        frappe.cache.delete_value(SYNC_STATE_KEY)
@@ -0,0 +1,298 @@
+"""
+Minimal asyncio IMAP istemcisi (IDLE listener için)
+
+Sadece listener'ın ihtiyaç duyduğu komutlar: LOGIN, SELECT, UID SEARCH,
+UID FETCH (BODY.PEEK[]), IDLE/DONE, NOOP, LOGOUT. Frappe'ye bağımlı değildir;
+invoice.tools.imap_stub ile yerel olarak test edilebilir.
+"""
+
+import asyncio
+import re
+import ssl
+
+# Sunucular IDLE'ı ~29 dk sonra kapatır; NAT zaman aşımlarından önce yenile (sn)
+IDLE_TIMEOUT = 5 * 60
+# Tek FETCH komutunda çekilen mesaj sayısı (bellek sınırı)
+FETCH_BATCH_SIZE = 20
+# Bağlantı koparsa yeniden bağlanma beklemesi (sn), her hatada ikiye katlanır
+RECONNECT_MIN_DELAY = 5
+RECONNECT_MAX_DELAY = 5 * 60
+# Backlog varken mesaj çekmeden önce bekleme (sn)
+PAUSE_DELAY = 10
+
+LITERAL_RE = re.compile(rb"\{(\d+)\}\r\n$")
+
+
+class ImapError(Exception):
+    pass
+
+
+def quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class ImapResponse:
+    """Tek bir untagged/tagged yanıt satırı; literal'ler ayrı tutulur"""
+
+    def __init__(self, text, literals):
+        self.text = text
+        self.literals = literals
+
+    def __repr__(self):
+        return f"ImapResponse({self.text!r}, {len(self.literals)} literal)"
+
+
+class ImapIdleClient:
+    """Tek mailbox için kalıcı IMAP bağlantısı"""
+
+    def __init__(self, host, port=993, use_ssl=True, timeout=60):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.tag_counter = 0
+        self.uidvalidity = None
+        self.uidnext = None
+        self.exists = None
+        # Komut yanıtlarında yeni EXISTS görüldü: IDLE'a girmeden önce tekrar senkronize et
+        self.saw_exists = False
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        context = ssl.create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context),
+            self.timeout
+        )
+        greeting = await self._read_line()
+        if not greeting.startswith(b"* OK") and not greeting.startswith(b"* PREAUTH"):
+            raise ImapError(f"Beklenmeyen karşılama: {greeting!r}")
+
+    async def login(self, user, password):
+        await self.command(f"LOGIN {quote(user)} {quote(password)}")
+
+    async def select(self, mailbox="INBOX"):
+        self.uidvalidity = self.uidnext = None
+        for response in await self.command(f"SELECT {quote(mailbox)}"):
+            text = response.text
+            if match := re.search(r"\[UIDVALIDITY (\d+)\]", text):
+                self.uidvalidity = int(match.group(1))
+            elif match := re.search(r"\[UIDNEXT (\d+)\]", text):
+                self.uidnext = int(match.group(1))
+        self.saw_exists = False
+
+    async def search_new_uids(self, last_uid):
+        """last_uid'den büyük UID'ler ("n:*" en büyük UID'i her zaman döndürür, filtrelenir)"""
+        uids = []
+        for response in await self.command(f"UID SEARCH UID {last_uid + 1}:*"):
+            if response.text.startswith("* SEARCH"):
+                uids.extend(int(uid) for uid in response.text.split()[2:])
+        return sorted(uid for uid in uids if uid > last_uid)
+
+    async def fetch_messages(self, uids):
+        """[(uid, raw_bytes)] - BODY.PEEK[] ile, \\Seen bayrağı değişmez"""
+        messages = []
+        for i in range(0, len(uids), FETCH_BATCH_SIZE):
+            uid_set = ",".join(str(uid) for uid in uids[i:i + FETCH_BATCH_SIZE])
+            for response in await self.command(f"UID FETCH {uid_set} (UID BODY.PEEK[])"):
+                match = re.search(r"\bUID (\d+)", response.text)
+                if " FETCH " in response.text and match and response.literals:
+                    messages.append((int(match.group(1)), response.literals[0]))
+        return sorted(messages)
+
+    async def idle(self, timeout=IDLE_TIMEOUT):
+        """IDLE'da bekle; yeni mesaj (EXISTS) gelirse True, süre dolarsa False"""
+        tag = await self._send("IDLE")
+        line = await self._read_line()
+        while not line.startswith(b"+"):
+            if line.startswith(tag.encode()):
+                raise ImapError(f"IDLE reddedildi: {line!r}")
+            self._track_untagged(line.decode(errors="replace"))
+            line = await self._read_line()
+
+        has_new = self.saw_exists
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not has_new:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                raise ConnectionError("IMAP bağlantısı kapandı")
+            has_new = self._track_untagged(line.decode(errors="replace"))
+
+        self.writer.write(b"DONE\r\n")
+        await self.writer.drain()
+        await self._read_until_tagged(tag)
+        return has_new or self.saw_exists
+
+    async def noop(self):
+        await self.command("NOOP")
+
+    async def logout(self):
+        if not self.connected:
+            return
+        try:
+            await asyncio.wait_for(self.command("LOGOUT"), 5)
+        except Exception:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def command(self, command):
+        tag = await self._send(command)
+        return await self._read_until_tagged(tag)
+
+    async def _send(self, command):
+        self.tag_counter += 1
+        tag = f"A{self.tag_counter:04d}"
+        self.writer.write(f"{tag} {command}\r\n".encode())
+        await self.writer.drain()
+        return tag
+
+    async def _read_until_tagged(self, tag):
+        responses = []
+        while True:
+            response = await self._read_response()
+            if response.text.startswith(f"{tag} "):
+                status = response.text.split(" ", 2)[1].upper()
+                if status != "OK":
+                    raise ImapError(response.text)
+                return responses
+            self._track_untagged(response.text)
+            responses.append(response)
+
+    async def _read_response(self):
+        """Satır + literal'ler ({n}\\r\\n ardından n byte) - tek mantıksal yanıt"""
+        parts, literals = [], []
+        while True:
+            line = await self._read_line()
+            match = LITERAL_RE.search(line)
+            if not match:
+                parts.append(line.rstrip(b"\r\n"))
+                break
+            parts.append(line[:match.start()])
+            literals.append(await asyncio.wait_for(self.reader.readexactly(int(match.group(1))), self.timeout))
+        return ImapResponse(b"".join(parts).decode(errors="replace"), literals)
+
+    async def _read_line(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise ConnectionError("IMAP bağlantısı kapandı")
+        return line
+
+    def _track_untagged(self, text):
+        match = re.match(r"\* (\d+) EXISTS", text)
+        if not match:
+            return False
+        count = int(match.group(1))
+        has_new = self.exists is None or count > self.exists
+        self.exists = count
+        self.saw_exists = self.saw_exists or has_new
+        return has_new
+
+
+class ImapIdleListener:
+    """Tek hesap için IDLE döngüsü: bağlan, sadece yeni UID'leri çek, handler'a ver
+
+    config: host, port, use_ssl, user, password, mailbox
+    on_messages(messages) -> None   : [(uid, raw_bytes)] (senkron, sırayla çağrılır)
+    on_state(state) -> None         : heartbeat / durum (uidvalidity, last_uid, connected, error)
+    is_paused() -> bool             : True iken mesaj çekmeyi ertele (backpressure)
+    on_gap() -> None                : UID takibi yeniden başladı, aradaki mesajlar poll ile alınmalı
+    """
+
+    def __init__(self, config, on_messages, on_state=None, is_paused=None, on_gap=None,
+            last_uid=None, uidvalidity=None, idle_timeout=IDLE_TIMEOUT):
+        self.config = config
+        self.on_messages = on_messages
+        self.on_state = on_state or (lambda state: None)
+        self.is_paused = is_paused or (lambda: False)
+        self.on_gap = on_gap or (lambda: None)
+        self.last_uid = last_uid
+        self.uidvalidity = uidvalidity
+        self.idle_timeout = idle_timeout
+        self.client = None
+        self.stopped = asyncio.Event()
+
+    async def run(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self.stopped.is_set():
+            try:
+                await self.connect()
+                delay = RECONNECT_MIN_DELAY
+                await self.listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.report(connected=False, error=str(e))
+                if self.client:
+                    self.client.close()
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        if self.client:
+            await self.client.logout()
+
+    def stop(self):
+        self.stopped.set()
+
+    async def connect(self):
+        config = self.config
+        self.client = ImapIdleClient(config["host"], config.get("port") or 993, config.get("use_ssl", True))
+        await self.client.connect()
+        await self.client.login(config["user"], config["password"])
+        await self.client.select(config.get("mailbox") or "INBOX")
+
+        # UIDVALIDITY değiştiyse eski UID'ler geçersiz: yeni mesajlardan başla
+        if self.last_uid is None or self.uidvalidity != self.client.uidvalidity:
+            self.uidvalidity = self.client.uidvalidity
+            self.last_uid = (self.client.uidnext or 1) - 1
+            self.on_gap()
+        self.report(connected=True, error=None)
+
+    async def listen(self):
+        has_new = True
+        while not self.stopped.is_set():
+            if has_new:
+                if self.is_paused():
+                    await asyncio.sleep(PAUSE_DELAY)
+                    await self.client.noop()
+                    continue
+                await self.sync()
+            has_new = await self.client.idle(self.idle_timeout)
+            self.report(connected=True)
+
+    async def sync(self):
+        """Yeni UID'leri çek ve handler'a ver; aradaki EXISTS'ler için tekrarla"""
+        while True:
+            self.client.saw_exists = False
+            uids = await self.client.search_new_uids(self.last_uid)
+            if uids:
+                messages = await self.client.fetch_messages(uids)
+                if messages:
+                    self.on_messages(messages)
+                self.last_uid = max(uids)
+                self.report(connected=True)
+            if not self.client.saw_exists:
+                return
+
+    def report(self, **state):
+        state.update({"uidvalidity": self.uidvalidity, "last_uid": self.last_uid})
+        self.on_state(state)
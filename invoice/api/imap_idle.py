@@ -0,0 +1,184 @@
+"""
+IMAP IDLE ile push tabanlı email alma (opsiyonel, uzun süre çalışan process)
+
+`bench --site <site> invoice-imap-idle` her uygun Email Account için kalıcı
+bir IMAP bağlantısı açar ve IDLE'da bekler. Yeni mesaj geldiğinde sadece yeni
+UID'ler çekilip Frappe'nin InboundMail'i ile Communication'a çevrilir; fatura
+pipeline'ı her zamanki gibi Communication hook'undan tetiklenir.
+
+Listener çalışan (heartbeat'i taze) hesaplar scheduler polling'inden çıkarılır;
+listener durursa polling kendiliğinden geri döner.
+"""
+
+import asyncio
+import email
+import time
+
+import frappe
+
+from invoice.api.imap_client import IDLE_TIMEOUT, ImapIdleListener
+from invoice.api.invoice_ingest import is_ingest_backlogged
+
+logger = frappe.logger("invoice.imap_idle", allow_site=frappe.local.site)
+
+IDLE_STATE_KEY = "invoice_imap_idle_state"
+# Heartbeat bu süreden eskiyse listener ölü sayılır, hesap tekrar poll edilir (sn)
+HEARTBEAT_TTL = 2 * IDLE_TIMEOUT + 60
+
+
+def get_idle_timeout():
+    return frappe.utils.cint(frappe.conf.get("invoice_imap_idle_timeout")) or IDLE_TIMEOUT
+
+
+def get_idle_accounts(account_names=None):
+    """IDLE ile dinlenebilecek hesaplar: IMAP, SSL, Basic auth (diğerleri polling'de kalır)"""
+    filters = {"enable_incoming": 1, "use_imap": 1}
+    if account_names:
+        filters["name"] = ["in", account_names]
+
+    accounts = []
+    for row in frappe.get_all("Email Account", filters=filters, fields=["name"]):
+        account = frappe.get_doc("Email Account", row.name)
+        if account.get("auth_method") == "OAuth" or not account.use_ssl:
+            print(f"[INVOICE] IMAP IDLE: {account.name} atlandı (OAuth / SSL'siz hesap polling ile alınır)")
+            logger.info(f"IMAP IDLE: {account.name} atlandı (OAuth / SSL'siz)")
+            continue
+        accounts.append(account)
+    return accounts
+
+
+def get_listener_config(account):
+    return {
+        "host": account.email_server,
+        "port": frappe.utils.cint(account.incoming_port) or 993,
+        "use_ssl": True,
+        "user": account.login_id if account.login_id_is_different else account.email_id,
+        "password": account.get_password(),
+        "mailbox": frappe.conf.get("invoice_imap_idle_mailbox") or "INBOX",
+    }
+
+
+def get_idle_state(account_name):
+    return frappe.cache.hget(IDLE_STATE_KEY, account_name) or {}
+
+
+def update_idle_state(account_name, state):
+    current = get_idle_state(account_name)
+    current.update(state)
+    current["heartbeat"] = time.time()
+    frappe.cache.hset(IDLE_STATE_KEY, account_name, current)
+
+
+def is_idle_listener_active(account_name):
+    """Hesap için çalışan bir IDLE listener var mı (scheduler polling'i atlar)"""
+    state = get_idle_state(account_name)
+    return bool(state.get("connected")) and time.time() - state.get("heartbeat", 0) < HEARTBEAT_TTL
+
+
+def ingest_imap_messages(account_name, messages):
+    """IDLE ile çekilen ham mesajları Communication'a çevir (Email Account.receive ile aynı yol)"""
+    from frappe.email.receive import InboundMail
+
+    ensure_db_connection()
+    email_account = frappe.get_doc("Email Account", account_name)
+    created = 0
+
+    for uid, raw in messages:
+        try:
+            message_id = get_message_id(raw)
+            if message_id and frappe.db.exists("Communication", {"message_id": message_id}):
+                continue
+
+            communication = InboundMail(raw, email_account, uid=uid, seen_status=0).process()
+            frappe.db.commit()
+            if communication:
+                created += 1
+
+        except Exception as e:
+            frappe.db.rollback()
+            print(f"[INVOICE] ❌ IMAP IDLE mesaj hatası ({account_name}, UID {uid}): {str(e)}")
+            logger.error(f"IMAP IDLE mesaj hatası ({account_name}, UID {uid}): {str(e)}")
+            frappe.log_error(
+                title=f"IMAP IDLE Ingest Error - {account_name}",
+                message=f"UID: {uid}\nError: {str(e)}\n{frappe.get_traceback()}"
+            )
+
+    print(f"[INVOICE] IMAP IDLE: {account_name} için {created} yeni email ({len(messages)} mesaj)")
+    logger.info(f"IMAP IDLE: {account_name}: {created} yeni email, {len(messages)} mesaj")
+
+
+def get_message_id(raw):
+    headers = email.message_from_bytes(raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n")
+    return (headers.get("Message-ID") or "").strip(" <>") or None
+
+
+def ensure_db_connection():
+    # Uzun süre boşta kalan process'te MariaDB bağlantısı düşmüş olabilir
+    try:
+        frappe.db.sql("select 1")
+    except Exception:
+        frappe.db.connect()
+
+
+def enqueue_catch_up_poll(account_name):
+    """UID takibi yeniden başladı: aradaki mesajları normal poll işi alsın"""
+    frappe.enqueue(
+        "invoice.api.email_tasks.sync_email_account",
+        queue="short",
+        timeout=600,
+        job_id=f"invoice_email_sync::{account_name}",
+        deduplicate=True,
+        account_name=account_name
+    )
+
+
+def build_listener(account, idle_timeout=None):
+    state = get_idle_state(account.name)
+    return ImapIdleListener(
+        get_listener_config(account),
+        on_messages=lambda messages: ingest_imap_messages(account.name, messages),
+        on_state=lambda new_state: update_idle_state(account.name, new_state),
+        is_paused=is_ingest_backlogged,
+        on_gap=lambda: enqueue_catch_up_poll(account.name),
+        last_uid=state.get("last_uid"),
+        uidvalidity=state.get("uidvalidity"),
+        idle_timeout=idle_timeout or get_idle_timeout(),
+    )
+
+
+async def run_listeners(listeners):
+    try:
+        await asyncio.gather(*(listener.run() for listener in listeners))
+    finally:
+        for listener in listeners:
+            listener.stop()
+
+
+def run_imap_idle_listener(account_names=None):
+    """Tüm uygun hesaplar için IDLE listener'ları çalıştır (bench komutu, bloklar)"""
+    accounts = get_idle_accounts(account_names)
+    if not accounts:
+        print("[INVOICE] IMAP IDLE: dinlenecek Email Account yok")
+        return
+
+    listeners = [build_listener(account) for account in accounts]
+    print(f"[INVOICE] IMAP IDLE başlatıldı: {', '.join(account.name for account in accounts)}")
+    logger.info(f"IMAP IDLE başlatıldı: {[account.name for account in accounts]}")
+    try:
+        asyncio.run(run_listeners(listeners))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for account in accounts:
+            update_idle_state(account.name, {"connected": False})
+
+
+@frappe.whitelist()
+def get_imap_idle_status():
+    """Server method: Hesap bazlı IDLE listener durumu"""
+    frappe.only_for("System Manager")
+    # RedisWrapper.hgetall anahtarları bytes döndürür
+    states = {frappe.safe_decode(account_name): state for account_name, state in frappe.cache.hgetall(IDLE_STATE_KEY).items()}
+    for account_name, state in states.items():
+        state["active"] = is_idle_listener_active(account_name)
+    return states
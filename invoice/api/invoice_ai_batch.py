@@ -0,0 +1,318 @@
+"""
+Toplu dosya (OpenAI Batch API) ile AI validation
+
+"Batch File" modundaki Invoice AI Validation Run'larında kural kontrolü /
+önbellekle sonuçlanmayan faturaların istekleri tek bir JSONL dosyasına yazılır,
+yüklenir ve tek bir batch olarak gönderilir (run: Submitted). Scheduler batch
+durumunu yoklar; tamamlanınca sonuç dosyası indirilir ve update_ai_validation_fields
+ile parça parça (parça başına tek commit) uygulanır.
+
+Batch routing'deki ilk (küçük) modelle gönderilir. Üst modele geçmesi gereken
+sonuçlar uygulama sırasında toplanır ve sıradaki modelle yeni bir batch olarak
+gönderilir (run Submitted kalır); uygulama işi model çağırmaz.
+
+Binlerce fatura birkaç API çağrısıyla doğrulanır; yanıt süresi önemli olmayan
+gece çalışmaları (start_nightly_ai_validation) için. Yerel deneme:
+invoice.tools.fake_openai batch endpoint'lerini de sunar.
+"""
+
+import json
+import os
+import tempfile
+
+import frappe
+
+from invoice.api.invoice_ai_validation import (
+    MAX_BATCH_SIZE,
+    VALIDATION_DOCTYPES,
+    VALIDATION_RUN_DOCTYPE,
+    VALIDATION_RUN_QUEUE,
+    VALIDATION_RUN_COUNTERS,
+    VALIDATION_RUN_TIMEOUT,
+    cache_validation_result,
+    count_model_usage,
+    count_validation_result,
+    get_completion_args,
+    get_openai_client,
+    get_remaining_invoices,
+    get_validation_request,
+    get_validation_routing,
+    prepare_validation_chunk,
+    publish_validation_progress,
+    record_validation_error,
+    route_validation_response,
+    update_ai_validation_fields,
+)
+
+logger = frappe.logger("invoice.ai_batch", allow_site=frappe.local.site)
+
+BATCH_MODE = "Batch File"
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# Hazırlık sırasında bir seferde okunan fatura sayısı
+PREPARE_CHUNK_SIZE = 100
+# Sonuçlar bu büyüklükte parçalarla yazılır (parça başına bir commit)
+APPLY_CHUNK_SIZE = 200
+# Bu durumlarda sonuç (kısmi de olsa) dosyası uygulanır
+BATCH_FINAL_STATUSES = ("completed", "expired", "cancelled")
+BATCH_FAILED_STATUSES = ("failed",)
+
+
+def submit_validation_batch(run):
+    """Run'ın kalan faturaları için istek dosyasını yaz, yükle ve batch'i başlat"""
+    remaining = get_remaining_invoices(run)
+    model = get_validation_routing()["models"][0]
+    requests = {}
+
+    def prepare():
+        for i in range(0, len(remaining), PREPARE_CHUNK_SIZE):
+            for invoice_doc, cache_key, messages in prepare_validation_chunk(run, remaining[i:i + PREPARE_CHUNK_SIZE]):
+                requests[invoice_doc.name] = {"cache_key": cache_key, "attempts": []}
+                yield invoice_doc.name, get_completion_args(messages, model)
+            # Kural / önbellek sonuçları parça parça kalıcı olsun
+            frappe.db.commit()
+
+    return send_validation_batch(run, prepare(), requests)
+
+
+def submit_escalation_batch(run, escalations, routing):
+    """Üst modele geçecek faturaları sıradaki modelle yeni bir batch olarak gönder
+
+    escalations: {fatura: {"cache_key", "attempts"}}; bir batch'teki tüm faturalar
+    aynı sayıda deneme yapmıştır, sıradaki model hepsi için aynıdır.
+    """
+    requests = {}
+
+    def prepare():
+        for name, request in escalations.items():
+            cache_key, result, messages = get_validation_request(frappe.get_doc(run.invoice_doctype, name), run.force)
+            if not messages:
+                # Bu arada önbelleğe girmiş sonuç
+                apply_validation_result(run, name, cache_key, result)
+                continue
+            requests[name] = request
+            yield name, get_completion_args(messages, routing["models"][len(request["attempts"])])
+
+    print(f"[INVOICE] AI validation: {len(escalations)} fatura üst modele gidiyor ({run.name})")
+    logger.info(f"AI validation: {len(escalations)} fatura üst modele gidiyor ({run.name})")
+    return send_validation_batch(run, prepare(), requests)
+
+
+def send_validation_batch(run, request_bodies, requests):
+    """(fatura, istek gövdesi) satırlarını JSONL dosyasına yaz, yükle ve batch'i başlat
+
+    requests satırlar yazılırken dolar; hiç istek yoksa run tamamlanır.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as batch_file:
+        for name, body in request_bodies:
+            batch_file.write(json.dumps({
+                "custom_id": name,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": body,
+            }, ensure_ascii=False) + "\n")
+
+    try:
+        if not requests:
+            return complete_validation_run(run)
+
+        client = get_openai_client()
+        with open(batch_file.name, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata={"run": run.name, "site": frappe.local.site}
+        )
+    finally:
+        os.unlink(batch_file.name)
+
+    run.model_calls = (run.model_calls or 0) + len(requests)
+    run.db_set({
+        "status": "Submitted",
+        "batch_id": batch.id,
+        "batch_status": batch.status,
+        "batch_requests": json.dumps(requests),
+        **{field: run.get(field) for field in VALIDATION_RUN_COUNTERS},
+    })
+    frappe.db.commit()
+    publish_validation_progress(run, force=True)
+    print(f"[INVOICE] AI validation batch gönderildi: {run.name} -> {batch.id} ({len(requests)} istek)")
+    logger.info(f"AI validation batch gönderildi: {run.name} -> {batch.id} ({len(requests)} istek)")
+    return run
+
+
+def poll_validation_batches():
+    """Scheduler (cron): gönderilmiş batch'lerin durumunu kontrol et, bitenleri uygula"""
+    runs = frappe.get_all(VALIDATION_RUN_DOCTYPE,
+        filters={"status": "Submitted", "mode": BATCH_MODE},
+        pluck="name"
+    )
+    if not runs:
+        return
+
+    client = get_openai_client()
+    for run_name in runs:
+        run = frappe.get_doc(VALIDATION_RUN_DOCTYPE, run_name)
+        try:
+            batch = client.batches.retrieve(run.batch_id)
+        except Exception as e:
+            logger.error(f"Batch durumu alınamadı ({run.name} / {run.batch_id}): {str(e)}")
+            continue
+
+        if batch.status != run.batch_status:
+            run.db_set("batch_status", batch.status)
+
+        if batch.status in BATCH_FINAL_STATUSES:
+            frappe.enqueue(
+                "invoice.api.invoice_ai_batch.apply_validation_batch",
+                queue=VALIDATION_RUN_QUEUE,
+                timeout=VALIDATION_RUN_TIMEOUT,
+                job_id=f"invoice_ai_validation_apply::{run.name}",
+                deduplicate=True,
+                enqueue_after_commit=True,
+                run_name=run.name
+            )
+        elif batch.status in BATCH_FAILED_STATUSES:
+            errors = getattr(batch.errors, "data", None) or []
+            fail_validation_run(run, "; ".join(error.message for error in errors[:3]) or f"Batch {batch.status}")
+    frappe.db.commit()
+
+
+def apply_validation_batch(run_name):
+    """Batch sonuç / hata dosyalarını uygula (tekrar çalıştırılabilir: uygulanmışlar atlanır)"""
+    run = frappe.get_doc(VALIDATION_RUN_DOCTYPE, run_name)
+    if run.status != "Submitted":
+        return run
+
+    client = get_openai_client()
+    batch = client.batches.retrieve(run.batch_id)
+    requests = {
+        name: request if isinstance(request, dict) else {"cache_key": request, "attempts": []}
+        for name, request in json.loads(run.batch_requests or "{}").items()
+    }
+    # Yarıda kalmış bir uygulamada yazılmış olanlar tekrar sayılmaz
+    pending = set(get_remaining_invoices(run)) & set(requests)
+
+    routing = get_validation_routing()
+    escalations = {}
+
+    lines = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            lines.extend(client.files.content(file_id).text.splitlines())
+
+    for i in range(0, len(lines), APPLY_CHUNK_SIZE):
+        for line in lines[i:i + APPLY_CHUNK_SIZE]:
+            if line.strip():
+                apply_batch_line(run, json.loads(line), requests, pending, routing, escalations)
+        frappe.db.commit()
+
+    # Sonucu gelmeyen istekler (süre doldu / iptal)
+    for name in sorted(pending):
+        record_validation_error(run.invoice_doctype, name, f"Batch sonucu yok ({batch.status})", commit=False)
+        count_validation_result(run, "Error")
+
+    if escalations:
+        return submit_escalation_batch(run, escalations, routing)
+
+    complete_validation_run(run, batch_status=batch.status)
+    return run
+
+
+def apply_batch_line(run, line, requests, pending, routing, escalations):
+    """Batch yanıtını uygula; üst modele geçmesi gerekiyorsa escalations'a ekle"""
+    name = line.get("custom_id")
+    if name not in pending:
+        return
+    pending.discard(name)
+    request = requests[name]
+
+    try:
+        response = line.get("response") or {}
+        error = None
+        if line.get("error") or response.get("status_code") != 200:
+            error = line.get("error") or (response.get("body") or {}).get("error") or {}
+            error = ValueError(error.get("message") or f"HTTP {response.get('status_code')}")
+
+        attempts = list(request["attempts"])
+        # Batch'te gecikme yok sayılır (sonuç saatler sonra gelir)
+        model = routing["models"][min(len(attempts), len(routing["models"]) - 1)]
+        result = route_validation_response(attempts, routing, model, None, response.get("body"), error)
+        if result is None:
+            escalations[name] = {"cache_key": request["cache_key"], "attempts": attempts}
+            return
+        apply_validation_result(run, name, request["cache_key"], result)
+    except Exception as e:
+        record_validation_error(run.invoice_doctype, name, e, commit=False)
+        count_validation_result(run, "Error")
+
+
+def apply_validation_result(run, name, cache_key, result):
+    if cache_key:
+        cache_validation_result(cache_key, result)
+    update_ai_validation_fields(frappe._dict(doctype=run.invoice_doctype, name=name), result, commit=False)
+    count_model_usage(run, result)
+    count_validation_result(run, result.get("status"))
+
+
+def complete_validation_run(run, batch_status=None):
+    values = {field: run.get(field) for field in VALIDATION_RUN_COUNTERS}
+    values.update({"status": "Completed", "finished_at": frappe.utils.now()})
+    if batch_status:
+        values["batch_status"] = batch_status
+    run.db_set(values)
+    frappe.db.commit()
+    publish_validation_progress(run, force=True)
+    print(f"[INVOICE] AI validation run tamamlandı: {run.name} ({run.processed}/{run.total})")
+    logger.info(f"AI validation run tamamlandı: {run.name} ({run.processed}/{run.total})")
+    return run
+
+
+def fail_validation_run(run, error):
+    run.db_set({"status": "Failed", "error": str(error)[:1000]})
+    publish_validation_progress(run, force=True)
+    logger.error(f"AI validation batch başarısız: {run.name}: {error}")
+
+
+def start_nightly_ai_validation():
+    """Scheduler (gece): doğrulanmamış / hata almış faturalar için Batch File run'ları başlat
+
+    site_config: invoice_ai_nightly_validation = 1 ile açılır.
+    """
+    from invoice.api.invoice_ai_validation import enqueue_validation_run
+
+    if not frappe.utils.cint(frappe.conf.get("invoice_ai_nightly_validation", 0)):
+        return
+
+    for doctype in VALIDATION_DOCTYPES:
+        if frappe.db.exists(VALIDATION_RUN_DOCTYPE, {
+            "invoice_doctype": doctype,
+            "status": ["in", ["Queued", "Running", "Submitted"]],
+        }):
+            continue
+
+        names = frappe.get_all(doctype,
+            or_filters=[
+                ["ai_validation_status", "in", ["Not Checked", "Error"]],
+                ["ai_validation_status", "is", "not set"],
+            ],
+            pluck="name",
+            order_by="creation asc",
+            limit=MAX_BATCH_SIZE
+        )
+        if not names:
+            continue
+
+        run = frappe.get_doc({
+            "doctype": VALIDATION_RUN_DOCTYPE,
+            "invoice_doctype": doctype,
+            "mode": BATCH_MODE,
+            "invoices": json.dumps(names),
+            "total": len(names),
+        }).insert(ignore_permissions=True)
+        enqueue_validation_run(run.name)
+        print(f"[INVOICE] Gece AI validation: {doctype} için {len(names)} fatura ({run.name})")
+        logger.info(f"Gece AI validation: {doctype} için {len(names)} fatura ({run.name})")
+    frappe.db.commit()
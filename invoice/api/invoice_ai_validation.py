@@ -2,24 +2,117 @@ import frappe
 import json
 import os
 import base64
+import asyncio
+import hashlib
+import time
+
+from invoice.api.invoice_prevalidation import (
+    build_prevalidation_result,
+    format_failed_checks,
+    is_prevalidation_enabled,
+    run_prevalidation,
+)
+from invoice.api.invoice_schema import get_invoice_schema
+from invoice.api.invoice_text_compaction import compact_raw_text, get_token_budget
 
 try:
-    from openai import OpenAI
+    import httpx
+    from openai import AsyncOpenAI, OpenAI
 except ImportError:
-    OpenAI = None
+    httpx = AsyncOpenAI = OpenAI = None
 
 logger = frappe.logger("invoice.ai_validation", allow_site=frappe.local.site)
 
-def get_openai_client():
-    """OpenAI client oluştur"""
+VALIDATION_DOCTYPES = ("Lieferando Invoice", "Wolt Invoice", "Uber Eats Invoice")
+
+# Batch validation (Invoice AI Validation Run)
+VALIDATION_RUN_DOCTYPE = "Invoice AI Validation Run"
+VALIDATION_RUN_QUEUE = "long"
+VALIDATION_RUN_TIMEOUT = 3600
+# Bir iş bu süreden sonra sayaçları kaydedip kendini tekrar kuyruğa ekler (sn)
+VALIDATION_RUN_SLICE = VALIDATION_RUN_TIMEOUT - 300
+# Aynı anda yapılan model çağrısı; site_config: invoice_ai_validation_concurrency
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+# Filtre ile başlatılan run'da en fazla bu kadar fatura
+MAX_BATCH_SIZE = 5000
+# Run'da checkpoint'te kaydedilen sayaçlar
+VALIDATION_RUN_COUNTERS = ("processed", "valid", "issues_found", "errors", "model_calls", "escalations", "tokens")
+VALIDATION_PROGRESS_EVENT = "invoice_ai_validation_progress"
+# İki ilerleme event'i arasındaki en kısa süre (sn)
+VALIDATION_PROGRESS_INTERVAL = 1
+
+VALIDATION_MODEL = "gpt-4o"  # veya "gpt-4-turbo"
+# Model routing: önce küçük / hızlı model; "Issues Found", düşük confidence veya
+# parse edilemeyen yanıtta bir sonraki modele geçilir.
+# site_config: invoice_ai_validation_models (liste veya "a,b"; tek model = routing kapalı)
+VALIDATION_MODELS = ("gpt-4o-mini", VALIDATION_MODEL)
+# Son model dışında bu confidence'ın altı üst modele gider; site_config: invoice_ai_escalation_confidence
+ESCALATION_CONFIDENCE = 0.85
+# Prompt metni / mesaj yapısı değişince artırılmalı (eski önbellek sonuçları kullanılmaz)
+PROMPT_VERSION = 3
+# site_config: invoice_openai_timeout / invoice_openai_max_retries
+OPENAI_TIMEOUT = 120
+OPENAI_MAX_RETRIES = 2
+# Boştaki bağlantı bu süre açık tutulur (sn)
+OPENAI_KEEPALIVE = 30
+
+# Sonuç önbelleği (Redis): anahtar = hash(hazırlanan veri, raw text, prompt sürümü, routing)
+RESULT_CACHE_KEY = "invoice_ai_validation_result"
+RESULT_CACHE_INDEX_KEY = "invoice_ai_validation_result_index"
+# site_config: invoice_ai_validation_cache_ttl (0 = kapalı) / invoice_ai_validation_cache_size
+RESULT_CACHE_TTL = 30 * 24 * 60 * 60
+RESULT_CACHE_SIZE = 5000
+
+# Process genelinde paylaşılan sync client'lar; anahtar: (api_key, base_url)
+_openai_clients = {}
+
+
+def get_openai_settings():
     if OpenAI is None:
         frappe.throw("OpenAI paketi yüklü değil. Lütfen 'pip install openai' komutu ile yükleyin.")
-    
-    api_key = frappe.conf.get("openai_api_key") or os.getenv("OPENAI_API_KEY")
 
+    api_key = frappe.conf.get("openai_api_key") or os.getenv("OPENAI_API_KEY")
     if not api_key:
         frappe.throw("OpenAI API key bulunamadı. Lütfen 'openai_api_key' site config'e ekleyin veya OPENAI_API_KEY environment variable'ı ayarlayın.")
-    return OpenAI(api_key=api_key)
+
+    return {
+        "api_key": api_key,
+        # Proxy veya yerel test sunucusu (invoice.tools.fake_openai) için; site_config: invoice_openai_base_url
+        "base_url": frappe.conf.get("invoice_openai_base_url") or os.getenv("OPENAI_BASE_URL") or None,
+        "timeout": frappe.utils.flt(frappe.conf.get("invoice_openai_timeout", OPENAI_TIMEOUT)),
+        "max_retries": frappe.utils.cint(frappe.conf.get("invoice_openai_max_retries", OPENAI_MAX_RETRIES)),
+    }
+
+
+def get_http_limits(max_connections=MAX_CONCURRENCY):
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=OPENAI_KEEPALIVE
+    )
+
+
+def get_openai_client():
+    """Process genelinde tek OpenAI client (bağlantılar keep-alive ile tekrar kullanılır)"""
+    settings = get_openai_settings()
+    key = (settings["api_key"], settings["base_url"])
+    client = _openai_clients.get(key)
+    if client is None:
+        client = _openai_clients[key] = OpenAI(
+            **settings,
+            http_client=httpx.Client(limits=get_http_limits(), timeout=settings["timeout"])
+        )
+    return client
+
+
+def get_async_openai_client(concurrency=DEFAULT_CONCURRENCY):
+    """Async client; bağlantı havuzu event loop'a bağlıdır, loop kapanmadan önce close() edilmeli"""
+    settings = get_openai_settings()
+    return AsyncOpenAI(
+        **settings,
+        http_client=httpx.AsyncClient(limits=get_http_limits(concurrency), timeout=settings["timeout"])
+    )
 
 def get_pdf_file_doc(invoice_doc):
     """Invoice'ın PDF File doc'unu bul"""
@@ -53,48 +146,50 @@ def get_pdf_file_doc(invoice_doc):
 
 def prepare_invoice_data_for_ai(invoice_doc):
     """Invoice DocType verilerini AI'ya göndermek için hazırla"""
-    doctype = invoice_doc.doctype
     data = {}
-    meta = frappe.get_meta(doctype)
     
-    default_only_fields = ['supplier_email', 'supplier_phone']  
-    
-    for field in meta.fields:
-        fieldname = field.fieldname
-        if fieldname in ['name', 'doctype', 'owner', 'creation', 'modified', 'modified_by']:
-            continue
-        if field.fieldtype in ['Section Break', 'Column Break', 'Tab Break']:
-            continue
-        if field.fieldtype == 'Attach':
-            continue 
-        if field.hidden:
-            continue
-        
+    # Alan listesi ve hariç tutma kuralları DocType başına bir kez hesaplanıp cache'lenir
+    for fieldname, default_only in get_invoice_schema(invoice_doc.doctype)["ai_fields"]:
         value = invoice_doc.get(fieldname)
         if value is not None and value != "":
         
-            if fieldname in default_only_fields and field.default and str(value) == str(field.default):
+            if default_only and str(value) == str(default_only):
                 data[fieldname] = f"{str(value)} (default - PDF'te olmayabilir)"
             else:
                 data[fieldname] = str(value) if not isinstance(value, (dict, list)) else json.dumps(value)
     
     return data
 
-def validate_invoice_with_ai(invoice_doctype, invoice_name):
-    """Invoice'ı OpenAI ile doğrula"""
-    try:
-        invoice_doc = frappe.get_doc(invoice_doctype, invoice_name)
-        
-        # Invoice verilerini hazırla
+def get_validation_request(invoice_doc, force=False):
+    """(cache_key, hazır sonuç, mesajlar)
+
+    Sırayla: kural kontrolü tutarsa (cache_key None) veya önbellekte sonuç varsa
+    mesajlar hazırlanmaz. force: ikisi de atlanır, model her zaman çağrılır.
+    """
+    prevalidation = None
+    if not force and is_prevalidation_enabled():
+        prevalidation = run_prevalidation(invoice_doc)
+        if prevalidation["passed"]:
+            return None, build_prevalidation_result(prevalidation), None
+
+    invoice_data = prepare_invoice_data_for_ai(invoice_doc)
+    cache_key = get_validation_cache_key(invoice_doc, invoice_data)
+    cached = None if force else get_cached_validation(cache_key)
+    if cached:
+        # Model bu sefer çağrılmadı (gecikme / token 0 yazılır); routing ilk çağrınınki
+        return cache_key, dict(cached, method="cache"), None
+    return cache_key, None, build_validation_messages(invoice_doc, invoice_data, prevalidation)
+
+
+def build_validation_messages(invoice_doc, invoice_data=None, prevalidation=None):
+    """Model'e gönderilecek mesajları hazırla (DB okumaları burada, model çağrısı dışında)"""
+    if invoice_data is None:
         invoice_data = prepare_invoice_data_for_ai(invoice_doc)
-        
-        # OpenAI client
-        client = get_openai_client()
-        
-        # Prompt hazırla (English for AI, results will be in Turkish)
-        prompt = f"""You are an invoice validation expert. Compare the invoice data in JSON format below with the PDF content and perform accuracy validation.
 
-Invoice DocType: {invoice_doctype}
+    # Prompt hazırla (English for AI, results will be in Turkish)
+    prompt = f"""You are an invoice validation expert. Compare the invoice data in JSON format below with the PDF content and perform accuracy validation.
+
+Invoice DocType: {invoice_doc.doctype}
 Invoice Number: {invoice_doc.invoice_number}
 
 Invoice data (extracted from DocType):
@@ -137,81 +232,262 @@ Response format (JSON):
 
 IMPORTANT: Provide response in JSON format only, no additional text. The summary and recommendations should be in Turkish."""
 
-        # PDF raw text'i al (PDF gönderimi yerine metin kullanıyoruz; API PDF'i image olarak kabul etmiyor)
-        raw_text = invoice_doc.get("raw_text", "")
-        if not raw_text:
-            frappe.throw("PDF raw text bulunamadı. Önce fatura işlenmiş olmalı.")
-        
-        # OpenAI API çağrısı - PDF text'i ile analiz
-        messages = [
-            {
-                "role": "system",
-                "content": "You are an invoice validation expert. You compare PDF text with DocType data and perform accuracy analysis. Provide responses in Turkish for summary and recommendations fields, but use English for technical terms and field names."
-            },
-            {
-                "role": "user",
-                "content": f"""{prompt}
+    if prevalidation and prevalidation["failed"]:
+        prompt += f"""
+
+Deterministic arithmetic checks on the DocType data FAILED (verify these fields against the PDF first):
+{format_failed_checks(prevalidation)}"""
+
+    # PDF raw text'i al (PDF gönderimi yerine metin kullanıyoruz; API PDF'i image olarak kabul etmiyor)
+    raw_text = invoice_doc.get("raw_text", "")
+    if not raw_text:
+        frappe.throw("PDF raw text bulunamadı. Önce fatura işlenmiş olmalı.")
 
-PDF Text (Raw):
-{raw_text[:15000]}  # Max 15000 chars
+    return [
+        {
+            "role": "system",
+            "content": "You are an invoice validation expert. You compare PDF text with DocType data and perform accuracy analysis. Provide responses in Turkish for summary and recommendations fields, but use English for technical terms and field names."
+        },
+        {
+            "role": "user",
+            "content": f"""{prompt}
+
+PDF Text (lines relevant to the fields above; "[...]" marks omitted lines):
+{compact_raw_text(invoice_doc, raw_text)}
 """
-            }
-        ]
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",  # veya "gpt-4-turbo"
-            messages=messages,
-            temperature=0.3,
-            max_tokens=2000
-        )
-        
-        response_text = response.choices[0].message.content.strip()
-        
-        # JSON'u parse et
+        }
+    ]
+
+
+def get_validation_routing():
+    """{"models": denenecek modeller (sırayla), "min_confidence": üst modele geçiş eşiği}"""
+    models = frappe.conf.get("invoice_ai_validation_models") or VALIDATION_MODELS
+    if isinstance(models, str):
+        models = [model.strip() for model in models.split(",") if model.strip()]
+    return {
+        "models": tuple(models),
+        "min_confidence": frappe.utils.flt(frappe.conf.get("invoice_ai_escalation_confidence", ESCALATION_CONFIDENCE)),
+    }
+
+
+def get_completion_args(messages, model=VALIDATION_MODEL):
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.3,
+        "max_tokens": 2000,
+    }
+
+
+def request_validation(client, messages, routing=None, attempts=None):
+    """Model çağrısı + yanıt parse, gerekirse üst modele geçerek (routing verilirse frappe kullanmaz)
+
+    attempts: önceki denemeler (ör. Batch API yanıtı); routing'de kalan modellerle devam edilir.
+    """
+    routing = routing or get_validation_routing()
+    attempts = [] if attempts is None else attempts
+    for model in routing["models"][len(attempts):]:
+        started = time.perf_counter()
+        response = error = None
         try:
-            # Eğer yanıt ```json ... ``` formatındaysa temizle
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            validation_result = json.loads(response_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"AI yanıtı parse edilemedi: {response_text}")
-            frappe.throw(f"AI yanıtı parse edilemedi: {str(e)}")
-        
+            response = client.chat.completions.create(**get_completion_args(messages, model))
+        except Exception as e:
+            error = e
+        result = route_validation_response(attempts, routing, model, get_latency_ms(started), response, error)
+        if result is not None:
+            return result
+
+
+async def request_validation_async(client, messages, semaphore, routing=None):
+    """request_validation'ın async hali; aynı anda en fazla semaphore kadar çağrı"""
+    routing = routing or get_validation_routing()
+    attempts = []
+    for model in routing["models"]:
+        async with semaphore:
+            started = time.perf_counter()
+            response = error = None
+            try:
+                response = await client.chat.completions.create(**get_completion_args(messages, model))
+            except Exception as e:
+                error = e
+        result = route_validation_response(attempts, routing, model, get_latency_ms(started), response, error)
+        if result is not None:
+            return result
+
+
+def get_latency_ms(started):
+    return round((time.perf_counter() - started) * 1000)
+
+
+def route_validation_response(attempts, routing, model, latency_ms, response=None, error=None):
+    """Bir modelin yanıtını değerlendir: sonuç veya (üst modele geçilecekse) None
+
+    response: chat completion (SDK nesnesi veya Batch API'deki dict). Son modelde
+    hata / parse edilemeyen yanıt yükseltilir; sonuca tüm denemeler "routing" olarak eklenir.
+    """
+    attempt = {"model": model, "latency_ms": latency_ms}
+    attempt.update(get_usage_tokens(response))
+    attempts.append(attempt)
+    final = len(attempts) >= len(routing["models"])
+
+    try:
+        if error:
+            raise error
+        result = parse_validation_response(get_response_content(response).strip())
+    except Exception as e:
+        if final:
+            raise
+        attempt["escalation"] = str(e)[:200]
+        return None
+
+    reason = None if final else get_escalation_reason(result, routing["min_confidence"])
+    if reason:
+        attempt["escalation"] = reason
+        return None
+
+    result["routing"] = attempts
+    return result
+
+
+def get_escalation_reason(validation_result, min_confidence):
+    status = validation_result.get("status")
+    if status != "Valid":
+        return f"Status: {status}"
+    confidence = frappe.utils.flt(validation_result.get("confidence"))
+    if confidence < min_confidence:
+        return f"Düşük confidence ({confidence:g} < {min_confidence:g})"
+    return None
+
+
+def get_response_content(response):
+    if isinstance(response, dict):
+        return response["choices"][0]["message"]["content"]
+    return response.choices[0].message.content
+
+
+def get_usage_tokens(response):
+    usage = response.get("usage") if isinstance(response, dict) else getattr(response, "usage", None)
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0}
+    if not isinstance(usage, dict):
+        usage = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+    return {"prompt_tokens": usage.get("prompt_tokens") or 0, "completion_tokens": usage.get("completion_tokens") or 0}
+
+
+def parse_validation_response(response_text):
+    """Model yanıtındaki JSON'u çıkar; parse edilemezse ValueError"""
+    # Eğer yanıt ```json ... ``` formatındaysa temizle
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"AI yanıtı parse edilemedi: {str(e)}\n{response_text[:500]}")
+
+
+def get_validation_cache_key(invoice_doc, invoice_data, routing=None):
+    routing = routing or get_validation_routing()
+    payload = json.dumps({
+        "doctype": invoice_doc.doctype,
+        "data": invoice_data,
+        "raw_text": invoice_doc.get("raw_text") or "",
+        "prompt_version": PROMPT_VERSION,
+        "token_budget": get_token_budget(),
+        "models": list(routing["models"]),
+        "min_confidence": routing["min_confidence"],
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_result_cache_ttl():
+    return frappe.utils.cint(frappe.conf.get("invoice_ai_validation_cache_ttl", RESULT_CACHE_TTL))
+
+
+def get_cached_validation(cache_key):
+    if get_result_cache_ttl() <= 0:
+        return None
+    # expires=True: sonuç request-local cache'e alınmaz, TTL'i Redis yönetir
+    return frappe.cache.get_value(f"{RESULT_CACHE_KEY}:{cache_key}", expires=True)
+
+
+def cache_validation_result(cache_key, validation_result):
+    """Sonucu önbelleğe yaz; en fazla invoice_ai_validation_cache_size kayıt (en eskiler silinir)"""
+    ttl = get_result_cache_ttl()
+    if ttl <= 0 or validation_result.get("status") not in ("Valid", "Issues Found"):
+        return
+
+    frappe.cache.set_value(f"{RESULT_CACHE_KEY}:{cache_key}", validation_result, expires_in_sec=ttl)
+
+    # Index: cache_key -> yazılma zamanı (boyut sınırı için)
+    now = time.time()
+    index_key = frappe.cache.make_key(RESULT_CACHE_INDEX_KEY)
+    pipe = frappe.cache.pipeline()
+    pipe.zadd(index_key, {cache_key: now})
+    pipe.zremrangebyscore(index_key, 0, now - ttl)
+    pipe.zcard(index_key)
+    pipe.expire(index_key, ttl)
+    _added, _expired, size, _ttl = pipe.execute()
+
+    excess = size - frappe.utils.cint(frappe.conf.get("invoice_ai_validation_cache_size", RESULT_CACHE_SIZE))
+    if excess > 0:
+        pipe.zrange(index_key, 0, excess - 1)
+        pipe.zremrangebyrank(index_key, 0, excess - 1)
+        evicted, _removed = pipe.execute()
+        frappe.cache.delete_value([f"{RESULT_CACHE_KEY}:{frappe.safe_decode(key)}" for key in evicted])
+
+
+def validate_invoice_with_ai(invoice_doctype, invoice_name, force=False):
+    """Invoice'ı OpenAI ile doğrula (force: önbelleği atla)"""
+    try:
+        invoice_doc = frappe.get_doc(invoice_doctype, invoice_name)
+        cache_key, validation_result, messages = get_validation_request(invoice_doc, force)
+
+        if validation_result is None:
+            # OpenAI API çağrısı - PDF text'i ile analiz
+            validation_result = request_validation(get_openai_client(), messages)
+            cache_validation_result(cache_key, validation_result)
+
         # Sonuçları invoice'a kaydet
         update_ai_validation_fields(invoice_doc, validation_result)
-        
-        return validation_result
+
+        return dict(validation_result, cached=messages is None and cache_key is not None)
         
     except Exception as e:
-        logger.error(f"AI validation hatası: {str(e)}\n{frappe.get_traceback()}")
-        frappe.log_error(
-            title="AI Validation Error",
-            message=f"Invoice: {invoice_doctype} / {invoice_name}\nError: {str(e)}\n{frappe.get_traceback()}"
-        )
-        
-        # Hata durumunda status'u güncelle (submit edilmiş invoice'larda da çalışması için set_value kullan)
-        try:
-            frappe.db.set_value(invoice_doctype, invoice_name, {
-                "ai_validation_status": "Error",
-                "ai_validation_summary": f"Error: {str(e)}"[:200],
-                "ai_validation_date": frappe.utils.now()
-            }, update_modified=False)
-            frappe.db.commit()
-        except Exception as update_error:
-            logger.error(f"Error field update hatası: {str(update_error)}")
-        
+        record_validation_error(invoice_doctype, invoice_name, e)
         frappe.throw(f"AI validation hatası: {str(e)}")
 
-def update_ai_validation_fields(invoice_doc, validation_result):
-    """AI validation sonuçlarını invoice alanlarına yaz"""
+
+def record_validation_error(invoice_doctype, invoice_name, error, commit=True):
+    """Hatayı logla ve invoice'ın AI validation durumunu Error yap"""
+    logger.error(f"AI validation hatası: {str(error)}\n{frappe.get_traceback()}")
+    frappe.log_error(
+        title="AI Validation Error",
+        message=f"Invoice: {invoice_doctype} / {invoice_name}\nError: {str(error)}\n{frappe.get_traceback()}"
+    )
+    
+    # Hata durumunda status'u güncelle (submit edilmiş invoice'larda da çalışması için set_value kullan)
+    try:
+        frappe.db.set_value(invoice_doctype, invoice_name, {
+            "ai_validation_status": "Error",
+            "ai_validation_summary": f"Error: {str(error)}"[:200],
+            "ai_validation_date": frappe.utils.now()
+        }, update_modified=False)
+        if commit:
+            frappe.db.commit()
+    except Exception as update_error:
+        logger.error(f"Error field update hatası: {str(update_error)}")
+
+def update_ai_validation_fields(invoice_doc, validation_result, commit=True):
+    """AI validation sonuçlarını invoice alanlarına yaz (commit=False: toplu yazımda çağıran commit eder)"""
     status = validation_result.get("status", "Error")
     summary = validation_result.get("summary", "")[:200]  # Max 200 karakter
     confidence = (validation_result.get("confidence", 0) * 100) if validation_result.get("confidence") else None
     result_json = json.dumps(validation_result, indent=2, ensure_ascii=False)
     validation_date = frappe.utils.now()
+    model, latency_ms, tokens = get_routing_summary(validation_result)
     
     # Submit edilmiş invoice'larda da çalışması için set_value kullan
     frappe.db.set_value(invoice_doc.doctype, invoice_doc.name, {
@@ -219,24 +495,46 @@ def update_ai_validation_fields(invoice_doc, validation_result):
         "ai_validation_summary": summary,
         "ai_validation_confidence": confidence,
         "ai_validation_result": result_json,
-        "ai_validation_date": validation_date
+        "ai_validation_date": validation_date,
+        "ai_validation_model": model,
+        "ai_validation_latency": latency_ms,
+        "ai_validation_tokens": tokens
     }, update_modified=False)
-    frappe.db.commit()
+    if commit:
+        frappe.db.commit()
+
+def get_routing_summary(validation_result):
+    """(model(ler), toplam gecikme ms, toplam token); kural / önbellek sonucunda model çağrılmadı"""
+    routing = validation_result.get("routing") or []
+    models = " → ".join(attempt["model"] for attempt in routing)
+    method = validation_result.get("method")
+    if method:
+        return (f"{method} ({models})" if models else method), 0, 0
+    return (
+        models,
+        sum(attempt.get("latency_ms") or 0 for attempt in routing),
+        sum((attempt.get("prompt_tokens") or 0) + (attempt.get("completion_tokens") or 0) for attempt in routing),
+    )
+
 
 @frappe.whitelist()
-def recheck_invoice_with_ai(doctype, name, show_message=True):
+def recheck_invoice_with_ai(doctype, name, show_message=True, force=False):
     """Server method: Invoice'ı AI ile tekrar kontrol et
     
     Args:
         doctype: Invoice doctype
         name: Invoice name
         show_message: If True, show success message (default: True)
+        force: If True, bypass the result cache and call the model (default: False)
     """
     try:
-        result = validate_invoice_with_ai(doctype, name)
+        result = validate_invoice_with_ai(doctype, name, force=frappe.utils.cint(force))
         if show_message:
             frappe.msgprint(
-                f"AI Validation tamamlandı: {result.get('status')} (Confidence: {result.get('confidence', 0)*100:.1f}%)",
+                f"AI Validation tamamlandı: {result.get('status')} (Confidence: {result.get('confidence', 0)*100:.1f}%)"
+                + (" - önbellekten" if result.get("cached") else "")
+                + (" - kural kontrolü" if result.get("method") == "rules" else "")
+                + (f" - {get_routing_summary(result)[0]}" if not result.get("method") and result.get("routing") else ""),
                 indicator="green" if result.get("status") == "Valid" else "orange"
             )
         return result
@@ -245,3 +543,256 @@ def recheck_invoice_with_ai(doctype, name, show_message=True):
             frappe.msgprint(f"Hata: {str(e)}", indicator="red")
         frappe.throw(str(e))
 
+
+def get_validation_concurrency():
+    return frappe.utils.cint(frappe.conf.get("invoice_ai_validation_concurrency", DEFAULT_CONCURRENCY))
+
+
+@frappe.whitelist()
+def start_batch_ai_validation(doctype, names=None, filters=None, concurrency=None, force=None, mode=None):
+    """Server method: seçili (veya filtreyle eşleşen) faturaları arka planda doğrula, run adını döndür
+
+    mode: "Realtime" (varsayılan, eşzamanlı model çağrıları) veya "Batch File" (OpenAI Batch API)
+    """
+    if doctype not in VALIDATION_DOCTYPES:
+        frappe.throw(f"Desteklenmeyen DocType: {doctype}")
+    if not frappe.has_permission(doctype, "write"):
+        frappe.throw(f"{doctype} için yetkiniz yok", frappe.PermissionError)
+
+    names = frappe.parse_json(names) if names else None
+    filters = frappe.parse_json(filters) if filters else None
+    if not names:
+        # get_list: kullanıcının görebildiği faturalar
+        names = frappe.get_list(doctype, filters=filters, pluck="name", limit_page_length=MAX_BATCH_SIZE)
+    if not names:
+        frappe.throw("Doğrulanacak fatura bulunamadı")
+
+    run = frappe.get_doc({
+        "doctype": VALIDATION_RUN_DOCTYPE,
+        "invoice_doctype": doctype,
+        "filters": json.dumps(filters) if filters else None,
+        "invoices": json.dumps(list(dict.fromkeys(names))),
+        "total": len(set(names)),
+        "concurrency": concurrency,
+        "force": frappe.utils.cint(force),
+        "mode": mode or "Realtime",
+    }).insert(ignore_permissions=True)
+    enqueue_validation_run(run.name)
+    return run.name
+
+
+@frappe.whitelist()
+def resume_batch_ai_validation(run_name):
+    """Server method: yarıda kalan / hata alan run'ı kaldığı yerden devam ettir"""
+    run = frappe.get_doc(VALIDATION_RUN_DOCTYPE, run_name)
+    if not frappe.has_permission(run.invoice_doctype, "write"):
+        frappe.throw(f"{run.invoice_doctype} için yetkiniz yok", frappe.PermissionError)
+    if run.status == "Completed":
+        frappe.throw(f"Run zaten tamamlanmış: {run_name}")
+    if run.status == "Submitted":
+        frappe.throw(f"Run'ın batch sonuçları bekleniyor: {run_name}")
+    run.db_set("status", "Queued")
+    enqueue_validation_run(run.name)
+    return run.name
+
+
+@frappe.whitelist()
+def get_batch_ai_validation_status(run_name):
+    """Server method: run sayaçları (realtime bağlantısı yoksa polling için)"""
+    run = frappe.get_doc(VALIDATION_RUN_DOCTYPE, run_name)
+    if not frappe.has_permission(run.invoice_doctype, "read"):
+        frappe.throw(f"{run.invoice_doctype} için yetkiniz yok", frappe.PermissionError)
+    return get_validation_progress(run)
+
+
+def enqueue_validation_run(run_name, continuation=None):
+    """Run işini kuyruğa ekle
+
+    continuation: çalışan işin kendi devamı (işlenen fatura sayısı). Frappe
+    deduplicate'i enqueue anında kontrol eder ve çalışan aynı job_id'li iş varken
+    devam işini düşürür; devam işi ayrı job_id alır ve dedupe edilmez.
+    """
+    job_id = f"invoice_ai_validation::{run_name}"
+    frappe.enqueue(
+        "invoice.api.invoice_ai_validation.run_batch_ai_validation",
+        queue=VALIDATION_RUN_QUEUE,
+        timeout=VALIDATION_RUN_TIMEOUT,
+        job_id=f"{job_id}::{continuation}" if continuation else job_id,
+        deduplicate=not continuation,
+        enqueue_after_commit=True,
+        run_name=run_name
+    )
+
+
+def run_batch_ai_validation(run_name, time_limit=VALIDATION_RUN_SLICE):
+    """Run'daki faturaları doğrula: model çağrıları paralel, DB işlemleri bu thread'de
+
+    Kaldığı yerden devam: bu run başladıktan sonra ai_validation_date'i yazılmış
+    faturalar atlanır; sayaçlar DB'den yeniden hesaplanır.
+    """
+    run = frappe.get_doc(VALIDATION_RUN_DOCTYPE, run_name)
+    if run.status in ("Completed", "Submitted"):
+        return run
+
+    if not run.started_at:
+        run.db_set("started_at", frappe.utils.now())
+    run.db_set({"status": "Running", "error": None})
+    frappe.db.commit()
+
+    deadline = time.monotonic() + time_limit if time_limit else None
+    # Run boyunca tek event loop ve tek async client (bağlantılar parçalar arasında tekrar kullanılır)
+    loop = asyncio.new_event_loop()
+    client = None
+    try:
+        if run.mode == "Batch File":
+            from invoice.api.invoice_ai_batch import submit_validation_batch
+
+            return submit_validation_batch(run)
+
+        remaining = get_remaining_invoices(run)
+        semaphore = asyncio.Semaphore(run.concurrency)
+        chunk_size = run.concurrency * 4
+
+        for i in range(0, len(remaining), chunk_size):
+            prepared = prepare_validation_chunk(run, remaining[i:i + chunk_size])
+            if prepared:
+                # Client sadece modele gidecek fatura varsa açılır (kural / önbellek yeterliyse API key gerekmez)
+                client = client or get_async_openai_client(run.concurrency)
+                loop.run_until_complete(request_validation_chunk(run, prepared, client, semaphore))
+
+            # Checkpoint: sayaçlar her parçadan sonra kaydedilir
+            run.db_set({field: run.get(field) for field in VALIDATION_RUN_COUNTERS})
+            frappe.db.commit()
+
+            if deadline and time.monotonic() >= deadline and i + chunk_size < len(remaining):
+                enqueue_validation_run(run.name, continuation=run.processed)
+                return run
+
+        run.db_set({"status": "Completed", "finished_at": frappe.utils.now()})
+        frappe.db.commit()
+        publish_validation_progress(run, force=True)
+        print(f"[INVOICE] AI validation run tamamlandı: {run.name} ({run.processed}/{run.total})")
+        logger.info(f"AI validation run tamamlandı: {run.name} ({run.processed}/{run.total})")
+        return run
+
+    except Exception as e:
+        frappe.db.rollback()
+        run.db_set({"status": "Failed", "error": str(e)[:1000]})
+        frappe.db.commit()
+        publish_validation_progress(run, force=True)
+        frappe.log_error(
+            title="AI Validation Run Error",
+            message=f"Run: {run.name}\nError: {str(e)}\n{frappe.get_traceback()}"
+        )
+        raise
+
+    finally:
+        if client:
+            loop.run_until_complete(client.close())
+        loop.close()
+
+
+def get_remaining_invoices(run):
+    """Bu run'da henüz doğrulanmamış faturalar; doğrulanmışlara göre sayaçları ayarla"""
+    names = json.loads(run.invoices or "[]")
+    done = frappe.get_all(run.invoice_doctype,
+        filters={
+            "name": ["in", names],
+            "ai_validation_date": [">=", run.started_at],
+        },
+        fields=["name", "ai_validation_status"]
+    ) if names else []
+
+    statuses = [row.ai_validation_status for row in done]
+    run.processed = len(done)
+    run.valid = statuses.count("Valid")
+    run.issues_found = statuses.count("Issues Found")
+    run.errors = len(statuses) - run.valid - run.issues_found
+
+    done_names = {row.name for row in done}
+    return [name for name in names if name not in done_names]
+
+
+def prepare_validation_chunk(run, names):
+    """Kural kontrolü / önbellekle sonuçlananları yaz; modele gidecekleri döndür"""
+    prepared = []
+    for name in names:
+        try:
+            invoice_doc = frappe.get_doc(run.invoice_doctype, name)
+            cache_key, result, messages = get_validation_request(invoice_doc, run.force)
+            if result:
+                update_ai_validation_fields(invoice_doc, result)
+                count_validation_result(run, result.get("status"))
+            else:
+                prepared.append((invoice_doc, cache_key, messages))
+        except Exception as e:
+            record_validation_error(run.invoice_doctype, name, e)
+            count_validation_result(run, "Error")
+    return prepared
+
+
+async def request_validation_chunk(run, prepared, client, semaphore):
+    """Model çağrılarını eşzamanlı yap, her sonucu geldikçe yaz
+
+    DB işlemleri loop'un thread'inde (frappe.local) ve kısa; sadece model çağrıları bekletir.
+    """
+    run.model_calls = (run.model_calls or 0) + len(prepared)
+    routing = get_validation_routing()
+
+    async def validate(invoice_doc, cache_key, messages):
+        try:
+            result = await request_validation_async(client, messages, semaphore, routing)
+            cache_validation_result(cache_key, result)
+            update_ai_validation_fields(invoice_doc, result)
+            count_model_usage(run, result)
+            count_validation_result(run, result.get("status"))
+        except Exception as e:
+            record_validation_error(invoice_doc.doctype, invoice_doc.name, e)
+            count_validation_result(run, "Error")
+
+    await asyncio.gather(*(validate(*request) for request in prepared))
+
+
+def count_validation_result(run, status):
+    run.processed = (run.processed or 0) + 1
+    if status == "Valid":
+        run.valid = (run.valid or 0) + 1
+    elif status == "Issues Found":
+        run.issues_found = (run.issues_found or 0) + 1
+    else:
+        run.errors = (run.errors or 0) + 1
+    publish_validation_progress(run)
+
+
+def count_model_usage(run, validation_result):
+    """Üst modele geçen fatura ve toplam token sayaçları"""
+    routing = validation_result.get("routing") or []
+    if len(routing) > 1:
+        run.escalations = (run.escalations or 0) + 1
+    run.tokens = (run.tokens or 0) + get_routing_summary(validation_result)[2]
+
+
+def get_validation_progress(run):
+    return {
+        "run": run.name,
+        "status": run.status,
+        "mode": run.mode,
+        "total": run.total or 0,
+        "processed": run.processed or 0,
+        "valid": run.valid or 0,
+        "issues_found": run.issues_found or 0,
+        "errors": run.errors or 0,
+        "model_calls": run.model_calls or 0,
+        "escalations": run.escalations or 0,
+        "tokens": run.tokens or 0,
+        "finished": run.status in ("Completed", "Failed"),
+    }
+
+
+def publish_validation_progress(run, force=False):
+    """Run'ı başlatan kullanıcıya ilerleme gönder (en fazla VALIDATION_PROGRESS_INTERVAL'de bir)"""
+    now = time.monotonic()
+    if not force and now - (run.flags.last_progress_at or 0) < VALIDATION_PROGRESS_INTERVAL:
+        return
+    run.flags.last_progress_at = now
+    frappe.publish_realtime(VALIDATION_PROGRESS_EVENT, get_validation_progress(run), user=run.owner)
@@ -3,10 +3,134 @@ import re
 import json
 from datetime import datetime
 
+from invoice.api.invoice_ingest import (
+    INGEST_MAX_ATTEMPTS,
+    PRIORITY_INVOICE,
+    PRIORITY_NETTING,
+    PRIORITY_REPORT,
+    clear_ingest_batch,
+    enqueue_invoice_attachment,
+    enqueue_invoice_email,
+    get_attachment_job_id,
+    get_attachment_priority,
+    get_ingest_batch,
+    get_ingest_job_id,
+    get_pending_attachments,
+    mark_ingest_state,
+    platform_slot,
+    record_attachment_result,
+    requeue_invoice_attachment,
+    schedule_ingest_retry,
+    set_ingest_job_status,
+    start_ingest_batch,
+    untrack_ingest_job,
+)
+from invoice.api.invoice_locks import InvoiceBusyError, canonical_invoice_number, invoice_lock
+from invoice.api.invoice_netting import link_netting_report
+from invoice.api.invoice_notifications import publish_email_progress, queue_email_summary
+from invoice.api.invoice_schema import build_invoice_values
+from invoice.api.invoice_triage import (
+    KIND_UBER_EATS_REPORT,
+    KIND_WOLT_PAYOUT_REPORT,
+    triage_communication,
+)
+
 logger = frappe.logger("invoice.email_handler", allow_site=frappe.local.site)
 
+# extract_* fonksiyonları değiştiğinde artırılmalı: daha önce işlenen PDF'ler yeniden işlenir
+EXTRACTOR_VERSION = "1"
+
+ATTACHMENT_FIELDS = ["name", "file_url", "file_name", "file_size", "content_hash"]
+
+PRIORITY_ORDER = (PRIORITY_INVOICE, PRIORITY_NETTING, PRIORITY_REPORT)
+
 def process_invoice_email(doc, method=None):
-    """Communication DocType'ına gelen email'leri yakala ve fatura oluştur"""
+    """Communication hook: gelen email'i fatura işleme kuyruğuna ekle
+    
+    Hook Email Account.receive() içinde çalışır; PDF parse ve DB yazma işlemleri
+    mail çekme döngüsünü bloklamasın diye asıl iş arka planda yapılır.
+    """
+    if doc.communication_type != "Communication" or doc.sent_or_received != "Received":
+        return
+    
+    # Fatura olmayan email'ler (trafiğin çoğu) DB'ye dokunmadan elenir
+    triage = triage_communication(doc)
+    if not triage["accept"]:
+        logger.info(f"Email atlandı - fatura değil (kural: {triage['rule']}): {doc.subject}")
+        return
+    
+    enqueue_invoice_email(doc.name)
+
+
+def process_invoice_email_job(communication_name, attempt=1):
+    """Arka plan işi: Communication'daki PDF'leri attachment işlerine dağıt"""
+    try:
+        _process_invoice_email_job(communication_name, attempt)
+    finally:
+        untrack_ingest_job(get_ingest_job_id(communication_name, attempt))
+
+
+def _process_invoice_email_job(communication_name, attempt):
+    set_ingest_job_status(communication_name, "Running", attempt=attempt)
+    
+    try:
+        doc = frappe.get_doc("Communication", communication_name)
+        stats = run_invoice_email_processing(doc, attempt)
+    except frappe.DoesNotExistError:
+        set_ingest_job_status(communication_name, "Finished", attempt=attempt, note="Communication silinmiş")
+        return
+    except Exception as e:
+        logger.error(f"Email işleme işi hatası ({communication_name}): {str(e)}")
+        frappe.log_error(
+            title="Invoice Email Job Error",
+            message=f"Communication: {communication_name}\nAttempt: {attempt}\nError: {str(e)}\n{frappe.get_traceback()}"
+        )
+        stats = {"failed_attachments": 1, "error": str(e)}
+    
+    stats = stats or {}
+    if stats.get("busy"):
+        # Email'i başka bir iş işliyor; sonucu o iş yazar
+        set_ingest_job_status(communication_name, "Busy", attempt=attempt, note=stats["busy"])
+        return
+    
+    if stats.get("dispatched"):
+        # Sonucu son attachment işi (finalize_invoice_email) yazar
+        set_ingest_job_status(communication_name, "Processing", attempt=attempt, attachments=stats["dispatched"])
+        return
+    
+    finish_ingest_job(communication_name, attempt, stats)
+
+
+def finish_ingest_job(communication_name, attempt, stats):
+    """İş durumunu yaz; başarısız PDF varsa email'i backoff sonrasına tekrar planla"""
+    if stats.get("failed_attachments"):
+        if attempt < INGEST_MAX_ATTEMPTS:
+            # Ingest log sayesinde sadece başarısız PDF'ler tekrar işlenir
+            schedule_ingest_retry(communication_name, attempt + 1)
+            return
+        set_ingest_job_status(communication_name, "Failed", attempt=attempt, error=stats.get("error"))
+        return
+    
+    set_ingest_job_status(
+        communication_name, "Finished", attempt=attempt,
+        newly_processed=stats.get("newly_processed", 0),
+        already_processed=stats.get("already_processed", 0)
+    )
+
+
+def run_invoice_email_processing(doc, attempt=1):
+    """Communication kilidi altında email'i işle, istatistikleri döndür"""
+    # Aynı Communication için iki iş (örn. retry + yeni update) yarışabilir;
+    # kilidi alamayan taraf PDF'leri boşuna parse etmeden çıkar (ingest log işi tamamlar)
+    with invoice_lock(f"communication:{doc.name}", blocking_timeout=0) as acquired:
+        if not acquired:
+            print(f"[INVOICE] Email atlandı - başka bir worker işliyor: {doc.subject} (Communication: {doc.name})")
+            logger.info(f"Email atlandı - başka bir worker işliyor (Communication: {doc.name})")
+            return {"busy": "Başka bir worker işliyor"}
+        return _process_invoice_email(doc, attempt)
+
+
+def _process_invoice_email(doc, attempt=1):
     print(f"[INVOICE] Email işleme başladı: {doc.subject} (Communication: {doc.name})")
     logger.info(f"Email işleme başladı: {doc.subject} (Communication: {doc.name})")
     
@@ -15,6 +139,8 @@ def process_invoice_email(doc, method=None):
         "already_processed": 0,
         "newly_processed": 0,
         "errors": 0,
+        "failed_attachments": 0,
+        "dispatched": 0,
         "invoices_created": []
     }
     
@@ -24,6 +150,13 @@ def process_invoice_email(doc, method=None):
             logger.info(f"Email atlandı - type: {doc.communication_type}, received: {doc.sent_or_received}")
             return
         
+        # Konu/gönderen kuralları File sorgusundan önce değerlendirilir
+        triage = triage_communication(doc)
+        if not triage["accept"]:
+            print(f"[INVOICE] Email atlandı - fatura değil: {doc.subject}")
+            logger.info(f"Email atlandı - fatura değil (kural: {triage['rule']}): {doc.subject}")
+            return
+        
         # NOT: Duplicate kontrolü sadece invoice_number (Rechnungsnummer) ile yapılacak
         # Email seviyesinde kontrol kaldırıldı - aynı email'den farklı faturalar gelebilir
         
@@ -32,7 +165,7 @@ def process_invoice_email(doc, method=None):
                 "attached_to_doctype": "Communication",
                 "attached_to_name": doc.name,
             },
-            fields=["name", "file_url", "file_name", "file_size"]
+            fields=ATTACHMENT_FIELDS
         )
         
         pdf_attachments = [
@@ -40,11 +173,17 @@ def process_invoice_email(doc, method=None):
             if att.get('file_name') and att.get('file_name').lower().endswith('.pdf')
         ]
         
-        subject = (doc.subject or "").lower()
+        # Ingest log: aynı extractor sürümüyle işlenmiş PDF'leri tekrar parse etme
+        # (on_update her kaydetmede tetiklenir - durum değişikliği, link, seen vb.)
+        if pdf_attachments:
+            pdf_attachments = get_pending_attachments(doc.name, pdf_attachments, EXTRACTOR_VERSION)
+            if not pdf_attachments:
+                print(f"[INVOICE] Email atlandı - tüm PDF'ler zaten işlenmiş: {doc.subject}")
+                logger.info(f"Email atlandı - tüm PDF'ler zaten işlenmiş: {doc.subject}")
+                return
         
         # ÖNEMLİ: "Ihre neue Aktivitätsübersicht" içeren email'ler UberEats faturaları
-        is_uber_eats_report = "ihre neue aktivitätsübersicht" in subject
-        if is_uber_eats_report:
+        if triage["kind"] == KIND_UBER_EATS_REPORT:
             print(f"[INVOICE] ✅ UberEats Aktivitätsübersicht email'i tespit edildi: {doc.subject}")
             logger.info(f"UberEats Aktivitätsübersicht email'i tespit edildi: {doc.subject}")
             print(f"[INVOICE] Tüm PDF'ler taranacak ({len(pdf_attachments)} adet)")
@@ -56,11 +195,10 @@ def process_invoice_email(doc, method=None):
                 logger.warning("UberEats email'inde PDF bulunamadı")
                 stats["errors"] = 1
                 show_summary_notification(stats, doc.subject)
-                return
+                return stats
         
         # ÖNEMLİ: "Wolt payout report" içeren email'lerdeki tüm PDF'leri işle
-        is_wolt_payout_report = "wolt payout report" in subject
-        if is_wolt_payout_report:
+        elif triage["kind"] == KIND_WOLT_PAYOUT_REPORT:
             print(f"[INVOICE] ✅ Wolt payout report email'i tespit edildi: {doc.subject}")
             logger.info(f"Wolt payout report email'i tespit edildi: {doc.subject}")
             print(f"[INVOICE] Tüm PDF'ler taranacak ({len(pdf_attachments)} adet)")
@@ -72,18 +210,10 @@ def process_invoice_email(doc, method=None):
                 logger.warning("Wolt payout report email'inde PDF bulunamadı")
                 stats["errors"] = 1
                 show_summary_notification(stats, doc.subject)
-                return
+                return stats
         
         # Normal fatura kontrolü - sadece özel email'ler değilse
-        if not is_uber_eats_report and not is_wolt_payout_report:
-            keywords = ["invoice", "fatura", "rechnung", "facture", "bill"]
-            has_invoice_subject = any(keyword in subject for keyword in keywords)
-            
-            if not has_invoice_subject:
-                print(f"[INVOICE] Email atlandı - fatura değil: {doc.subject}")
-                logger.info(f"Email atlandı - fatura değil: {doc.subject}")
-                return
-            
+        else:
             print(f"[INVOICE] ✅ Fatura email'i tespit edildi: {doc.subject}")
             logger.info(f"Fatura email'i tespit edildi: {doc.subject}")
             stats["total_detected"] = 1
@@ -91,104 +221,243 @@ def process_invoice_email(doc, method=None):
             if not pdf_attachments:
                 stats["errors"] = 1
                 show_summary_notification(stats, doc.subject)
-                return
+                return stats
+        
+        # Her PDF ayrı işte işlenir; özet son iş bittiğinde gönderilir
+        file_names = [pdf.name for pdf in pdf_attachments]
+        if not start_ingest_batch(doc.name, attempt, file_names, doc.subject, stats["total_detected"]):
+            print(f"[INVOICE] Email atlandı - PDF'leri hâlâ işleniyor: {doc.subject}")
+            logger.info(f"Email atlandı - PDF'leri hâlâ işleniyor (Communication: {doc.name})")
+            return {"busy": "PDF'leri hâlâ işleniyor"}
+        
+        # Faturalar önce, netting ve raporlar sonra (ayrı öncelik kuyrukları)
+        route_platform = triage["route"]["platform"] if triage["route"] else None
+        for pdf in sorted(pdf_attachments, key=lambda att: PRIORITY_ORDER.index(get_attachment_priority(att.file_name))):
+            enqueue_invoice_attachment(
+                doc.name, pdf.name, attempt,
+                priority=get_attachment_priority(pdf.file_name),
+                platform=route_platform or detect_platform_from_filename(pdf.file_name) or "unknown"
+            )
+        stats["dispatched"] = len(file_names)
+        publish_email_progress(doc.name, {"subject": doc.subject, "files": len(file_names)})
         
-        # İlk tur: faturaları (Selbstfakturierung) işle, netting raporlarını topla
-        netting_pdfs = []
-        for pdf in pdf_attachments:
-            try:
-                # UberEats email'lerinde: Sadece "Bestell- und Zahlungsübersicht" başlığı olan PDF'leri işle
-                if is_uber_eats_report:
-                    # PDF içeriğini hızlıca kontrol et
-                    has_uber_eats_header = check_pdf_has_uber_eats_header(pdf)
-                    if not has_uber_eats_header:
-                        print(f"[INVOICE] ⏭️ PDF atlandı (Bestell- und Zahlungsübersicht yok): {pdf.file_name}")
-                        logger.info(f"PDF atlandı (Bestell- und Zahlungsübersicht yok): {pdf.file_name}")
-                        continue
-                    print(f"[INVOICE] ✅ PDF işlenecek (Bestell- und Zahlungsübersicht bulundu): {pdf.file_name}")
-                    logger.info(f"PDF işlenecek (Bestell- und Zahlungsübersicht bulundu): {pdf.file_name}")
-                
-                # Wolt payout report email'lerinde: fatura PDF'lerini hemen işle, netting raporlarını ikinci tura bırak
-                if is_wolt_payout_report:
-                    has_selbstfakturierung = check_pdf_has_selbstfakturierung(pdf)
-                    if not has_selbstfakturierung:
-                        has_netting_report = check_pdf_has_wolt_netting_report(pdf)
-                        if has_netting_report:
-                            netting_pdfs.append(pdf)
-                            print(f"[INVOICE] 🔄 Netting raporu tespit edildi, ikinci turda eklenecek: {pdf.file_name}")
-                            logger.info(f"Netting raporu tespit edildi (queue): {pdf.file_name}")
-                        else:
-                            print(f"[INVOICE] ⏭️ PDF atlandı (Rechnung(Selbstfakturierung) ya da Netting yok): {pdf.file_name}")
-                            logger.info(f"PDF atlandı (Rechnung(Selbstfakturierung) ya da Netting yok): {pdf.file_name}")
-                        continue
-                    print(f"[INVOICE] ✅ PDF işlenecek (Rechnung(Selbstfakturierung) bulundu): {pdf.file_name}")
-                    logger.info(f"PDF işlenecek (Rechnung(Selbstfakturierung) bulundu): {pdf.file_name}")
-                
-                invoice = create_invoice_from_pdf(doc, pdf)
-                if invoice:
-                    stats["newly_processed"] += 1
-                    stats["invoices_created"].append({
-                        "doctype": invoice.doctype,
-                        "name": invoice.name,
-                        "invoice_number": getattr(invoice, "invoice_number", "N/A")
-                    })
-                else:
-                    stats["already_processed"] += 1
-            except Exception as e:
-                stats["errors"] += 1
-                frappe.log_error(
-                    title="Invoice PDF Processing Error",
-                    message=f"PDF: {pdf.file_name}\nError: {str(e)}\n{frappe.get_traceback()}"
+        print(f"[INVOICE] {len(file_names)} PDF işleme kuyruğuna eklendi (Communication: {doc.name})")
+        logger.info(f"{len(file_names)} PDF işleme kuyruğuna eklendi (Communication: {doc.name})")
+        
+    except Exception as e:
+        print(f"[INVOICE] ❌ Email işleme hatası: {str(e)}")
+        logger.error(f"Email işleme hatası: {str(e)}")
+        frappe.log_error(
+            title="Invoice Email Processing Error",
+            message=f"Error: {str(e)}\n{frappe.get_traceback()}"
+        )
+        stats["failed_attachments"] += 1
+        stats["error"] = str(e)
+    
+    return stats
+
+
+def process_invoice_attachment_job(communication_name, file_name, attempt=1,
+        priority=PRIORITY_INVOICE, platform=None, requeues=0):
+    """Arka plan işi: tek bir PDF'i işle, sonucu email batch'ine yaz"""
+    try:
+        _process_invoice_attachment_job(communication_name, file_name, attempt, priority, platform, requeues)
+    finally:
+        untrack_ingest_job(get_attachment_job_id(communication_name, file_name, attempt, requeues), priority)
+
+
+def _process_invoice_attachment_job(communication_name, file_name, attempt, priority, platform, requeues):
+    result = {}
+    try:
+        # Platform başına eşzamanlılık sınırı: slot yoksa worker beklemez, iş ertelenir
+        with platform_slot(platform) as acquired:
+            if not acquired:
+                if requeue_invoice_attachment(
+                    communication_name, file_name, attempt,
+                    priority=priority, platform=platform, requeues=requeues + 1
+                ):
+                    print(f"[INVOICE] {platform} slotları dolu, PDF ertelendi: {file_name}")
+                    logger.info(f"{platform} slotları dolu, PDF ertelendi: {file_name}")
+                    return
+                # Erteleme sınırı aşıldı: PDF başarısız sayılır, email retry'ı tekrar dener
+                logger.warning(f"{platform} slotu alınamadı, PDF başarısız sayıldı: {file_name}")
+                raise InvoiceBusyError(f"{platform} slotları dolu")
+            
+            doc = frappe.get_doc("Communication", communication_name)
+            pdf = get_invoice_attachment(file_name)
+            if pdf:
+                result = process_invoice_attachment(doc, pdf, triage_communication(doc))
+            frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        logger.error(f"Attachment işi hatası ({communication_name} / {file_name}): {str(e)}")
+        frappe.log_error(
+            title="Invoice Attachment Job Error",
+            message=f"Communication: {communication_name}\nFile: {file_name}\nError: {str(e)}\n{frappe.get_traceback()}"
+        )
+        result = {"errors": 1, "failed_attachments": 1}
+    
+    remaining = record_attachment_result(communication_name, result)
+    if remaining is None:
+        # Batch düşmüş (TTL / temizlenmiş): email'i bu PDF'in sonucuyla kapat
+        print(f"[INVOICE] ⚠️ Email batch'i bulunamadı, PDF sonucu doğrudan yazılıyor: {file_name}")
+        logger.warning(f"Email batch'i bulunamadı ({communication_name} / {file_name})")
+        finish_ingest_job(communication_name, attempt, result)
+        return
+    
+    if remaining == 0:
+        finalize_invoice_email(communication_name)
+        return
+    
+    batch = get_ingest_batch(communication_name)
+    batch["done"] = batch["files"] - remaining
+    publish_email_progress(communication_name, batch)
+
+
+def get_invoice_attachment(file_name):
+    attachments = frappe.get_all("File", filters={"name": file_name}, fields=ATTACHMENT_FIELDS)
+    return attachments[0] if attachments else None
+
+
+def process_invoice_attachment(doc, pdf, triage):
+    """Tek PDF'i işle, batch sayaç artışlarını döndür"""
+    result = {}
+    try:
+        # UberEats email'lerinde: Sadece "Bestell- und Zahlungsübersicht" başlığı olan PDF'leri işle
+        if triage["kind"] == KIND_UBER_EATS_REPORT:
+            # PDF içeriğini hızlıca kontrol et
+            has_uber_eats_header = check_pdf_has_uber_eats_header(pdf)
+            if not has_uber_eats_header:
+                print(f"[INVOICE] ⏭️ PDF atlandı (Bestell- und Zahlungsübersicht yok): {pdf.file_name}")
+                logger.info(f"PDF atlandı (Bestell- und Zahlungsübersicht yok): {pdf.file_name}")
+                mark_ingest_state(doc.name, pdf, "Skipped", EXTRACTOR_VERSION)
+                return result
+            print(f"[INVOICE] ✅ PDF işlenecek (Bestell- und Zahlungsübersicht bulundu): {pdf.file_name}")
+            logger.info(f"PDF işlenecek (Bestell- und Zahlungsübersicht bulundu): {pdf.file_name}")
+        
+        # Wolt payout report email'lerinde: fatura PDF'lerini hemen işle, netting raporlarını ikinci tura bırak
+        route = triage["route"]
+        if triage["kind"] == KIND_WOLT_PAYOUT_REPORT:
+            has_selbstfakturierung = check_pdf_has_selbstfakturierung(pdf)
+            if not has_selbstfakturierung:
+                # Gönderen netting raporu göndermiyorsa PDF'i ikinci kez açma
+                has_netting_report = (
+                    (not route or "netting_report" in route["kinds"])
+                    and check_pdf_has_wolt_netting_report(pdf)
                 )
+                if has_netting_report:
+                    print(f"[INVOICE] 🔄 Netting raporu tespit edildi, ikinci turda eklenecek: {pdf.file_name}")
+                    logger.info(f"Netting raporu tespit edildi (queue): {pdf.file_name}")
+                    result["netting_file"] = pdf.name
+                else:
+                    print(f"[INVOICE] ⏭️ PDF atlandı (Rechnung(Selbstfakturierung) ya da Netting yok): {pdf.file_name}")
+                    logger.info(f"PDF atlandı (Rechnung(Selbstfakturierung) ya da Netting yok): {pdf.file_name}")
+                    mark_ingest_state(doc.name, pdf, "Skipped", EXTRACTOR_VERSION)
+                return result
+            print(f"[INVOICE] ✅ PDF işlenecek (Rechnung(Selbstfakturierung) bulundu): {pdf.file_name}")
+            logger.info(f"PDF işlenecek (Rechnung(Selbstfakturierung) bulundu): {pdf.file_name}")
+        
+        if route:
+            print(f"[INVOICE] Gönderenden platform: {route['platform']} ({doc.sender})")
+            logger.info(f"Gönderenden platform: {route['platform']} ({doc.sender})")
+        
+        invoice = create_invoice_from_pdf(doc, pdf, route=route)
+        mark_ingest_state(doc.name, pdf, "Done", EXTRACTOR_VERSION, result=invoice)
+        if invoice:
+            result["newly_processed"] = 1
+            result["invoice"] = {
+                "doctype": invoice.doctype,
+                "name": invoice.name,
+                "invoice_number": getattr(invoice, "invoice_number", "N/A")
+            }
+        else:
+            result["already_processed"] = 1
+    except InvoiceBusyError as e:
+        # Duplicate sayılmaz: Failed kalır, email tekrar denendiğinde işlenir
+        result = {"failed_attachments": 1}
+        mark_ingest_state(doc.name, pdf, "Failed", EXTRACTOR_VERSION, error=str(e))
+    except Exception as e:
+        result = {"errors": 1, "failed_attachments": 1}
+        mark_ingest_state(doc.name, pdf, "Failed", EXTRACTOR_VERSION, error=str(e))
+        frappe.log_error(
+            title="Invoice PDF Processing Error",
+            message=f"PDF: {pdf.file_name}\nError: {str(e)}\n{frappe.get_traceback()}"
+        )
+    
+    return result
+
 
-        # İkinci tur: netting raporlarını artık oluşmuş Wolt Invoice'lara ekle
-        for net_pdf in netting_pdfs:
+def finalize_invoice_email(communication_name):
+    """Son attachment işi: netting ikinci turunu çalıştır, tek özet bildirimini gönder"""
+    stats = get_ingest_batch(communication_name)
+    
+    # İkinci tur: netting raporlarını artık oluşmuş Wolt Invoice'lara ekle
+    if stats["netting_files"]:
+        doc = frappe.get_doc("Communication", communication_name)
+        for file_name in stats["netting_files"]:
+            net_pdf = get_invoice_attachment(file_name)
+            if not net_pdf:
+                continue
             try:
                 handle_wolt_netting_report(doc, net_pdf)
+                mark_ingest_state(doc.name, net_pdf, "Done", EXTRACTOR_VERSION)
             except Exception as e:
                 stats["errors"] += 1
+                stats["failed_attachments"] += 1
+                mark_ingest_state(doc.name, net_pdf, "Failed", EXTRACTOR_VERSION, error=str(e))
                 frappe.log_error(
                     title="Wolt Netting PDF Error",
                     message=f"PDF: {net_pdf.file_name}\nError: {str(e)}\n{frappe.get_traceback()}"
                 )
-        
         frappe.db.commit()
-        print(f"[INVOICE] Email işleme tamamlandı. Stats: {stats}")
-        logger.info(f"Email işleme tamamlandı. Stats: {stats}")
-        print(f"[INVOICE] Bildirim fonksiyonu çağrılıyor...")
-        show_summary_notification(stats, doc.subject)
-        print(f"[INVOICE] Bildirim fonksiyonu tamamlandı.")
-        
-    except Exception as e:
-        print(f"[INVOICE] ❌ Email işleme hatası: {str(e)}")
-        logger.error(f"Email işleme hatası: {str(e)}")
-        frappe.log_error(
-            title="Invoice Email Processing Error",
-            message=f"Error: {str(e)}\n{frappe.get_traceback()}"
-        )
+    
+    # Netting PDF'leri işaretlendikten sonra: yeni bir batch bunları tekrar dağıtmasın
+    clear_ingest_batch(communication_name)
+    
+    print(f"[INVOICE] Email işleme tamamlandı. Stats: {stats}")
+    logger.info(f"Email işleme tamamlandı (Communication: {communication_name}). Stats: {stats}")
+    publish_email_progress(communication_name, stats, finished=True)
+    show_summary_notification(stats, stats["subject"])
+    
+    finish_ingest_job(communication_name, stats["attempt"], stats)
 
 
-def create_invoice_from_pdf(communication_doc, pdf_attachment):
-    """PDF'den Invoice kaydı oluştur"""
+def create_invoice_from_pdf(communication_doc, pdf_attachment, route=None):
+    """PDF'den Invoice kaydı oluştur
+    
+    route: gönderen yönlendirmesi (invoice_triage); varsa platformun extractor'ı
+    doğrudan çalışır. Aynı domain platform dışı email de gönderebildiği için
+    (örn. uber.com yolculuk faturaları) yönlendirme içerik/dosya adı ile
+    doğrulanamazsa aynı metin üzerinde tam tespite düşülür (PDF bir kez okunur).
+    """
     file_name = pdf_attachment.get('file_name', '')
     print(f"[INVOICE] PDF işleniyor: {file_name}")
     logger.info(f"PDF işleniyor: {file_name}")
     
-    # Dosya adına göre platform tespiti (öncelikli)
-    file_name_lower = file_name.lower() if file_name else ''
-    platform_from_filename = detect_platform_from_filename(file_name_lower)
-    print(f"[INVOICE] Dosya adından platform: {platform_from_filename}")
-    logger.info(f"Dosya adından platform: {platform_from_filename}")
+    platform = None
+    extracted_data = None
+    if route:
+        extracted_data = extract_invoice_data_from_pdf(pdf_attachment, route=route["platform"])
+        if extracted_data.get("route_verified"):
+            platform = route["platform"]
     
-    extracted_data = extract_invoice_data_from_pdf(pdf_attachment)
-    
-    # PDF içeriğinden platform tespiti
-    platform_from_content = extracted_data.get("platform")
-    print(f"[INVOICE] İçerikten platform: {platform_from_content}")
-    logger.info(f"İçerikten platform: {platform_from_content}")
-    
-    # Dosya adı tespiti öncelikli, yoksa içerik tespiti
-    platform = platform_from_filename or platform_from_content
+    if not platform:
+        # Dosya adına göre platform tespiti (öncelikli)
+        file_name_lower = file_name.lower() if file_name else ''
+        platform_from_filename = detect_platform_from_filename(file_name_lower)
+        print(f"[INVOICE] Dosya adından platform: {platform_from_filename}")
+        logger.info(f"Dosya adından platform: {platform_from_filename}")
+        
+        if extracted_data is None:
+            extracted_data = extract_invoice_data_from_pdf(pdf_attachment)
+        
+        # PDF içeriğinden platform tespiti
+        platform_from_content = extracted_data.get("platform")
+        print(f"[INVOICE] İçerikten platform: {platform_from_content}")
+        logger.info(f"İçerikten platform: {platform_from_content}")
+        
+        # Dosya adı tespiti öncelikli, yoksa içerik tespiti
+        platform = platform_from_filename or platform_from_content
     
     # ÖNEMLİ: Platform tespit edilemezse işleme (1&1, diğer faturalar gibi)
     if not platform or platform == "unknown":
@@ -214,152 +483,108 @@ def create_invoice_from_pdf(communication_doc, pdf_attachment):
     return create_lieferando_invoice_doc(communication_doc, pdf_attachment, extracted_data)
 
 
+def route_matches_pdf(platform, file_name, full_text):
+    """Gönderen yönlendirmesini dosya adı veya PDF içeriğiyle doğrula"""
+    if detect_platform_from_filename((file_name or "").lower()) == platform:
+        return True
+    return detect_invoice_platform(full_text or "") == platform
+
+
 def create_lieferando_invoice_doc(communication_doc, pdf_attachment, extracted_data):
     """Lieferando Invoice kaydı oluştur"""
+    invoice = insert_invoice_once("Lieferando Invoice", communication_doc, extracted_data)
+    if not invoice:
+        return None
+    
+    attach_pdf_to_invoice(pdf_attachment, invoice.name, "Lieferando Invoice")
+    
+    return invoice
+
+
+def create_wolt_invoice_doc(communication_doc, pdf_attachment, extracted_data):
+    """Wolt Invoice kaydı oluştur"""
+    invoice = insert_invoice_once("Wolt Invoice", communication_doc, extracted_data)
+    if not invoice:
+        return None
+    
+    attach_pdf_to_invoice(pdf_attachment, invoice.name, "Wolt Invoice")
+    
+    return invoice
+
+
+def insert_invoice_once(doctype, communication_doc, extracted_data):
+    """Rechnungsnummer kilidi altında duplicate kontrolü yapıp Invoice kaydını oluştur
+    
+    Paralel worker'lar aynı faturayı (örn. aynı ekstreyi taşıyan iki email) aynı anda
+    işleyebilir. Kontrol + insert + commit kilit içinde yapılır; kilidi ikinci alan
+    worker kaydı görür ve unique name hatasına düşmeden None döner. Kilit
+    INVOICE_LOCK_WAIT içinde alınamazsa InvoiceBusyError (PDF tekrar denenir).
+    """
     invoice_number = extracted_data.get("invoice_number")
     
-    # Duplicate kontrolü: Sadece invoice_number (Rechnungsnummer) ile kontrol
-    if invoice_number:
-        existing_invoice = frappe.db.exists("Lieferando Invoice", {"invoice_number": invoice_number})
+    if not invoice_number:
+        # Geçici numaralar tabSeries'ten tekil alınır, kilit gerekmez
+        invoice_number = generate_temp_invoice_number()
+        print(f"[INVOICE] ⚠️ Invoice number bulunamadı, geçici numara kullanılacak: {invoice_number}")
+        logger.warning(f"Invoice number bulunamadı, geçici numara kullanılacak: {invoice_number}")
+        return _insert_invoice(doctype, communication_doc, extracted_data, invoice_number)
+    
+    lock_name = f"{doctype}:{canonical_invoice_number(invoice_number)}"
+    with invoice_lock(lock_name) as acquired:
+        if not acquired:
+            print(f"[INVOICE] ⚠️ Fatura başka bir worker tarafından işleniyor (Rechnungsnummer: {invoice_number})")
+            logger.warning(f"Fatura kilidi alınamadı, tekrar denenecek (Rechnungsnummer: {invoice_number})")
+            raise InvoiceBusyError(f"Fatura başka bir worker tarafından işleniyor (Rechnungsnummer: {invoice_number})")
+        
+        # Duplicate kontrolü: Sadece invoice_number (Rechnungsnummer) ile kontrol
+        existing_invoice = frappe.db.exists(doctype, {"invoice_number": invoice_number})
         if existing_invoice:
             print(f"[INVOICE] ⚠️ Fatura zaten işlenmiş (Rechnungsnummer: {invoice_number})")
             logger.info(f"Fatura zaten işlenmiş (Rechnungsnummer: {invoice_number})")
             return None
         print(f"[INVOICE] ✅ Yeni fatura tespit edildi (Rechnungsnummer: {invoice_number})")
         logger.info(f"Yeni fatura tespit edildi (Rechnungsnummer: {invoice_number})")
-    else:
-        print(f"[INVOICE] ⚠️ Invoice number bulunamadı, geçici numara kullanılacak")
-        logger.warning("Invoice number bulunamadı, geçici numara kullanılacak")
-    
-    invoice = frappe.get_doc({
-        "doctype": "Lieferando Invoice",
-        "invoice_number": invoice_number or generate_temp_invoice_number(),
-        "invoice_date": extracted_data.get("invoice_date") or frappe.utils.today(),
-        "period_start": extracted_data.get("period_start"),
-        "period_end": extracted_data.get("period_end"),
-        "status": "Draft",
-        "supplier_name": extracted_data.get("supplier_name") or "yd.yourdelivery GmbH",
-        "supplier_email": extracted_data.get("supplier_email") or communication_doc.sender,
-        "supplier_ust_idnr": extracted_data.get("supplier_ust_idnr"),
-        "supplier_iban": extracted_data.get("supplier_iban"),
-        "restaurant_name": extracted_data.get("restaurant_name"),
-        "customer_number": extracted_data.get("customer_number"),
-        "customer_company": extracted_data.get("customer_company"),
-        "restaurant_address": extracted_data.get("restaurant_address"),
-        "customer_bank_iban": extracted_data.get("customer_bank_iban"),
-        "total_orders": extracted_data.get("total_orders") or 0,
-        "total_revenue": extracted_data.get("total_revenue") or 0,
-        "online_paid_orders": extracted_data.get("online_paid_orders") or 0,
-        "online_paid_amount": extracted_data.get("online_paid_amount") or 0,
-        "ausstehende_am_datum": extracted_data.get("invoice_date"),
-        "ausstehende_onlinebezahlungen_betrag": extracted_data.get("outstanding_balance") or extracted_data.get("total_revenue") or 0,
-        "rechnungsausgleich_betrag": extracted_data.get("total_amount") or 0,
-        "auszahlung_gesamt": extracted_data.get("payout_amount") or 0,
-        "service_fee_rate": extracted_data.get("service_fee_rate") or 30,
-        "service_fee_amount": extracted_data.get("service_fee_amount") or 0,
-        "admin_fee_amount": extracted_data.get("admin_fee_amount") or 0,
-        "subtotal": extracted_data.get("subtotal") or 0,
-        "tax_rate": extracted_data.get("tax_rate") or 19,
-        "tax_amount": extracted_data.get("tax_amount") or 0,
-        "total_amount": extracted_data.get("total_amount") or 0,
-        "paid_online_payments": extracted_data.get("paid_online_payments") or 0,
-        "outstanding_amount": extracted_data.get("outstanding_amount") or 0,
-        "payout_amount": extracted_data.get("payout_amount") or 0,
-        "outstanding_balance": extracted_data.get("outstanding_balance") or 0,
-        "email_subject": communication_doc.subject,
-        "email_from": communication_doc.sender,
-        "received_date": communication_doc.creation,
-        "processed_date": frappe.utils.now(),
-        "extraction_confidence": extracted_data.get("confidence", 50),
-        "raw_text": extracted_data.get("raw_text", "")
-    })
+        
+        return _insert_invoice(doctype, communication_doc, extracted_data, invoice_number)
+
+
+def _insert_invoice(doctype, communication_doc, extracted_data, invoice_number):
+    invoice = build_invoice_doc(doctype, communication_doc, extracted_data, invoice_number)
     
     order_items = extracted_data.get("order_items", [])
     if order_items:
         invoice.order_items = order_items
     
     # name (ID) field'ını invoice_number (Rechnungsnummer) ile aynı yap
-    final_invoice_number = invoice_number or generate_temp_invoice_number()
-    invoice.name = final_invoice_number
+    invoice.name = invoice_number
     
-    invoice.insert(ignore_permissions=True, ignore_mandatory=True)
-    attach_pdf_to_invoice(pdf_attachment, invoice.name, "Lieferando Invoice")
-    notify_invoice_created("Lieferando Invoice", invoice.name, invoice.invoice_number, communication_doc.subject)
+    frappe.db.savepoint("invoice_insert")
+    try:
+        invoice.insert(ignore_permissions=True, ignore_mandatory=True)
+    except frappe.DuplicateEntryError:
+        # Kilit timeout'u aşılmış olabilir; kayıt zaten var, hata değil
+        frappe.db.rollback(save_point="invoice_insert")
+        print(f"[INVOICE] ⚠️ Fatura zaten işlenmiş (Rechnungsnummer: {invoice_number})")
+        logger.info(f"Fatura zaten işlenmiş - duplicate insert (Rechnungsnummer: {invoice_number})")
+        return None
     
+    # Kilit bırakılmadan önce commit: diğer worker'ın exists kontrolü kaydı görmeli
+    frappe.db.commit()
     return invoice
 
 
-def create_wolt_invoice_doc(communication_doc, pdf_attachment, extracted_data):
-    """Wolt Invoice kaydı oluştur"""
-    invoice_number = extracted_data.get("invoice_number")
-    
-    # Duplicate kontrolü: Sadece invoice_number (Rechnungsnummer) ile kontrol
-    if invoice_number:
-        existing_invoice = frappe.db.exists("Wolt Invoice", {"invoice_number": invoice_number})
-        if existing_invoice:
-            print(f"[INVOICE] ⚠️ Fatura zaten işlenmiş (Rechnungsnummer: {invoice_number})")
-            logger.info(f"Fatura zaten işlenmiş (Rechnungsnummer: {invoice_number})")
-            return None
-        print(f"[INVOICE] ✅ Yeni fatura tespit edildi (Rechnungsnummer: {invoice_number})")
-        logger.info(f"Yeni fatura tespit edildi (Rechnungsnummer: {invoice_number})")
-    else:
-        print(f"[INVOICE] ⚠️ Invoice number bulunamadı, geçici numara kullanılacak")
-        logger.warning("Invoice number bulunamadı, geçici numara kullanılacak")
-    
-    invoice = frappe.get_doc({
-        "doctype": "Wolt Invoice",
-        "invoice_number": invoice_number or generate_temp_invoice_number(),
-        "invoice_date": extracted_data.get("invoice_date") or frappe.utils.today(),
-        "period_start": extracted_data.get("period_start"),
-        "period_end": extracted_data.get("period_end"),
+def build_invoice_doc(doctype, communication_doc, extracted_data, invoice_number):
+    """Extractor çıktısından (cache'lenmiş şema ile) yeni Invoice dokümanı oluştur"""
+    return frappe.get_doc({
+        "doctype": doctype,
+        **build_invoice_values(doctype, extracted_data, communication_doc),
+        "invoice_number": invoice_number,
         "status": "Draft",
-        "supplier_name": extracted_data.get("supplier_name") or "Wolt Enterprises Deutschland GmbH",
-        "supplier_vat": extracted_data.get("supplier_vat"),
-        "supplier_address": extracted_data.get("supplier_address"),
-        "restaurant_name": extracted_data.get("restaurant_name"),
-        "customer_number": extracted_data.get("customer_number"),
-        "restaurant_address": extracted_data.get("restaurant_address"),
-        "goods_net_7": extracted_data.get("goods_net_7") or 0,
-        "goods_vat_7": extracted_data.get("goods_vat_7") or 0,
-        "goods_gross_7": extracted_data.get("goods_gross_7") or 0,
-        "goods_net_19": extracted_data.get("goods_net_19") or 0,
-        "goods_vat_19": extracted_data.get("goods_vat_19") or 0,
-        "goods_gross_19": extracted_data.get("goods_gross_19") or 0,
-        "goods_net_total": extracted_data.get("goods_net_total") or 0,
-        "goods_vat_total": extracted_data.get("goods_vat_total") or 0,
-        "goods_gross_total": extracted_data.get("goods_gross_total") or 0,
-        "distribution_net_total": extracted_data.get("distribution_net_total") or 0,
-        "distribution_vat_total": extracted_data.get("distribution_vat_total") or 0,
-        "distribution_gross_total": extracted_data.get("distribution_gross_total") or 0,
-        "netprice_net_7": extracted_data.get("netprice_net_7") or 0,
-        "netprice_vat_7": extracted_data.get("netprice_vat_7") or 0,
-        "netprice_gross_7": extracted_data.get("netprice_gross_7") or 0,
-        "netprice_net_19": extracted_data.get("netprice_net_19") or 0,
-        "netprice_vat_19": extracted_data.get("netprice_vat_19") or 0,
-        "netprice_gross_19": extracted_data.get("netprice_gross_19") or 0,
-        "netprice_net_total": extracted_data.get("netprice_net_total") or 0,
-        "netprice_vat_total": extracted_data.get("netprice_vat_total") or 0,
-        "netprice_gross_total": extracted_data.get("netprice_gross_total") or 0,
-        "end_amount_net": extracted_data.get("end_amount_net") or 0,
-        "end_amount_vat": extracted_data.get("end_amount_vat") or 0,
-        "end_amount_gross": extracted_data.get("end_amount_gross") or 0,
         "email_subject": communication_doc.subject,
         "email_from": communication_doc.sender,
         "received_date": communication_doc.creation,
         "processed_date": frappe.utils.now(),
-        "extraction_confidence": extracted_data.get("confidence", 55),
-        "raw_text": extracted_data.get("raw_text", "")
     })
-    
-    # name (ID) field'ını invoice_number (Rechnungsnummer) ile aynı yap
-    final_invoice_number = invoice_number or generate_temp_invoice_number()
-    invoice.name = final_invoice_number
-    
-    invoice.insert(ignore_permissions=True, ignore_mandatory=True)
-    attach_pdf_to_invoice(pdf_attachment, invoice.name, "Wolt Invoice")
-    notify_invoice_created("Wolt Invoice", invoice.name, invoice.invoice_number, communication_doc.subject)
-    
-    return invoice
 
 
 def check_pdf_has_uber_eats_header(pdf_attachment):
@@ -449,8 +674,13 @@ def check_pdf_has_wolt_netting_report(pdf_attachment):
         return False
 
 
-def extract_invoice_data_from_pdf(pdf_attachment):
-    """PDF'den fatura verilerini çıkar"""
+def extract_invoice_data_from_pdf(pdf_attachment, route=None):
+    """PDF'den fatura verilerini çıkar
+    
+    route: gönderen yönlendirmesinin platformu. Dosya adı veya metin doğrularsa
+    (route_verified) içerikten platform tespiti ve genel fatura no/tarih/toplam/IBAN
+    taramaları atlanır; doğrulamazsa aynı metinle tam tespit yapılır.
+    """
     try:
         import PyPDF2
         
@@ -466,81 +696,23 @@ def extract_invoice_data_from_pdf(pdf_attachment):
             "confidence": 60
         }
         
-        # Rechnungsnummer extraction - UberEats faturaları için özel pattern (öncelikli)
-        # Format: "Rechnungsnummer: UBER_DEU-FIGGGCEE-01-2025-0000001"
-        uber_rechnung_match = re.search(r'Rechnungsnummer:\s*([A-Z0-9_\-]+)', full_text, re.IGNORECASE)
-        if uber_rechnung_match:
-            data["invoice_number"] = uber_rechnung_match.group(1).strip()
-            print(f"[INVOICE] ✅ UberEats Rechnungsnummer bulundu: {data['invoice_number']}")
-            logger.info(f"UberEats Rechnungsnummer bulundu: {data['invoice_number']}")
-        else:
-            # Rechnungsnummer extraction - Wolt faturaları için özel pattern
-            # Format: "Rechnungsnummer DEU/25/HRB274170B/1/35" veya "Rechnungsnummer: DEU/25/HRB274170B/1/35"
-            rechnung_match = re.search(r'Rechnungsnummer[\s:]+([A-Z]{3}/\d{2}/[A-Z0-9]+(?:/\d+)+)', full_text, re.IGNORECASE)
-            if rechnung_match:
-                data["invoice_number"] = rechnung_match.group(1).strip()
-                print(f"[INVOICE] ✅ Rechnungsnummer bulundu: {data['invoice_number']}")
-                logger.info(f"Rechnungsnummer bulundu: {data['invoice_number']}")
+        platform = None
+        if route:
+            if route_matches_pdf(route, pdf_attachment.get("file_name"), full_text):
+                platform = route
+                data["route_verified"] = True
             else:
-                # Fallback: Daha genel pattern'ler
-                invoice_patterns = [
-                    r'Rechnungsnummer[\s:]+([A-Z0-9\/\-]+)',
-                    r'Invoice\s*(?:Number|No|#)[\s:]+([A-Z0-9\-]+)',
-                    r'Rechnung\s*(?:Nr|#)[\s:]+([A-Z0-9\-]+)',
-                    r'Fatura\s*(?:No|#)[\s:]+([A-Z0-9\-]+)',
-                ]
-                
-                for pattern in invoice_patterns:
-                    match = re.search(pattern, full_text, re.IGNORECASE)
-                    if match:
-                        invoice_num = match.group(1).strip()
-                        # USt.-ID formatını (DE123456789) filtrele
-                        if not re.match(r'^DE\d{9}$', invoice_num):
-                            data["invoice_number"] = invoice_num
-                            print(f"[INVOICE] ✅ Rechnungsnummer bulundu (fallback): {data['invoice_number']}")
-                            logger.info(f"Rechnungsnummer bulundu (fallback): {data['invoice_number']}")
-                            break
-        
-        date_patterns = [
-            r'Date[\s:]*(\d{1,2}[\.\/\-]\d{1,2}[\.\/\-]\d{2,4})',
-            r'Datum[\s:]*(\d{1,2}[\.\/\-]\d{1,2}[\.\/\-]\d{2,4})',
-            r'(\d{1,2}[\.\/\-]\d{1,2}[\.\/\-]\d{2,4})',
-        ]
-        
-        for pattern in date_patterns:
-            match = re.search(pattern, full_text)
-            if match:
-                try:
-                    data["invoice_date"] = parse_date(match.group(1))
-                    break
-                except:
-                    pass
-        
-        total_patterns = [
-            r'Total[\s:]*[€$£]?\s*([\d,\.]+)',
-            r'Gesamt[\s:]*[€$£]?\s*([\d,\.]+)',
-            r'Toplam[\s:]*[€$£]?\s*([\d,\.]+)',
-            r'[€$£]\s*([\d,\.]+)',
-        ]
-        
-        for pattern in total_patterns:
-            matches = re.findall(pattern, full_text, re.IGNORECASE)
-            if matches:
-                amounts = []
-                for m in matches:
-                    try:
-                        amounts.append(float(m.replace(',', '')))
-                    except:
-                        pass
-                if amounts:
-                    data["total_amount"] = max(amounts)
-                    break
+                logger.warning(
+                    f"Gönderen yönlendirmesi ({route}) içerikle doğrulanamadı: {pdf_attachment.get('file_name')}"
+                )
         
-        iban_match = re.search(r'([A-Z]{2}\d{2}[\s]?[\d\s]{10,30})', full_text)
-        if iban_match:
-            data["iban"] = iban_match.group(1).replace(' ', '')
+        if not platform:
+            data.update(extract_generic_fields(full_text))
+            platform = detect_invoice_platform(full_text)
+        elif platform == "lieferando":
+            # Lieferando extractor'ı fatura no/tarih için genel taramaya dayanıyor
+            data.update(extract_generic_fields(full_text))
         
-        platform = detect_invoice_platform(full_text)
         data["platform"] = platform or "lieferando"
         
         if platform == "wolt":
@@ -562,6 +734,87 @@ def extract_invoice_data_from_pdf(pdf_attachment):
         return {"raw_text": "", "confidence": 0}
 
 
+def extract_generic_fields(full_text: str) -> dict:
+    """Platformdan bağımsız genel taramalar (fatura no, tarih, toplam, IBAN)"""
+    data = {}
+    
+    # Rechnungsnummer extraction - UberEats faturaları için özel pattern (öncelikli)
+    # Format: "Rechnungsnummer: UBER_DEU-FIGGGCEE-01-2025-0000001"
+    uber_rechnung_match = re.search(r'Rechnungsnummer:\s*([A-Z0-9_\-]+)', full_text, re.IGNORECASE)
+    if uber_rechnung_match:
+        data["invoice_number"] = uber_rechnung_match.group(1).strip()
+        print(f"[INVOICE] ✅ UberEats Rechnungsnummer bulundu: {data['invoice_number']}")
+        logger.info(f"UberEats Rechnungsnummer bulundu: {data['invoice_number']}")
+    else:
+        # Rechnungsnummer extraction - Wolt faturaları için özel pattern
+        # Format: "Rechnungsnummer DEU/25/HRB274170B/1/35" veya "Rechnungsnummer: DEU/25/HRB274170B/1/35"
+        rechnung_match = re.search(r'Rechnungsnummer[\s:]+([A-Z]{3}/\d{2}/[A-Z0-9]+(?:/\d+)+)', full_text, re.IGNORECASE)
+        if rechnung_match:
+            data["invoice_number"] = rechnung_match.group(1).strip()
+            print(f"[INVOICE] ✅ Rechnungsnummer bulundu: {data['invoice_number']}")
+            logger.info(f"Rechnungsnummer bulundu: {data['invoice_number']}")
+        else:
+            # Fallback: Daha genel pattern'ler
+            invoice_patterns = [
+                r'Rechnungsnummer[\s:]+([A-Z0-9\/\-]+)',
+                r'Invoice\s*(?:Number|No|#)[\s:]+([A-Z0-9\-]+)',
+                r'Rechnung\s*(?:Nr|#)[\s:]+([A-Z0-9\-]+)',
+                r'Fatura\s*(?:No|#)[\s:]+([A-Z0-9\-]+)',
+            ]
+            
+            for pattern in invoice_patterns:
+                match = re.search(pattern, full_text, re.IGNORECASE)
+                if match:
+                    invoice_num = match.group(1).strip()
+                    # USt.-ID formatını (DE123456789) filtrele
+                    if not re.match(r'^DE\d{9}$', invoice_num):
+                        data["invoice_number"] = invoice_num
+                        print(f"[INVOICE] ✅ Rechnungsnummer bulundu (fallback): {data['invoice_number']}")
+                        logger.info(f"Rechnungsnummer bulundu (fallback): {data['invoice_number']}")
+                        break
+    
+    date_patterns = [
+        r'Date[\s:]*(\d{1,2}[\.\/\-]\d{1,2}[\.\/\-]\d{2,4})',
+        r'Datum[\s:]*(\d{1,2}[\.\/\-]\d{1,2}[\.\/\-]\d{2,4})',
+        r'(\d{1,2}[\.\/\-]\d{1,2}[\.\/\-]\d{2,4})',
+    ]
+    
+    for pattern in date_patterns:
+        match = re.search(pattern, full_text)
+        if match:
+            try:
+                data["invoice_date"] = parse_date(match.group(1))
+                break
+            except:
+                pass
+    
+    total_patterns = [
+        r'Total[\s:]*[€$£]?\s*([\d,\.]+)',
+        r'Gesamt[\s:]*[€$£]?\s*([\d,\.]+)',
+        r'Toplam[\s:]*[€$£]?\s*([\d,\.]+)',
+        r'[€$£]\s*([\d,\.]+)',
+    ]
+    
+    for pattern in total_patterns:
+        matches = re.findall(pattern, full_text, re.IGNORECASE)
+        if matches:
+            amounts = []
+            for m in matches:
+                try:
+                    amounts.append(float(m.replace(',', '')))
+                except:
+                    pass
+            if amounts:
+                data["total_amount"] = max(amounts)
+                break
+    
+    iban_match = re.search(r'([A-Z]{2}\d{2}[\s]?[\d\s]{10,30})', full_text)
+    if iban_match:
+        data["iban"] = iban_match.group(1).replace(' ', '')
+    
+    return data
+
+
 def detect_platform_from_filename(file_name: str) -> str:
     """Dosya adından platform tespit et"""
     if not file_name:
@@ -806,18 +1059,6 @@ def handle_wolt_netting_report(communication_doc, pdf_attachment):
             logger.warning(f"Netting raporunda Rechnungsnummer bulunamadı: {pdf_attachment.file_name}")
             return
         
-        existing_invoice = frappe.db.exists("Wolt Invoice", {"invoice_number": invoice_number})
-        if not existing_invoice:
-            print(f"[INVOICE] ⚠️ Netting raporu için Wolt Invoice bulunamadı (Rechnungsnummer: {invoice_number})")
-            logger.warning(f"Netting raporu için Wolt Invoice bulunamadı (Rechnungsnummer: {invoice_number})")
-            return
-        
-        print(f"[INVOICE] ✅ Netting raporu Wolt Invoice'a eklenecek (Rechnungsnummer: {invoice_number})")
-        logger.info(f"Netting raporu Wolt Invoice'a eklenecek (Rechnungsnummer: {invoice_number})")
-        
-        # PDF'i yeni alana attach et
-        attach_pdf_to_invoice_with_field(pdf_attachment, invoice_number, "Wolt Invoice", "netting_report_pdf")
-        
         # Raw text ve parse edilmiş alanları sakla
         update_values = {"netting_raw_text": full_text}
         
@@ -842,8 +1083,9 @@ def handle_wolt_netting_report(communication_doc, pdf_attachment):
             for src, target in mapping.items():
                 if src in parsed_fields and parsed_fields[src] is not None:
                     update_values[target] = parsed_fields[src]
-        frappe.db.set_value("Wolt Invoice", invoice_number, update_values)
-        frappe.db.commit()
+        
+        # Fatura henüz yoksa parse sonucu bekletilir, fatura oluşunca bağlanır
+        link_netting_report(communication_doc, pdf_attachment, invoice_number, update_values)
         
     except Exception as e:
         frappe.log_error(
@@ -1187,65 +1429,11 @@ def extract_uber_eats_fields(full_text: str) -> dict:
 
 def create_uber_eats_invoice_doc(communication_doc, pdf_attachment, extracted_data):
     """UberEats Invoice kaydı oluştur"""
-    invoice_number = extracted_data.get("invoice_number")
-    
-    # Duplicate kontrolü: Sadece invoice_number (Rechnungsnummer) ile kontrol
-    if invoice_number:
-        existing_invoice = frappe.db.exists("Uber Eats Invoice", {"invoice_number": invoice_number})
-        if existing_invoice:
-            print(f"[INVOICE] ⚠️ Fatura zaten işlenmiş (Rechnungsnummer: {invoice_number})")
-            logger.info(f"Fatura zaten işlenmiş (Rechnungsnummer: {invoice_number})")
-            return None
-        print(f"[INVOICE] ✅ Yeni fatura tespit edildi (Rechnungsnummer: {invoice_number})")
-        logger.info(f"Yeni fatura tespit edildi (Rechnungsnummer: {invoice_number})")
-    else:
-        print(f"[INVOICE] ⚠️ Invoice number bulunamadı, geçici numara kullanılacak")
-        logger.warning("Invoice number bulunamadı, geçici numara kullanılacak")
-    
-    invoice = frappe.get_doc({
-        "doctype": "Uber Eats Invoice",
-        "invoice_number": invoice_number or generate_temp_invoice_number(),
-        "invoice_date": extracted_data.get("invoice_date") or frappe.utils.today(),
-        "tax_date": extracted_data.get("tax_date"),
-        "period_start": extracted_data.get("period_start"),
-        "period_end": extracted_data.get("period_end"),
-        "status": "Draft",
-        "supplier_name": extracted_data.get("supplier_name") or "Uber Eats Germany GmbH",
-        "supplier_vat": extracted_data.get("supplier_vat"),
-        "supplier_address": extracted_data.get("supplier_address"),
-        "restaurant_name": extracted_data.get("restaurant_name"),
-        "customer_company": extracted_data.get("customer_company"),
-        "restaurant_address": extracted_data.get("restaurant_address"),
-        "business_id": extracted_data.get("business_id"),
-        "customer_vat": extracted_data.get("customer_vat"),
-        "tax_number": extracted_data.get("tax_number"),
-        "total_orders": extracted_data.get("total_orders") or 0,
-        "total_order_value": extracted_data.get("total_order_value") or 0,
-        "gross_revenue_after_discounts": extracted_data.get("gross_revenue_after_discounts") or 0,
-        "commission_own_delivery": extracted_data.get("commission_own_delivery") or 0,
-        "commission_pickup": extracted_data.get("commission_pickup") or 0,
-        "uber_eats_fee": extracted_data.get("uber_eats_fee") or 0,
-        "vat_19_percent": extracted_data.get("vat_19_percent") or 0,
-        "cash_collected": extracted_data.get("cash_collected") or 0,
-        "total_payout": extracted_data.get("total_payout") or 0,
-        "net_amount": extracted_data.get("net_amount") or 0,
-        "vat_amount": extracted_data.get("vat_amount") or 0,
-        "total_amount": extracted_data.get("total_amount") or 0,
-        "email_subject": communication_doc.subject,
-        "email_from": communication_doc.sender,
-        "received_date": communication_doc.creation,
-        "processed_date": frappe.utils.now(),
-        "extraction_confidence": extracted_data.get("confidence", 55),
-        "raw_text": extracted_data.get("raw_text", "")
-    })
-    
-    # name (ID) field'ını invoice_number (Rechnungsnummer) ile aynı yap
-    final_invoice_number = invoice_number or generate_temp_invoice_number()
-    invoice.name = final_invoice_number
+    invoice = insert_invoice_once("Uber Eats Invoice", communication_doc, extracted_data)
+    if not invoice:
+        return None
     
-    invoice.insert(ignore_permissions=True, ignore_mandatory=True)
     attach_pdf_to_invoice(pdf_attachment, invoice.name, "Uber Eats Invoice")
-    notify_invoice_created("Uber Eats Invoice", invoice.name, invoice.invoice_number, communication_doc.subject)
     
     return invoice
 
@@ -1328,10 +1516,19 @@ def attach_pdf_to_invoice_with_field(pdf_attachment, invoice_name, target_doctyp
         )
 
 
+TEMP_INVOICE_SERIES = "TEMP-INVOICE-"
+
+
 def generate_temp_invoice_number():
-    """Geçici fatura numarası oluştur"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    return f"TEMP-{timestamp}"
+    """Geçici fatura numarası oluştur
+
+    Sayaç tabSeries üzerinden (SELECT ... FOR UPDATE) alınır; paralel worker'lar
+    aynı saniyede bile farklı ve artan numara alır. Tarih sadece okunabilirlik için.
+    """
+    from frappe.model.naming import getseries
+    
+    counter = getseries(TEMP_INVOICE_SERIES, 6)
+    return f"TEMP-{datetime.now().strftime('%Y%m%d')}-{counter}"
 
 
 def parse_date(date_str):
@@ -1351,293 +1548,12 @@ def parse_date(date_str):
     return frappe.utils.today()
 
 
-def notify_invoice_created(doctype, docname, invoice_number, email_subject):
-    """Fatura oluşturulduğunda kullanıcıya bildirim göster"""
-    try:
-        from frappe.utils.data import get_url_to_form
-        
-        invoice_link = get_url_to_form(doctype, docname)
-        platform_name = "Lieferando" if "Lieferando" in doctype else "Wolt"
-        
-        message = f"""
-        <b>{platform_name} Faturası Oluşturuldu</b><br><br>
-        Fatura No: <b>{invoice_number or 'N/A'}</b><br>
-        Email: {email_subject[:50]}{'...' if len(email_subject) > 50 else ''}<br><br>
-        <a href='{invoice_link}'><b>Faturayı Görüntüle</b></a>
-        """
-        
-        frappe.publish_realtime(
-            "msgprint",
-            {
-                "message": message,
-                "alert": True,
-                "indicator": "green",
-                "title": f"{platform_name} Faturası Oluşturuldu"
-            },
-            after_commit=True
-        )
-        
-    except Exception as e:
-        logger.error(f"Bildirim gönderme hatası: {str(e)}")
-
-
-def _get_session_stats():
-    """Session bazlı istatistikleri al"""
-    session_key = "invoice_processing_stats"
-    if not hasattr(frappe.local, session_key):
-        setattr(frappe.local, session_key, {
-            "total_detected": 0,
-            "already_processed": 0,
-            "newly_processed": 0,
-            "errors": 0,
-            "invoices_created": [],
-            "emails_processed": []
-        })
-    return getattr(frappe.local, session_key)
-
-
-def _update_session_stats(stats):
-    """Session istatistiklerini güncelle"""
-    session_stats = _get_session_stats()
-    session_stats["total_detected"] += stats.get("total_detected", 0)
-    session_stats["already_processed"] += stats.get("already_processed", 0)
-    session_stats["newly_processed"] += stats.get("newly_processed", 0)
-    session_stats["errors"] += stats.get("errors", 0)
-    session_stats["invoices_created"].extend(stats.get("invoices_created", []))
-    if stats.get("total_detected", 0) > 0 or stats.get("already_processed", 0) > 0:
-        session_stats["emails_processed"].append(stats)
-
-
-def show_summary_notification(stats, email_subject, is_final=False):
-    """Email işleme özetini göster - hem realtime hem de Notification Log olarak"""
+def show_summary_notification(stats, email_subject):
+    """Email işleme özetini digest tamponuna ekle (invoice_notifications)"""
     print(f"[INVOICE] show_summary_notification çağrıldı. Stats: {stats}, Subject: {email_subject}")
     try:
-        from frappe.utils.data import get_url_to_form
-        from frappe.desk.doctype.notification_log.notification_log import enqueue_create_notification
-        
-        print(f"[INVOICE] Import'lar tamamlandı")
-        
-        try:
-            _update_session_stats(stats)
-            print(f"[INVOICE] Session stats güncellendi")
-        except Exception as e:
-            print(f"[INVOICE] ⚠️ Session stats hatası (devam ediliyor): {str(e)}")
-            logger.warning(f"Session stats hatası: {str(e)}")
-        
-        total_detected = stats.get("total_detected", 0)
-        already_processed = stats.get("already_processed", 0)
-        newly_processed = stats.get("newly_processed", 0)
-        errors = stats.get("errors", 0)
-        invoices_created = stats.get("invoices_created", [])
-        
-        print(f"[INVOICE] Bildirim gönderiliyor. Stats: total={total_detected}, new={newly_processed}, already={already_processed}, errors={errors}")
-        logger.info(f"Bildirim gönderiliyor. Stats: total={total_detected}, new={newly_processed}, already={already_processed}, errors={errors}")
-        
-        if total_detected == 0 and already_processed == 0:
-            print(f"[INVOICE] Bildirim gönderilmedi - istatistik yok (total={total_detected}, already={already_processed})")
-            logger.info("Bildirim gönderilmedi - istatistik yok")
-            return
-        
-        message_parts = []
-        message_parts.append(f"📧 <b>Email İşleme Özeti</b><br>")
-        message_parts.append(f"<b>Email:</b> {email_subject[:60]}{'...' if len(email_subject) > 60 else ''}<br><br>")
-        
-        if total_detected > 0:
-            message_parts.append(f"✅ <b>Yakalanan Fatura:</b> {total_detected}<br>")
-        
-        if already_processed > 0:
-            message_parts.append(f"⚠️ <b>Daha Önce İşlenmiş:</b> {already_processed}<br>")
-        
-        if newly_processed > 0:
-            message_parts.append(f"🆕 <b>Yeni İşlenen:</b> {newly_processed}<br>")
-        
-        if errors > 0:
-            message_parts.append(f"❌ <b>Hata:</b> {errors}<br>")
-        
-        if invoices_created:
-            message_parts.append(f"<br><b>Oluşturulan Faturalar:</b><br>")
-            for inv in invoices_created[:5]:
-                platform = "Lieferando" if "Lieferando" in inv["doctype"] else "Wolt"
-                invoice_link = get_url_to_form(inv["doctype"], inv["name"])
-                message_parts.append(f"• <a href='{invoice_link}'>{platform} - {inv['invoice_number']}</a><br>")
-            
-            if len(invoices_created) > 5:
-                message_parts.append(f"... ve {len(invoices_created) - 5} fatura daha<br>")
-        
-        message = "".join(message_parts)
-        
-        if errors > 0:
-            indicator = "red"
-        elif already_processed > 0 and newly_processed == 0:
-            indicator = "orange"
-        else:
-            indicator = "green"
-        
-        # Realtime bildirim (anlık popup) - her zaman gönder
-        print(f"[INVOICE] Realtime bildirim hazırlanıyor...")
-        try:
-            current_user = frappe.session.user if hasattr(frappe, 'session') and hasattr(frappe.session, 'user') else None
-            print(f"[INVOICE] Current user: {current_user}")
-            
-            # Tüm aktif kullanıcılara bildirim gönder
-            active_users = frappe.get_all("User", 
-                filters={"enabled": 1, "user_type": "System User"},
-                fields=["name"]
-            )
-            user_list = [user.name for user in active_users] if active_users else []
-            
-            if not user_list:
-                print(f"[INVOICE] ⚠️ Aktif kullanıcı bulunamadı, bildirim gönderilemiyor")
-                logger.warning("Aktif kullanıcı bulunamadı")
-            else:
-                print(f"[INVOICE] Bildirim gönderilecek kullanıcılar: {user_list}")
-                
-                # Her kullanıcıya bildirim gönder
-                for user in user_list:
-                    try:
-                        frappe.publish_realtime(
-                            "show_alert",
-                            {
-                                "message": message,
-                                "alert": True,
-                                "indicator": indicator,
-                                "title": "Fatura İşleme Özeti"
-                            },
-                            user=user,
-                            after_commit=True
-                        )
-                        print(f"[INVOICE] ✅ Bildirim gönderildi: {user}")
-                    except Exception as e:
-                        print(f"[INVOICE] ❌ Kullanıcı {user} için bildirim hatası: {str(e)}")
-                        logger.error(f"Kullanıcı {user} için bildirim hatası: {str(e)}")
-                
-                logger.info(f"Realtime bildirim gönderildi - {len(user_list)} kullanıcıya")
-        except Exception as e:
-            print(f"[INVOICE] ❌ Realtime bildirim hatası: {str(e)}")
-            logger.error(f"Realtime bildirim hatası: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-        
-        # Notification Log kaydı oluştur (kalıcı bildirim)
-        try:
-            subject_text = f"Fatura İşleme: {newly_processed} yeni, {already_processed} tekrar"
-            if errors > 0:
-                subject_text += f", {errors} hata"
-            
-            notification_doc = {
-                "type": "Alert",
-                "document_type": "Communication",
-                "subject": subject_text,
-                "email_content": message,
-            }
-            
-            active_users = frappe.get_all("User", 
-                filters={"enabled": 1, "user_type": "System User"},
-                fields=["name"]
-            )
-            user_emails = [user.name for user in active_users]
-            
-            if user_emails:
-                enqueue_create_notification(user_emails, notification_doc)
-                print(f"[INVOICE] ✅ Notification Log gönderildi - {len(user_emails)} kullanıcıya")
-                logger.info(f"Notification Log gönderildi - {len(user_emails)} kullanıcıya")
-            else:
-                print(f"[INVOICE] ⚠️ Notification Log gönderilmedi - aktif kullanıcı bulunamadı")
-                logger.warning("Notification Log gönderilmedi - aktif kullanıcı bulunamadı")
-        except Exception as e:
-            logger.error(f"Notification Log gönderme hatası: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-        
-        # Final özet için toplu bildirim gönder
-        if is_final:
-            session_stats = _get_session_stats()
-            _send_final_summary(session_stats)
-            if hasattr(frappe.local, "invoice_processing_stats"):
-                delattr(frappe.local, "invoice_processing_stats")
-        
+        queue_email_summary(stats, email_subject)
     except Exception as e:
         logger.error(f"Özet bildirimi gönderme hatası: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-
-
-def _send_final_summary(session_stats):
-    """Tüm email'ler işlendikten sonra toplu özet gönder"""
-    try:
-        from frappe.utils.data import get_url_to_form
-        from frappe.desk.doctype.notification_log.notification_log import enqueue_create_notification
-        
-        total_detected = session_stats.get("total_detected", 0)
-        already_processed = session_stats.get("already_processed", 0)
-        newly_processed = session_stats.get("newly_processed", 0)
-        errors = session_stats.get("errors", 0)
-        all_invoices = session_stats.get("invoices_created", [])
-        emails_count = len(session_stats.get("emails_processed", []))
-        
-        if total_detected == 0 and already_processed == 0:
-            return
-        
-        message_parts = []
-        message_parts.append(f"<b>📧 Toplu Email İşleme Özeti</b><br><br>")
-        message_parts.append(f"<b>İşlenen Email Sayısı:</b> {emails_count}<br><br>")
-        message_parts.append(f"✅ <b>Toplam Yakalanan Fatura:</b> {total_detected}<br>")
-        message_parts.append(f"🆕 <b>Yeni İşlenen:</b> {newly_processed}<br>")
-        message_parts.append(f"⚠️ <b>Daha Önce İşlenmiş:</b> {already_processed}<br>")
-        
-        if errors > 0:
-            message_parts.append(f"❌ <b>Hata:</b> {errors}<br>")
-        
-        if all_invoices:
-            message_parts.append(f"<br><b>Oluşturulan Faturalar ({len(all_invoices)}):</b><br>")
-            for inv in all_invoices[:10]:
-                platform = "Lieferando" if "Lieferando" in inv["doctype"] else "Wolt"
-                invoice_link = get_url_to_form(inv["doctype"], inv["name"])
-                message_parts.append(f"• <a href='{invoice_link}'>{platform} - {inv['invoice_number']}</a><br>")
-            
-            if len(all_invoices) > 10:
-                message_parts.append(f"... ve {len(all_invoices) - 10} fatura daha<br>")
-        
-        message = "".join(message_parts)
-        
-        if errors > 0:
-            indicator = "red"
-        elif already_processed > 0 and newly_processed == 0:
-            indicator = "orange"
-        else:
-            indicator = "green"
-        
-        # Toplu özet bildirimi
-        frappe.publish_realtime(
-            "msgprint",
-            {
-                "message": message,
-                "alert": True,
-                "indicator": indicator,
-                "title": "Fatura İşleme - Toplu Özet"
-            },
-            after_commit=True
-        )
-        
-        subject_text = f"Fatura İşleme Özeti: {emails_count} email, {newly_processed} yeni fatura"
-        if errors > 0:
-            subject_text += f", {errors} hata"
-        
-        notification_doc = {
-            "type": "Alert",
-            "document_type": "Communication",
-            "subject": subject_text,
-            "email_content": message,
-        }
-        
-        active_users = frappe.get_all("User", 
-            filters={"enabled": 1, "user_type": "System User"},
-            fields=["name"]
-        )
-        user_emails = [user.name for user in active_users]
-        
-        if user_emails:
-            enqueue_create_notification(user_emails, notification_doc)
-        
-    except Exception as e:
-        logger.error(f"Toplu özet bildirimi gönderme hatası: {str(e)}")
@@ -0,0 +1,514 @@
+"""
+Email -> fatura ingest takibi (Invoice Ingest Log)
+
+Communication hook'u hem after_insert hem on_update'te çalışıyor; her
+kaydetmede PDF'leri tekrar parse etmemek için (Communication, File,
+içerik hash'i) başına işlenme durumu ve extractor sürümü tutulur.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import frappe
+
+from invoice.invoice.doctype.invoice_ingest_log.invoice_ingest_log import get_ingest_log_name
+
+logger = frappe.logger("invoice.ingest", allow_site=frappe.local.site)
+
+INGEST_LOG_DOCTYPE = "Invoice Ingest Log"
+
+# Bu durumlardaki kayıtlar aynı extractor sürümüyle tekrar işlenmez
+FINISHED_STATES = ("Done", "Skipped")
+
+
+def get_pending_attachments(communication_name, attachments, extractor_version):
+    """Henüz (bu extractor sürümüyle) işlenmemiş attachment'ları döndür
+
+    Tek indeksli sorgu: Communication'a ait log kayıtları. PDF okunmaz.
+    """
+    if not attachments:
+        return []
+
+    finished = {
+        row.name
+        for row in frappe.get_all(INGEST_LOG_DOCTYPE,
+            filters={
+                "communication": communication_name,
+                "extractor_version": extractor_version,
+                "state": ["in", FINISHED_STATES],
+            },
+            fields=["name"]
+        )
+    }
+
+    return [
+        att for att in attachments
+        if get_ingest_log_name(communication_name, att.name, att.get("content_hash")) not in finished
+    ]
+
+
+def mark_ingest_state(communication_name, attachment, state, extractor_version, result=None, error=None):
+    """Attachment'ın ingest durumunu kaydet (upsert)"""
+    log_name = get_ingest_log_name(communication_name, attachment.name, attachment.get("content_hash"))
+    values = {
+        "state": state,
+        "extractor_version": extractor_version,
+        "result_doctype": result.doctype if result else None,
+        "result_name": result.name if result else None,
+        "error": (error or "")[:1000] or None,
+    }
+
+    try:
+        if frappe.db.exists(INGEST_LOG_DOCTYPE, log_name):
+            attempts = frappe.db.get_value(INGEST_LOG_DOCTYPE, log_name, "attempts") or 0
+            values["attempts"] = attempts + 1
+            frappe.db.set_value(INGEST_LOG_DOCTYPE, log_name, values)
+        else:
+            frappe.get_doc({
+                "doctype": INGEST_LOG_DOCTYPE,
+                "communication": communication_name,
+                "file": attachment.name,
+                "file_name": attachment.get("file_name"),
+                "content_hash": attachment.get("content_hash"),
+                "attempts": 1,
+                **values
+            }).insert(ignore_permissions=True)
+    except Exception as e:
+        # Log yazılamazsa en kötü ihtimalle PDF bir sonraki update'te tekrar işlenir
+        logger.error(f"Ingest log yazılamadı ({log_name}): {str(e)}")
+
+
+# ---------------------------------------------------------------------------
+# Arka plan işleri
+# ---------------------------------------------------------------------------
+
+# Öncelik sırası: faturalar > netting raporları > diğer raporlar.
+# Her öncelik uygulamaya ait ayrı bir kuyruğa gider; worker'lar kuyrukları verilen
+# sırayla tüketir. Kuyruklar common_site_config'te tanımlanır:
+#   "workers": {"invoice_ingest": {"timeout": 1500}, "invoice_netting": {...}, "invoice_report": {...}}
+#   bench worker --queue invoice_ingest,invoice_netting,invoice_report
+# Tanımlı olmayan kuyruğa iş eklenemez; o öncelik "long" kuyruğuna düşer (uzun PDF
+# işleri diğer uygulamaların short işleriyle yarışmasın). Site config:
+#   "invoice_ingest_priority_queues": {"invoice": ..., "netting": ..., "report": ...}
+#   "invoice_ingest_queue": tüm işler tek kuyrukta (öncelik yok)
+PRIORITY_INVOICE = "invoice"
+PRIORITY_NETTING = "netting"
+PRIORITY_REPORT = "report"
+INGEST_PRIORITY_QUEUES = {
+    PRIORITY_INVOICE: "invoice_ingest",
+    PRIORITY_NETTING: "invoice_netting",
+    PRIORITY_REPORT: "invoice_report",
+}
+INGEST_QUEUE = "long"
+INGEST_JOB_TIMEOUT = 1500
+
+# Platform başına aynı anda işlenen PDF sayısı (site config: "invoice_ingest_platform_concurrency")
+PLATFORM_CONCURRENCY = 4
+INGEST_PLATFORMS = ("lieferando", "wolt", "uber_eats", "unknown")
+# Slot kilidinin TTL'i (sn); iş sürdükçe yenilenir, çöken işin slotu bu sürede düşer
+PLATFORM_SLOT_TTL = 60
+# Slot bulunamazsa iş beklemeden bırakılır ve gecikmeyle tekrar kuyruğa eklenir:
+# taban * 2^(n-1) sn, en fazla PLATFORM_SLOT_MAX_DELAY; PLATFORM_SLOT_MAX_REQUEUES
+# denemeden sonra PDF başarısız sayılır (email retry'ı devralır)
+PLATFORM_SLOT_RETRY_DELAY = 15
+PLATFORM_SLOT_MAX_DELAY = 300
+PLATFORM_SLOT_MAX_REQUEUES = 8
+INGEST_DELAYED_KEY = "invoice_ingest_delayed"
+
+# Bekleyen/çalışan ingest işi bu kadar olunca mail çekme durur
+# (site config: "invoice_ingest_backpressure_depth")
+BACKPRESSURE_DEPTH = 200
+# Öncelik başına bekleyen/çalışan ingest işleri: {job_id: kuyruğa eklenme zamanı}.
+# Frappe kuyruklarının tamamı değil sadece bu uygulamanın işleri sayılır. Bitişi hiç
+# yazılamayan (öldürülen worker) işler bu süre sonunda sayımdan düşer.
+INGEST_PENDING_KEY = "invoice_ingest_pending"
+PENDING_JOB_TTL = 6 * 60 * 60
+
+# Başarısız attachment'lar için toplam deneme sayısı
+INGEST_MAX_ATTEMPTS = 3
+# Tekrar denemeden önce bekleme: taban * 4^(n-2) sn (2. deneme 1 dk, 3. deneme 4 dk sonra);
+# site config: "invoice_ingest_retry_backoff". Zamanı gelen denemeleri cron kuyruğa ekler.
+INGEST_RETRY_BACKOFF = 60
+INGEST_RETRY_KEY = "invoice_ingest_retry"
+
+JOB_STATUS_TTL = 24 * 60 * 60
+
+
+def get_ingest_queue(priority=PRIORITY_INVOICE):
+    from frappe.utils.background_jobs import get_queues_timeout
+
+    if frappe.conf.get("invoice_ingest_queue"):
+        return frappe.conf.get("invoice_ingest_queue")
+    queues = {**INGEST_PRIORITY_QUEUES, **(frappe.conf.get("invoice_ingest_priority_queues") or {})}
+    queue = queues.get(priority)
+    return queue if queue in get_queues_timeout() else INGEST_QUEUE
+
+
+def get_ingest_job_id(communication_name, attempt=1):
+    job_id = f"invoice_ingest::{communication_name}"
+    return job_id if attempt == 1 else f"{job_id}::retry{attempt}"
+
+
+def get_attachment_job_id(communication_name, file_name, attempt=1, requeues=0):
+    job_id = f"{get_ingest_job_id(communication_name, attempt)}::{file_name}"
+    return f"{job_id}::requeue{requeues}" if requeues else job_id
+
+
+def enqueue_invoice_email(communication_name, attempt=1):
+    """Communication işleme işini kuyruğa ekle (Communication başına tek iş)
+
+    Aynı Communication için kuyrukta/çalışan iş varsa yenisi eklenmez.
+    """
+    from frappe.utils.background_jobs import is_job_enqueued
+
+    job_id = get_ingest_job_id(communication_name, attempt)
+    if not frappe.flags.in_test and is_job_enqueued(job_id):
+        return False
+
+    set_ingest_job_status(communication_name, "Queued", attempt=attempt)
+    track_ingest_job(job_id)
+    frappe.enqueue(
+        "invoice.api.invoice_email_handler.process_invoice_email_job",
+        queue=get_ingest_queue(),
+        timeout=INGEST_JOB_TIMEOUT,
+        job_id=job_id,
+        deduplicate=True,
+        enqueue_after_commit=True,
+        now=frappe.flags.in_test,
+        communication_name=communication_name,
+        attempt=attempt
+    )
+    return True
+
+
+def get_retry_backoff():
+    return frappe.utils.cint(frappe.conf.get("invoice_ingest_retry_backoff", INGEST_RETRY_BACKOFF))
+
+
+def schedule_ingest_retry(communication_name, attempt):
+    """attempt numaralı denemeyi hemen değil backoff süresi sonrasına planla"""
+    delay = get_retry_backoff() * 4 ** max(attempt - 2, 0)
+    frappe.cache.zadd(frappe.cache.make_key(INGEST_RETRY_KEY), {f"{communication_name}::{attempt}": time.time() + delay})
+    set_ingest_job_status(
+        communication_name, "Retrying", attempt=attempt - 1,
+        next_attempt_at=frappe.utils.add_to_date(frappe.utils.now_datetime(), seconds=delay, as_string=True, as_datetime=True)
+    )
+
+
+def enqueue_due_ingest_retries():
+    """Scheduler (cron): zamanı gelen tekrar denemelerini ve ertelenmiş PDF işlerini kuyruğa ekle"""
+    key = frappe.cache.make_key(INGEST_RETRY_KEY)
+    for member in frappe.cache.zrangebyscore(key, 0, time.time()):
+        # Aynı anda çalışan iki scheduler'dan sadece zrem'i başaran kuyruğa ekler
+        if not frappe.cache.zrem(key, member):
+            continue
+        communication_name, attempt = frappe.safe_decode(member).rsplit("::", 1)
+        enqueue_invoice_email(communication_name, attempt=int(attempt))
+
+    key = frappe.cache.make_key(INGEST_DELAYED_KEY)
+    for member in frappe.cache.zrangebyscore(key, 0, time.time()):
+        if not frappe.cache.zrem(key, member):
+            continue
+        enqueue_invoice_attachment(**json.loads(member))
+    frappe.db.commit()
+
+
+def enqueue_invoice_attachment(communication_name, file_name, attempt=1,
+        priority=PRIORITY_INVOICE, platform=None, requeues=0):
+    """Tek bir PDF attachment'ı için işleme işini öncelik kuyruğuna ekle"""
+    job_id = get_attachment_job_id(communication_name, file_name, attempt, requeues)
+
+    track_ingest_job(job_id, priority)
+    frappe.enqueue(
+        "invoice.api.invoice_email_handler.process_invoice_attachment_job",
+        queue=get_ingest_queue(priority),
+        timeout=INGEST_JOB_TIMEOUT,
+        job_id=job_id,
+        now=frappe.flags.in_test,
+        communication_name=communication_name,
+        file_name=file_name,
+        attempt=attempt,
+        priority=priority,
+        platform=platform,
+        requeues=requeues
+    )
+
+
+def get_platform_slot_delay(requeues):
+    return min(PLATFORM_SLOT_RETRY_DELAY * 2 ** max(requeues - 1, 0), PLATFORM_SLOT_MAX_DELAY)
+
+
+def requeue_invoice_attachment(communication_name, file_name, attempt=1,
+        priority=PRIORITY_INVOICE, platform=None, requeues=1):
+    """Slot bulamayan PDF işini gecikmeyle tekrar kuyruğa ekle; sınır aşıldıysa False"""
+    if requeues > PLATFORM_SLOT_MAX_REQUEUES:
+        return False
+
+    job = {
+        "communication_name": communication_name,
+        "file_name": file_name,
+        "attempt": attempt,
+        "priority": priority,
+        "platform": platform,
+        "requeues": requeues,
+    }
+    frappe.cache.zadd(
+        frappe.cache.make_key(INGEST_DELAYED_KEY),
+        {json.dumps(job, sort_keys=True): time.time() + get_platform_slot_delay(requeues)}
+    )
+    return True
+
+
+def get_attachment_priority(file_name):
+    """Dosya adından ucuz öncelik tahmini (PDF açılmaz)"""
+    name = (file_name or "").lower()
+    if "netting_report" in name:
+        return PRIORITY_NETTING
+    if "report" in name:
+        return PRIORITY_REPORT
+    return PRIORITY_INVOICE
+
+
+def get_platform_concurrency():
+    return frappe.utils.cint(frappe.conf.get("invoice_ingest_platform_concurrency")) or PLATFORM_CONCURRENCY
+
+
+@contextmanager
+def platform_slot(platform):
+    """Platform başına eşzamanlılık sınırı (Redis kilit slotları)
+
+    Boş slot varsa True, yoksa beklemeden False yield eder. Slot kilidi kısa TTL
+    ile alınır ve iş sürdükçe arka plan thread'inde yenilenir.
+    """
+    platform = platform or "unknown"
+    for slot in range(get_platform_concurrency()):
+        lock = frappe.cache.lock(
+            frappe.cache.make_key(f"invoice_lock:ingest_slot:{platform}:{slot}"),
+            timeout=PLATFORM_SLOT_TTL
+        )
+        if lock.acquire(blocking=False):
+            break
+    else:
+        yield False
+        return
+
+    stop = threading.Event()
+
+    def keep_alive():
+        while not stop.wait(PLATFORM_SLOT_TTL / 3):
+            try:
+                lock.reacquire()
+            except Exception:
+                # Kilit düşmüş; slot artık sayılmaz
+                return
+
+    heartbeat = threading.Thread(target=keep_alive, daemon=True)
+    heartbeat.start()
+    try:
+        yield True
+    finally:
+        stop.set()
+        heartbeat.join()
+        try:
+            lock.release()
+        except Exception as e:
+            logger.warning(f"Slot kilidi bırakılamadı ({platform}): {str(e)}")
+
+
+def get_pending_key(priority):
+    return frappe.cache.make_key(f"{INGEST_PENDING_KEY}:{priority}")
+
+
+def track_ingest_job(job_id, priority=PRIORITY_INVOICE):
+    """Kuyruğa eklenen ingest işini say (bitince untrack_ingest_job)"""
+    frappe.cache.zadd(get_pending_key(priority), {job_id: time.time()})
+
+
+def untrack_ingest_job(job_id, priority=PRIORITY_INVOICE):
+    frappe.cache.zrem(get_pending_key(priority), job_id)
+
+
+def get_ingest_queue_depths():
+    """Öncelik başına bekleyen/çalışan ingest işi sayısı"""
+    pipe = frappe.cache.pipeline()
+    for priority in INGEST_PRIORITY_QUEUES:
+        pipe.zremrangebyscore(get_pending_key(priority), 0, time.time() - PENDING_JOB_TTL)
+        pipe.zcard(get_pending_key(priority))
+    counts = pipe.execute()[1::2]
+
+    return {
+        priority: {"queue": get_ingest_queue(priority), "depth": count}
+        for priority, count in zip(INGEST_PRIORITY_QUEUES, counts)
+    }
+
+
+def get_backpressure_depth():
+    return frappe.utils.cint(frappe.conf.get("invoice_ingest_backpressure_depth")) or BACKPRESSURE_DEPTH
+
+
+def get_ingest_backlog(depths=None):
+    """Bekleyen/çalışan ve slot beklerken ertelenmiş ingest işleri"""
+    depths = depths or get_ingest_queue_depths()
+    delayed = frappe.cache.zcard(frappe.cache.make_key(INGEST_DELAYED_KEY))
+    return sum(row["depth"] for row in depths.values()) + delayed
+
+
+def is_ingest_backlogged():
+    """Bekleyen ingest işleri sınırı aştıysa (mail çekme yavaşlamalı) True"""
+    return get_ingest_backlog() >= get_backpressure_depth()
+
+
+@frappe.whitelist()
+def get_ingest_queue_metrics():
+    """Server method: ingest kuyruk derinlikleri, platform slotları ve backpressure durumu"""
+    frappe.only_for("System Manager")
+
+    depths = get_ingest_queue_depths()
+    backlog = get_ingest_backlog(depths)
+    concurrency = get_platform_concurrency()
+
+    pipe = frappe.cache.pipeline()
+    for platform in INGEST_PLATFORMS:
+        for slot in range(concurrency):
+            pipe.exists(frappe.cache.make_key(f"invoice_lock:ingest_slot:{platform}:{slot}"))
+    held = pipe.execute()
+
+    return {
+        "queues": depths,
+        "backlog": backlog,
+        "backpressure_depth": get_backpressure_depth(),
+        "backpressure": backlog >= get_backpressure_depth(),
+        "platform_concurrency": concurrency,
+        "delayed": frappe.cache.zcard(frappe.cache.make_key(INGEST_DELAYED_KEY)),
+        "running": {
+            platform: sum(held[i * concurrency:(i + 1) * concurrency])
+            for i, platform in enumerate(INGEST_PLATFORMS)
+        },
+    }
+
+
+def set_ingest_job_status(communication_name, status, **details):
+    """İş durumunu cache'e yaz (Queued / Running / Processing / Retrying / Busy / Finished / Failed)"""
+    frappe.cache.set_value(
+        f"invoice_ingest_status:{communication_name}",
+        {"status": status, "updated": frappe.utils.now(), **details},
+        expires_in_sec=JOB_STATUS_TTL
+    )
+
+
+@frappe.whitelist()
+def get_ingest_job_status(communication_name):
+    """Server method: Communication'ın fatura işleme durumunu döndür"""
+    frappe.has_permission("Communication", doc=communication_name, throw=True)
+    return frappe.cache.get_value(f"invoice_ingest_status:{communication_name}")
+
+
+# ---------------------------------------------------------------------------
+# Email başına sonuç toplama (Redis)
+# ---------------------------------------------------------------------------
+
+# Her PDF ayrı bir işte (farklı worker'larda) işlenir. Sonuçlar Communication
+# başına bir Redis hash'inde atomik olarak toplanır; "remaining" sayacını
+# sıfıra indiren iş son iştir ve özet bildirimini o gönderir.
+
+BATCH_COUNTERS = ("already_processed", "newly_processed", "errors", "failed_attachments")
+
+# Çöken işler yüzünden yarım kalan batch'ler bu süre sonunda düşer
+BATCH_TTL = 6 * 60 * 60
+
+
+def get_ingest_batch_key(communication_name):
+    return frappe.cache.make_key(f"invoice_ingest_batch:{communication_name}")
+
+
+def start_ingest_batch(communication_name, attempt, file_names, subject, total_detected):
+    """Communication için batch başlat. Süren bir batch varsa False döner."""
+    key = get_ingest_batch_key(communication_name)
+    if not frappe.cache.hsetnx(key, "remaining", len(file_names)):
+        return False
+
+    pipe = frappe.cache.pipeline()
+    pipe.hset(key, mapping={
+        "attempt": attempt,
+        "subject": subject or "",
+        "total_detected": total_detected,
+        "files": len(file_names),
+        **{field: 0 for field in BATCH_COUNTERS},
+    })
+    pipe.expire(key, BATCH_TTL)
+    pipe.execute()
+    return True
+
+
+# Batch yoksa (TTL ile düşmüş / temizlenmiş) hiçbir şey yazmaz ve nil döner;
+# aksi halde hincrby boş bir hash'te remaining=-1 oluşturur ve email hiç kapanmaz.
+# KEYS: batch, invoices, netting
+# ARGV: ttl, invoice json ("" = yok), netting dosyası ("" = yok), alan1, artış1, ...
+RECORD_RESULT_SCRIPT = """
+if redis.call("exists", KEYS[1]) == 0 then
+    return false
+end
+for i = 4, #ARGV, 2 do
+    redis.call("hincrby", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if ARGV[2] ~= "" then
+    redis.call("rpush", KEYS[2], ARGV[2])
+end
+if ARGV[3] ~= "" then
+    redis.call("rpush", KEYS[3], ARGV[3])
+end
+for _, key in ipairs(KEYS) do
+    redis.call("expire", key, ARGV[1])
+end
+return redis.call("hincrby", KEYS[1], "remaining", -1)
+"""
+
+
+def record_attachment_result(communication_name, result):
+    """PDF sonucunu batch'e ekle, kalan PDF sayısını döndür (0 ise son iş bu)
+
+    result: BATCH_COUNTERS artışları, oluşan fatura ("invoice") ve ikinci tura
+    bırakılan netting raporu ("netting_file"). Batch artık yoksa None döner.
+    """
+    key = get_ingest_batch_key(communication_name)
+    args = [
+        BATCH_TTL,
+        json.dumps(result["invoice"]) if result.get("invoice") else "",
+        result.get("netting_file") or "",
+    ]
+    for field in BATCH_COUNTERS:
+        if result.get(field):
+            args += [field, result[field]]
+
+    remaining = frappe.cache.register_script(RECORD_RESULT_SCRIPT)(
+        keys=[key, f"{key}:invoices", f"{key}:netting"], args=args
+    )
+    return None if remaining is None else int(remaining)
+
+
+def get_ingest_batch(communication_name):
+    """Batch'in toplanmış istatistiklerini döndür"""
+    key = get_ingest_batch_key(communication_name)
+    pipe = frappe.cache.pipeline()
+    pipe.hgetall(key)
+    pipe.lrange(f"{key}:invoices", 0, -1)
+    pipe.lrange(f"{key}:netting", 0, -1)
+    values, invoices, netting = pipe.execute()
+
+    values = {k.decode(): v.decode() for k, v in values.items()}
+    return {
+        "attempt": int(values.get("attempt") or 1),
+        "subject": values.get("subject", ""),
+        "total_detected": int(values.get("total_detected") or 0),
+        "files": int(values.get("files") or 0),
+        **{field: int(values.get(field) or 0) for field in BATCH_COUNTERS},
+        "invoices_created": [json.loads(inv) for inv in invoices],
+        "netting_files": [name.decode() for name in netting],
+    }
+
+
+def clear_ingest_batch(communication_name):
+    key = get_ingest_batch_key(communication_name)
+    frappe.cache.delete(key, f"{key}:invoices", f"{key}:netting")
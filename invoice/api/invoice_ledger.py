@@ -0,0 +1,199 @@
+"""
+Platformlar arası fatura defteri (Invoice Ledger Entry)
+
+Üç platform DocType'ı farklı alan adları kullanıyor; defter her fatura için
+tek, dar bir satır tutar. Fatura yazıldıkça doc_events ile güncellenir,
+geçmiş kayıtlar backfill_invoice_ledger ile doldurulur.
+"""
+
+import frappe
+
+from invoice.invoice.doctype.invoice_ledger_entry.invoice_ledger_entry import get_ledger_entry_name
+
+logger = frappe.logger("invoice.ledger", allow_site=frappe.local.site)
+
+LEDGER_DOCTYPE = "Invoice Ledger Entry"
+
+# Defter alanı -> platform DocType'ındaki kaynak alan (tuple: alanların toplamı)
+# fee_amount / vat_amount: platformun kestiği ücretin neti ve KDV'si
+LEDGER_FIELD_MAP = {
+    "Lieferando Invoice": {
+        "platform": "Lieferando",
+        "gross_amount": "total_revenue",
+        # subtotal (Zwischensumme) değil: ücret kalemleri açıkça toplanır
+        "fee_amount": ("service_fee_amount", "admin_fee_amount"),
+        "vat_amount": "tax_amount",
+        "payout_amount": "auszahlung_gesamt",
+    },
+    "Wolt Invoice": {
+        "platform": "Wolt",
+        "gross_amount": "goods_gross_total",
+        "fee_amount": "distribution_net_total",
+        "vat_amount": "distribution_vat_total",
+        "payout_amount": "end_amount_gross",
+    },
+    "Uber Eats Invoice": {
+        "platform": "Uber Eats",
+        "gross_amount": "gross_revenue_after_discounts",
+        "fee_amount": "net_amount",
+        "vat_amount": "vat_amount",
+        "payout_amount": "total_payout",
+    },
+}
+
+AMOUNT_FIELDS = ("gross_amount", "fee_amount", "vat_amount", "payout_amount")
+COMMON_FIELDS = ("name", "invoice_number", "restaurant_name", "period_start", "period_end", "invoice_date")
+
+BACKFILL_CHUNK_SIZE = 500
+
+
+def build_ledger_values(invoice_doctype, invoice):
+    """Fatura kaydından (Document veya get_all satırı) defter değerlerini çıkar"""
+    mapping = LEDGER_FIELD_MAP[invoice_doctype]
+    period_ref = invoice.get("period_end") or invoice.get("invoice_date")
+
+    values = {
+        "platform": mapping["platform"],
+        "restaurant_name": invoice.get("restaurant_name"),
+        "period_start": invoice.get("period_start"),
+        "period_end": invoice.get("period_end"),
+        "invoice_date": invoice.get("invoice_date"),
+        "period_month": str(period_ref)[:7] if period_ref else None,
+        "invoice_number": invoice.get("invoice_number"),
+    }
+    for ledger_field in AMOUNT_FIELDS:
+        values[ledger_field] = sum(invoice.get(field) or 0 for field in get_source_fields(mapping, ledger_field))
+
+    return values
+
+
+def get_source_fields(mapping, ledger_field):
+    source = mapping[ledger_field]
+    return source if isinstance(source, tuple) else (source,)
+
+
+def upsert_ledger_entry(invoice_doctype, invoice):
+    """Faturanın defter satırını oluştur ya da güncelle"""
+    values = build_ledger_values(invoice_doctype, invoice)
+    entry_name = get_ledger_entry_name(invoice_doctype, invoice.get("name"))
+
+    if frappe.db.exists(LEDGER_DOCTYPE, entry_name):
+        frappe.db.set_value(LEDGER_DOCTYPE, entry_name, values)
+        return entry_name
+
+    entry = frappe.get_doc({
+        "doctype": LEDGER_DOCTYPE,
+        "invoice_doctype": invoice_doctype,
+        "invoice_name": invoice.get("name"),
+        **values
+    })
+    entry.insert(ignore_permissions=True)
+    return entry.name
+
+
+def sync_invoice_ledger(doc, method=None):
+    """doc_events: fatura kaydedildiğinde defter satırını güncelle"""
+    if doc.doctype not in LEDGER_FIELD_MAP:
+        return
+
+    try:
+        upsert_ledger_entry(doc.doctype, doc)
+    except Exception as e:
+        # Defter hatası fatura kaydını engellememeli
+        logger.error(f"Ledger güncelleme hatası ({doc.doctype} / {doc.name}): {str(e)}")
+        frappe.log_error(
+            title="Invoice Ledger Sync Error",
+            message=f"Invoice: {doc.doctype} / {doc.name}\nError: {str(e)}\n{frappe.get_traceback()}"
+        )
+
+
+def remove_invoice_ledger(doc, method=None):
+    """doc_events: iptal edilen / silinen faturanın defter satırını kaldır"""
+    if doc.doctype not in LEDGER_FIELD_MAP:
+        return
+
+    entry_name = get_ledger_entry_name(doc.doctype, doc.name)
+    if frappe.db.exists(LEDGER_DOCTYPE, entry_name):
+        frappe.delete_doc(LEDGER_DOCTYPE, entry_name, ignore_permissions=True, force=True)
+
+
+def backfill_invoice_ledger(chunk_size=BACKFILL_CHUNK_SIZE, doctypes=None):
+    """Geçmiş faturalardan defteri doldur (tekrar çalıştırılabilir; doctypes: sadece bu platformlar)"""
+    total = 0
+    for invoice_doctype, mapping in LEDGER_FIELD_MAP.items():
+        if doctypes and invoice_doctype not in doctypes:
+            continue
+        fields = list(COMMON_FIELDS) + [field for f in AMOUNT_FIELDS for field in get_source_fields(mapping, f)]
+        start = 0
+        while True:
+            rows = frappe.get_all(invoice_doctype,
+                filters={"docstatus": ["<", 2]},
+                fields=fields,
+                order_by="creation asc",
+                limit_start=start,
+                limit_page_length=chunk_size
+            )
+            if not rows:
+                break
+
+            for row in rows:
+                upsert_ledger_entry(invoice_doctype, row)
+            frappe.db.commit()
+
+            total += len(rows)
+            start += chunk_size
+
+        logger.info(f"{invoice_doctype} deftere aktarıldı (toplam: {total})")
+
+    return total
+
+
+@frappe.whitelist()
+def enqueue_invoice_ledger_backfill():
+    """Server method: Defter backfill işini arka planda başlat"""
+    frappe.only_for("System Manager")
+    frappe.enqueue(
+        "invoice.api.invoice_ledger.backfill_invoice_ledger",
+        queue="long",
+        timeout=3600,
+        job_id="invoice_ledger_backfill",
+        deduplicate=True
+    )
+    return {"queued": True}
+
+
+@frappe.whitelist()
+def get_platform_payouts(from_month=None, to_month=None, platform=None, restaurant_name=None):
+    """Platform / restoran / ay bazında toplamlar (sadece defter tablosundan okunur)
+
+    Args:
+        from_month: "YYYY-MM" (dahil)
+        to_month: "YYYY-MM" (dahil)
+        platform: Lieferando | Wolt | Uber Eats
+        restaurant_name: Restoran adı
+    """
+    filters = []
+    if from_month:
+        filters.append(["period_month", ">=", from_month])
+    if to_month:
+        filters.append(["period_month", "<=", to_month])
+    if platform:
+        filters.append(["platform", "=", platform])
+    if restaurant_name:
+        filters.append(["restaurant_name", "=", restaurant_name])
+
+    return frappe.get_all(LEDGER_DOCTYPE,
+        filters=filters,
+        fields=[
+            "period_month",
+            "platform",
+            "restaurant_name",
+            "count(name) as invoice_count",
+            "sum(gross_amount) as gross_amount",
+            "sum(fee_amount) as fee_amount",
+            "sum(vat_amount) as vat_amount",
+            "sum(payout_amount) as payout_amount",
+        ],
+        group_by="period_month, platform, restaurant_name",
+        order_by="period_month desc, platform asc, restaurant_name asc"
+    )
@@ -0,0 +1,52 @@
+"""
+Worker'lar arası kilitler (Redis)
+
+Birden fazla worker aynı email'i / aynı faturayı aynı anda işleyebilir.
+Kilitler timeout ile otomatik düşer; çöken bir worker kilidi sonsuza
+kadar tutamaz.
+"""
+
+import re
+from contextlib import contextmanager
+
+import frappe
+
+logger = frappe.logger("invoice.locks", allow_site=frappe.local.site)
+
+# Kilidin en fazla tutulabileceği süre (sn) - PDF işleme + insert için yeterli
+LOCK_TIMEOUT = 300
+
+# Fatura numarası kilidi için bekleme süresi (sn)
+INVOICE_LOCK_WAIT = 30
+
+
+class InvoiceBusyError(frappe.ValidationError):
+    """Kilit başka bir worker'da: iş tamamlanmadı, tekrar denenmeli"""
+
+
+@contextmanager
+def invoice_lock(name, timeout=LOCK_TIMEOUT, blocking_timeout=INVOICE_LOCK_WAIT):
+    """Site bazlı Redis kilidi. Kilit alınabildiyse True, alınamadıysa False yield eder.
+
+    blocking_timeout=0 ise beklemeden döner (kilit başkasındaysa False).
+    """
+    lock = frappe.cache.lock(
+        frappe.cache.make_key(f"invoice_lock:{name}"),
+        timeout=timeout,
+        blocking_timeout=blocking_timeout or None
+    )
+    acquired = lock.acquire(blocking=bool(blocking_timeout))
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except Exception as e:
+                # Timeout dolduysa kilit zaten düşmüştür
+                logger.warning(f"Kilit bırakılamadı ({name}): {str(e)}")
+
+
+def canonical_invoice_number(invoice_number):
+    """Kilit anahtarı için normalize edilmiş Rechnungsnummer"""
+    return re.sub(r"\s+", "", invoice_number or "").upper()
@@ -0,0 +1,113 @@
+"""
+Wolt netting raporu -> Wolt Invoice bağlantısı
+
+Netting raporu faturasından önce gelebilir (aynı email'deki PDF'ler ayrı
+işlerde işleniyor, ya da fatura sonraki bir email'le geliyor). Bu durumda
+parse edilmiş alanlar ve dosya referansı "Wolt Netting Pending Link"
+kaydında (adı normalize Rechnungsnummer) bekletilir; Wolt Invoice
+oluşturulunca tek PK sorgusuyla bulunup bağlanır. PDF tekrar parse edilmez.
+"""
+
+import json
+
+import frappe
+
+from invoice.api.invoice_locks import canonical_invoice_number, invoice_lock
+
+logger = frappe.logger("invoice.netting", allow_site=frappe.local.site)
+
+PENDING_NETTING_DOCTYPE = "Wolt Netting Pending Link"
+WOLT_INVOICE_DOCTYPE = "Wolt Invoice"
+
+
+def link_netting_report(communication_doc, pdf_attachment, invoice_number, values):
+    """Netting alanlarını Wolt Invoice'a yaz; fatura henüz yoksa bekleyen kayda al
+
+    insert_invoice_once ile aynı kilit kullanılır: fatura insert'i ile
+    netting kontrolü arasında bağlantı kaçmaz.
+    """
+    lock_name = f"{WOLT_INVOICE_DOCTYPE}:{canonical_invoice_number(invoice_number)}"
+    with invoice_lock(lock_name) as acquired:
+        if not acquired:
+            logger.warning(f"Netting kilidi alınamadı, kilitsiz devam ediliyor (Rechnungsnummer: {invoice_number})")
+
+        invoice_name = frappe.db.exists(WOLT_INVOICE_DOCTYPE, {"invoice_number": invoice_number})
+        if invoice_name:
+            print(f"[INVOICE] ✅ Netting raporu Wolt Invoice'a eklenecek (Rechnungsnummer: {invoice_number})")
+            logger.info(f"Netting raporu Wolt Invoice'a eklenecek (Rechnungsnummer: {invoice_number})")
+            apply_netting_values(invoice_name, pdf_attachment.name, values)
+            return invoice_name
+
+        print(f"[INVOICE] ⏳ Wolt Invoice henüz yok, netting raporu bekletiliyor (Rechnungsnummer: {invoice_number})")
+        logger.info(f"Wolt Invoice henüz yok, netting raporu bekletiliyor (Rechnungsnummer: {invoice_number})")
+        defer_netting_report(communication_doc, pdf_attachment, invoice_number, values)
+        frappe.db.commit()
+        return None
+
+
+def defer_netting_report(communication_doc, pdf_attachment, invoice_number, values):
+    """Bekleyen bağlantı kaydını oluştur / güncelle (son gelen rapor geçerli)"""
+    pending_name = canonical_invoice_number(invoice_number)
+    row = {
+        "status": "Pending",
+        "communication": communication_doc.name if communication_doc else None,
+        "file": pdf_attachment.name,
+        "file_name": pdf_attachment.get("file_name"),
+        "netting_values": json.dumps(values, ensure_ascii=False, default=str),
+    }
+
+    if frappe.db.exists(PENDING_NETTING_DOCTYPE, pending_name):
+        frappe.db.set_value(PENDING_NETTING_DOCTYPE, pending_name, row)
+    else:
+        frappe.get_doc({
+            "doctype": PENDING_NETTING_DOCTYPE,
+            "invoice_number": invoice_number,
+            **row
+        }).insert(ignore_permissions=True)
+
+
+def apply_netting_values(invoice_name, file_name, values):
+    """Netting PDF'ini ve parse edilmiş alanları Wolt Invoice'a yaz"""
+    from invoice.api.invoice_email_handler import attach_pdf_to_invoice_with_field
+
+    attach_pdf_to_invoice_with_field(frappe._dict(name=file_name), invoice_name, WOLT_INVOICE_DOCTYPE, "netting_report_pdf")
+    frappe.db.set_value(WOLT_INVOICE_DOCTYPE, invoice_name, values)
+    frappe.db.commit()
+
+
+def resolve_pending_netting(doc, method=None):
+    """doc_events (Wolt Invoice after_insert): bekleyen netting raporu varsa bağla
+
+    Insert yolunu uzatmamak için bağlama commit sonrası arka planda yapılır.
+    """
+    if not doc.invoice_number:
+        return
+
+    pending_name = canonical_invoice_number(doc.invoice_number)
+    if frappe.db.get_value(PENDING_NETTING_DOCTYPE, pending_name, "status") != "Pending":
+        return
+
+    frappe.enqueue(
+        "invoice.api.invoice_netting.apply_pending_netting",
+        queue="short",
+        job_id=f"invoice_netting::{pending_name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        now=frappe.flags.in_test,
+        invoice_name=doc.name,
+        pending_name=pending_name
+    )
+
+
+def apply_pending_netting(invoice_name, pending_name):
+    """Arka plan işi: bekleyen netting kaydını Wolt Invoice'a uygula"""
+    pending = frappe.get_doc(PENDING_NETTING_DOCTYPE, pending_name)
+    if pending.status != "Pending":
+        return
+
+    apply_netting_values(invoice_name, pending.file, json.loads(pending.netting_values or "{}"))
+    pending.db_set({"status": "Linked", "linked_invoice": invoice_name})
+    frappe.db.commit()
+
+    print(f"[INVOICE] ✅ Bekleyen netting raporu bağlandı: {invoice_name}")
+    logger.info(f"Bekleyen netting raporu bağlandı: {invoice_name} ({pending.file_name})")
@@ -0,0 +1,278 @@
+"""
+Fatura işleme bildirimleri
+
+İlerleme (realtime): tek kanal, PROGRESS_EVENT. Her email'in son durumu
+Redis'te tutulur; değişen tüm email'ler tek bir event'te site odasına
+yayınlanır (email başına flush başına en fazla bir kayıt). Ara ilerleme en
+fazla PROGRESS_INTERVAL'de bir gönderilir; aralık içinde kalan kayıtları bir
+sonraki ilerleme ya da scheduler (cron) gönderir. Biten email'ler hemen
+gönderilir. Liste görünümleri bunu tek bir canlı toast olarak gösterir.
+
+Özet (Notification Log): her email'in özeti tampona eklenir. Tampon, son
+gönderimden bu yana pencere süresi dolduysa hemen, dolmadıysa scheduler
+(cron, dakikada bir) tarafından tek bir digest olarak gönderilir.
+
+Alıcı listesi (aktif System User'lar) önbellekte tutulur, User değişince düşer.
+"""
+
+import json
+import time
+
+import frappe
+
+from invoice.api.invoice_locks import invoice_lock
+
+logger = frappe.logger("invoice.notifications", allow_site=frappe.local.site)
+
+RECIPIENTS_CACHE_KEY = "invoice_notification_recipients"
+BUFFER_KEY = "invoice_notification_buffer"
+LAST_FLUSH_KEY = "invoice_notification_last_flush"
+
+# İki digest arasındaki en kısa süre (sn); site_config: invoice_notification_window
+NOTIFICATION_WINDOW = 60
+# Gönderilemeyen tampon en fazla bu kadar tutulur (sn)
+BUFFER_TTL = 6 * 60 * 60
+# Digest mesajında listelenen fatura sayısı
+DIGEST_INVOICE_LIMIT = 5
+
+PROGRESS_EVENT = "invoice_ingest_progress"
+PROGRESS_KEY = "invoice_ingest_progress"
+LAST_PROGRESS_FLUSH_KEY = "invoice_ingest_progress_last_flush"
+# İki ilerleme event'i arasındaki en kısa süre (sn); site_config: invoice_progress_interval
+PROGRESS_INTERVAL = 2
+
+
+def get_notification_window():
+    return frappe.utils.cint(frappe.conf.get("invoice_notification_window", NOTIFICATION_WINDOW))
+
+
+def get_notification_recipients():
+    """Aktif System User'lar (önbellekten)"""
+    return frappe.cache.get_value(RECIPIENTS_CACHE_KEY, generator=load_notification_recipients)
+
+
+def load_notification_recipients():
+    return frappe.get_all("User",
+        filters={"enabled": 1, "user_type": "System User"},
+        pluck="name"
+    )
+
+
+def clear_notification_recipients_cache(doc=None, method=None):
+    """doc_events: User eklenince / değişince / silinince alıcı listesini düşür"""
+    frappe.cache.delete_value(RECIPIENTS_CACHE_KEY)
+
+
+def queue_email_summary(stats, email_subject):
+    """Email özetini tampona ekle; pencere dolduysa digest'i hemen gönder"""
+    total_detected = stats.get("total_detected", 0)
+    already_processed = stats.get("already_processed", 0)
+    if total_detected == 0 and already_processed == 0:
+        print(f"[INVOICE] Bildirim gönderilmedi - istatistik yok (total={total_detected}, already={already_processed})")
+        logger.info("Bildirim gönderilmedi - istatistik yok")
+        return
+
+    entry = {
+        "subject": email_subject or "",
+        "total_detected": total_detected,
+        "already_processed": already_processed,
+        "newly_processed": stats.get("newly_processed", 0),
+        "errors": stats.get("errors", 0),
+        "invoices_created": stats.get("invoices_created", [])[:DIGEST_INVOICE_LIMIT],
+        "invoice_count": len(stats.get("invoices_created", [])),
+    }
+    key = frappe.cache.make_key(BUFFER_KEY)
+    pipe = frappe.cache.pipeline()
+    pipe.rpush(key, json.dumps(entry, default=str))
+    pipe.expire(key, BUFFER_TTL)
+    pipe.execute()
+
+    if time.time() - (frappe.cache.get_value(LAST_FLUSH_KEY) or 0) >= get_notification_window():
+        flush_notification_digest(force=True)
+
+
+def flush_notification_digest(force=False):
+    """Scheduler (cron): tampondaki özetleri tek digest olarak gönder"""
+    if not force and time.time() - (frappe.cache.get_value(LAST_FLUSH_KEY) or 0) < get_notification_window():
+        return
+
+    # Aynı anda tek flush: diğer worker tamponu zaten boşaltıyor
+    with invoice_lock("notification_flush", timeout=60, blocking_timeout=0) as acquired:
+        if not acquired:
+            return
+
+        key = frappe.cache.make_key(BUFFER_KEY)
+        pipe = frappe.cache.pipeline()
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        raw_entries, _deleted = pipe.execute()
+        if not raw_entries:
+            return
+
+        frappe.cache.set_value(LAST_FLUSH_KEY, time.time())
+        entries = [json.loads(raw) for raw in raw_entries]
+        send_digest(entries)
+
+
+def send_digest(entries):
+    totals = {
+        field: sum(entry[field] for entry in entries)
+        for field in ("total_detected", "already_processed", "newly_processed", "errors")
+    }
+    message = build_digest_message(entries, totals)
+
+    # Notification Log (kalıcı bildirim)
+    try:
+        recipients = get_notification_recipients()
+        if not recipients:
+            print(f"[INVOICE] ⚠️ Notification Log gönderilmedi - aktif kullanıcı bulunamadı")
+            logger.warning("Notification Log gönderilmedi - aktif kullanıcı bulunamadı")
+            return
+
+        subject_text = f"Fatura İşleme: {totals['newly_processed']} yeni, {totals['already_processed']} tekrar"
+        if totals["errors"] > 0:
+            subject_text += f", {totals['errors']} hata"
+        if len(entries) > 1:
+            subject_text += f" ({len(entries)} email)"
+
+        written = write_notification_logs(recipients, {
+            "type": "Alert",
+            "document_type": "Communication",
+            "subject": subject_text,
+            "email_content": message,
+        })
+        print(f"[INVOICE] ✅ Digest gönderildi - {len(entries)} email, {written} kullanıcı")
+        logger.info(f"Digest gönderildi - {len(entries)} email, {written} kullanıcı")
+    except Exception as e:
+        logger.error(f"Notification Log gönderme hatası: {str(e)}")
+
+
+def write_notification_logs(recipients, notification):
+    """Notification Log'ları tek multi-row insert ile yaz, yazılan kullanıcı sayısını döndür
+
+    enqueue_create_notification kullanıcı başına ayrı insert yapan bir iş açar; burada
+    bildirimi kapalı ve aynı konulu okunmamış bildirimi olan kullanıcılar atlanır.
+    Digest "Alert" türünde: frappe Alert için email göndermez, after_insert'e gerek yok;
+    zil ikonu burada güncellenir.
+    """
+    disabled = set(frappe.get_all("Notification Settings",
+        filters={"name": ["in", list(recipients)], "enabled": 0},
+        pluck="name"
+    ))
+    # Notification Settings kaydı olmayan kullanıcı varsayılanı kullanır (açık)
+    users = [user for user in dict.fromkeys(recipients) if user not in disabled]
+    if not users:
+        return 0
+
+    unread = set(frappe.get_all("Notification Log",
+        filters={
+            "for_user": ["in", users],
+            "subject": notification["subject"],
+            "read": 0,
+        },
+        pluck="for_user"
+    ))
+    users = [user for user in users if user not in unread]
+    if not users:
+        return 0
+
+    now = frappe.utils.now()
+    fields = [
+        "name", "creation", "modified", "owner", "modified_by", "for_user", "from_user",
+        "type", "document_type", "document_name", "subject", "email_content", "read",
+    ]
+    frappe.db.bulk_insert("Notification Log", fields, [
+        (
+            frappe.generate_hash(length=10), now, now, "Administrator", "Administrator", user, "Administrator",
+            notification["type"], notification.get("document_type"), notification.get("document_name"),
+            notification["subject"], notification.get("email_content"), 0,
+        )
+        for user in users
+    ])
+
+    # bulk_insert after_insert'i çalıştırmaz: zil ikonunu burada güncelle
+    frappe.db.set_value("Notification Settings", {"name": ["in", users]}, "seen", 0, update_modified=False)
+    for user in users:
+        frappe.publish_realtime("notification", user=user, after_commit=True)
+    return len(users)
+
+
+def build_digest_message(entries, totals):
+    from frappe.utils.data import get_url_to_form
+
+    parts = [f"📧 <b>Email İşleme Özeti</b><br>"]
+    if len(entries) == 1:
+        subject = entries[0]["subject"]
+        parts.append(f"<b>Email:</b> {subject[:60]}{'...' if len(subject) > 60 else ''}<br><br>")
+    else:
+        parts.append(f"<b>Email sayısı:</b> {len(entries)}<br><br>")
+
+    if totals["total_detected"] > 0:
+        parts.append(f"✅ <b>Yakalanan Fatura:</b> {totals['total_detected']}<br>")
+    if totals["already_processed"] > 0:
+        parts.append(f"⚠️ <b>Daha Önce İşlenmiş:</b> {totals['already_processed']}<br>")
+    if totals["newly_processed"] > 0:
+        parts.append(f"🆕 <b>Yeni İşlenen:</b> {totals['newly_processed']}<br>")
+    if totals["errors"] > 0:
+        parts.append(f"❌ <b>Hata:</b> {totals['errors']}<br>")
+
+    invoices = [inv for entry in entries for inv in entry["invoices_created"]]
+    invoice_count = sum(entry["invoice_count"] for entry in entries)
+    if invoices:
+        parts.append(f"<br><b>Oluşturulan Faturalar:</b><br>")
+        for inv in invoices[:DIGEST_INVOICE_LIMIT]:
+            platform = inv["doctype"].replace(" Invoice", "")
+            parts.append(f"• <a href='{get_url_to_form(inv['doctype'], inv['name'])}'>{platform} - {inv['invoice_number']}</a><br>")
+        if invoice_count > DIGEST_INVOICE_LIMIT:
+            parts.append(f"... ve {invoice_count - DIGEST_INVOICE_LIMIT} fatura daha<br>")
+
+    return "".join(parts)
+
+
+def get_progress_interval():
+    return frappe.utils.flt(frappe.conf.get("invoice_progress_interval", PROGRESS_INTERVAL))
+
+
+def publish_email_progress(communication_name, batch, finished=False):
+    """Email'in güncel ilerlemesini kaydet; email bittiyse ya da aralık dolduysa hemen yayınla
+
+    batch: get_ingest_batch() ile aynı alanlar (subject, files, sayaçlar, invoices_created)
+    """
+    state = {
+        "communication": communication_name,
+        "subject": (batch.get("subject") or "")[:80],
+        "files": batch.get("files", 0),
+        "done": batch.get("files", 0) if finished else batch.get("done", 0),
+        "new": batch.get("newly_processed", 0),
+        "already": batch.get("already_processed", 0),
+        "errors": batch.get("errors", 0),
+        "invoices": batch.get("invoices_created", [])[:DIGEST_INVOICE_LIMIT],
+        "finished": finished,
+    }
+    key = frappe.cache.make_key(PROGRESS_KEY)
+    pipe = frappe.cache.pipeline()
+    pipe.hset(key, communication_name, json.dumps(state, default=str))
+    pipe.expire(key, BUFFER_TTL)
+    pipe.execute()
+
+    # Aralık dolmadıysa kayıt tamponda kalır (worker beklemez)
+    if finished or time.time() - (frappe.cache.get_value(LAST_PROGRESS_FLUSH_KEY) or 0) >= get_progress_interval():
+        flush_ingest_progress()
+
+
+def flush_ingest_progress():
+    """Bekleyen ilerleme kayıtlarını tek event olarak yayınla (scheduler: cron, dakikada bir)"""
+    with invoice_lock("progress_flush", timeout=30, blocking_timeout=0) as acquired:
+        if not acquired:
+            return
+
+        key = frappe.cache.make_key(PROGRESS_KEY)
+        pipe = frappe.cache.pipeline()
+        pipe.hgetall(key)
+        pipe.delete(key)
+        states, _deleted = pipe.execute()
+        if not states:
+            return
+
+        frappe.cache.set_value(LAST_PROGRESS_FLUSH_KEY, time.time())
+        frappe.publish_realtime(PROGRESS_EVENT, {"emails": [json.loads(state) for state in states.values()]})
@@ -0,0 +1,202 @@
+"""
+AI validation öncesi kural tabanlı (aritmetik) kontrol
+
+Çıkarılan tutarlar kendi içinde tutarlıysa (net + KDV = brüt, oran toplamları,
+KDV oranı, ana toplamın PDF metninde geçmesi) model çağrılmadan sonuç yazılır.
+Kontrol tutmazsa veya ana toplam çıkarılamamışsa fatura modele gönderilir;
+başarısız kontroller prompt'a eklenir. extraction_confidence kapı olarak
+kullanılmaz: extractor'lar başarılı her çıkarımda sabit 60 yazar, bu yüzden
+alan çıkarımın kalitesi hakkında bilgi taşımaz.
+
+DB'ye erişmez; sadece invoice alanlarını ve raw_text'i okur.
+"""
+
+import re
+
+import frappe
+
+# sonuç alanı -> toplanan alanlar ("-" önekli alan çıkarılır)
+SUM_RULES = {
+    "Lieferando Invoice": (
+        ("total_amount", ("subtotal", "tax_amount")),
+        ("outstanding_amount", ("total_amount", "-paid_online_payments")),
+    ),
+    "Wolt Invoice": (
+        ("goods_gross_7", ("goods_net_7", "goods_vat_7")),
+        ("goods_gross_19", ("goods_net_19", "goods_vat_19")),
+        ("goods_net_total", ("goods_net_7", "goods_net_19")),
+        ("goods_vat_total", ("goods_vat_7", "goods_vat_19")),
+        ("goods_gross_total", ("goods_net_total", "goods_vat_total")),
+        ("distribution_gross_total", ("distribution_net_total", "distribution_vat_total")),
+        ("netprice_gross_7", ("netprice_net_7", "netprice_vat_7")),
+        ("netprice_gross_19", ("netprice_net_19", "netprice_vat_19")),
+        ("netprice_gross_total", ("netprice_net_total", "netprice_vat_total")),
+        ("end_amount_gross", ("end_amount_net", "end_amount_vat")),
+        ("netting_wolt_gross", ("netting_wolt_net", "netting_wolt_vat")),
+        ("netting_merchant_gross", ("netting_merchant_net", "netting_merchant_vat")),
+    ),
+    "Uber Eats Invoice": (
+        ("total_amount", ("net_amount", "vat_amount")),
+    ),
+}
+
+# KDV alanı -> (matrah alanı, oran: sabit yüzde veya oran alanı)
+VAT_RULES = {
+    "Lieferando Invoice": (
+        ("tax_amount", "subtotal", "tax_rate"),
+    ),
+    "Wolt Invoice": (
+        ("goods_vat_7", "goods_net_7", 7),
+        ("goods_vat_19", "goods_net_19", 19),
+        ("netprice_vat_7", "netprice_net_7", 7),
+        ("netprice_vat_19", "netprice_net_19", 19),
+    ),
+    "Uber Eats Invoice": (
+        ("vat_amount", "net_amount", 19),
+    ),
+}
+
+# Ana toplam: çıkarılamamışsa (0) veya PDF metninde geçmiyorsa fatura modele gider
+TOTAL_FIELDS = {
+    "Lieferando Invoice": "total_amount",
+    "Wolt Invoice": "end_amount_gross",
+    "Uber Eats Invoice": "total_amount",
+}
+
+# Toplam kontrollerinde kabul edilen yuvarlama farkı
+SUM_TOLERANCE = 0.01
+# Sipariş bazında yuvarlanan KDV toplamı birkaç cent sapabilir
+VAT_TOLERANCE = 0.05
+# Sadece iç tutarlılık ve ana toplam kontrol edilir, alanlar tek tek PDF ile karşılaştırılmaz
+RULES_CONFIDENCE = 0.95
+
+
+def is_prevalidation_enabled():
+    return bool(frappe.utils.cint(frappe.conf.get("invoice_ai_prevalidation", 1)))
+
+
+def run_prevalidation(invoice_doc):
+    """Kontrolleri çalıştır: {"passed", "reason", "checks", "failed"}
+
+    passed=False ise fatura modele gönderilmeli; failed prompt'a eklenir.
+    """
+    doctype = invoice_doc.doctype
+    if doctype not in SUM_RULES:
+        return {"passed": False, "reason": "Kural tanımı yok", "checks": [], "failed": []}
+
+    checks = []
+    for target, terms in SUM_RULES[doctype]:
+        check = check_sum(invoice_doc, target, terms)
+        if check:
+            checks.append(check)
+    for target, base_field, rate in VAT_RULES[doctype]:
+        check = check_vat(invoice_doc, target, base_field, rate)
+        if check:
+            checks.append(check)
+
+    total_field = TOTAL_FIELDS[doctype]
+    total_check = check_total_in_text(invoice_doc, total_field)
+    checks.append(total_check)
+    failed = [check for check in checks if not check["match"]]
+
+    if not get_amount(invoice_doc, total_field):
+        reason = f"Ana toplam ({total_field}) çıkarılamadı"
+    elif failed:
+        reason = f"{len(failed)}/{len(checks)} kontrol tutmadı"
+    else:
+        reason = None
+
+    return {"passed": reason is None, "reason": reason, "checks": checks, "failed": failed}
+
+
+def get_amount(invoice_doc, fieldname):
+    return frappe.utils.flt(invoice_doc.get(fieldname))
+
+
+def check_sum(invoice_doc, target, terms):
+    """target = Σ terms; ilgili alanların hepsi boşsa (fatura türünde yok) None"""
+    fields = (target,) + tuple(term.lstrip("-") for term in terms)
+    if not any(get_amount(invoice_doc, field) for field in fields):
+        return None
+
+    expected = sum(
+        -get_amount(invoice_doc, term[1:]) if term.startswith("-") else get_amount(invoice_doc, term)
+        for term in terms
+    )
+    actual = get_amount(invoice_doc, target)
+    return {
+        "field": target,
+        "rule": f"{target} = " + " ".join(
+            f"- {term[1:]}" if term.startswith("-") else f"+ {term}" for term in terms
+        ).lstrip("+ "),
+        "expected": round(expected, 2),
+        "doctype_value": round(actual, 2),
+        "match": round(abs(expected - actual), 2) <= SUM_TOLERANCE,
+    }
+
+
+def check_vat(invoice_doc, target, base_field, rate):
+    base = get_amount(invoice_doc, base_field)
+    actual = get_amount(invoice_doc, target)
+    if not base and not actual:
+        return None
+
+    rate_value = rate if isinstance(rate, (int, float)) else get_amount(invoice_doc, rate)
+    expected = base * rate_value / 100
+    return {
+        "field": target,
+        "rule": f"{target} = {base_field} × {rate_value:g}%",
+        "expected": round(expected, 2),
+        "doctype_value": round(actual, 2),
+        "match": round(abs(expected - actual), 2) <= VAT_TOLERANCE,
+    }
+
+
+def check_total_in_text(invoice_doc, total_field):
+    """Ana toplam PDF metninde (Alman / düz yazımıyla) geçiyor mu"""
+    total = get_amount(invoice_doc, total_field)
+    text = invoice_doc.get("raw_text") or ""
+    found = bool(total) and any(
+        re.search(rf"(?<![\d.,]){re.escape(candidate)}(?![\d,]|\.\d)", text)
+        for candidate in format_amount_candidates(total)
+    )
+    return {
+        "field": total_field,
+        "rule": f"{total_field} PDF metninde geçiyor",
+        "expected": round(total, 2),
+        "doctype_value": round(total, 2),
+        "match": found,
+    }
+
+
+def format_amount_candidates(amount):
+    """1234.5 -> 1.234,50 / 1234,50 / 1,234.50 / 1234.50"""
+    english = f"{abs(amount):,.2f}"
+    german = english.replace(",", "_").replace(".", ",").replace("_", ".")
+    return {german, german.replace(".", ""), english, english.replace(",", "")}
+
+
+def build_prevalidation_result(outcome):
+    """Kontroller tuttuysa AI yanıtıyla aynı yapıda sonuç (update_ai_validation_fields için)"""
+    checks = outcome["checks"]
+    return {
+        "status": "Valid",
+        "confidence": RULES_CONFIDENCE,
+        "summary": f"Kural kontrolü: {len(checks)} aritmetik kontrol tutarlı (AI çağrılmadı)",
+        "details": {
+            "missing_fields": [],
+            "incorrect_fields": [],
+            "extras_in_pdf": [],
+            "field_comparisons": checks,
+        },
+        "recommendations": [],
+        "method": "rules",
+    }
+
+
+def format_failed_checks(outcome):
+    """Prompt'a eklenecek başarısız kontrol satırları"""
+    return "\n".join(
+        f"- {check['rule']}: expected {check['expected']}, DocType has {check['doctype_value']}"
+        for check in outcome["failed"]
+    )
@@ -0,0 +1,294 @@
+"""
+Geçmiş email'leri toplu yeniden işleme (Invoice Reingest Run)
+
+Communication'lar (creation, name) sırasıyla parça parça okunur; her parça
+triage + ingest log süzgecinden geçirilip bekleyen PDF'i olan email'ler
+normal pipeline'a (enqueue_invoice_email -> attachment işleri) verilir.
+Her parçadan sonra imleç run kaydına yazılır; yarıda kalan run kaldığı
+yerden devam eder. Dry run modunda hiçbir şey kuyruğa eklenmez; rapor
+işlenmemiş PDF'leri gösterir, kaç fatura oluşacağını değil (platform içerik
+tespiti ve duplicate kontrolü PDF parse edilmeden bilinemez).
+"""
+
+import json
+import time
+
+import frappe
+
+from invoice.api.invoice_ingest import (
+    FINISHED_STATES,
+    INGEST_JOB_TIMEOUT,
+    INGEST_LOG_DOCTYPE,
+    enqueue_invoice_email,
+    get_attachment_priority,
+    is_ingest_backlogged,
+)
+from invoice.api.invoice_triage import PLATFORM_KEYS, triage_communication
+from invoice.invoice.doctype.invoice_ingest_log.invoice_ingest_log import get_ingest_log_name
+
+logger = frappe.logger("invoice.reingest", allow_site=frappe.local.site)
+
+REINGEST_RUN_DOCTYPE = "Invoice Reingest Run"
+REINGEST_QUEUE = "long"
+
+# Bir iş bu süreden sonra imleci kaydedip kendini tekrar kuyruğa ekler (sn)
+RUN_SLICE_SECONDS = INGEST_JOB_TIMEOUT - 300
+# Ingest kuyrukları doluyken bekleme (sn)
+BACKLOG_PAUSE = 5
+# Bench komutu kuyruklar boşalana kadar en fazla bu kadar bekler, sonra run durur (sn)
+BACKLOG_MAX_WAIT = 30 * 60
+
+DRY_RUN_NOTE = "Bekleyen (işlenmemiş) PDF'ler; oluşacak fatura sayısı değil"
+
+# Dry run raporunda tutulan örnek satır sayısı
+REPORT_SAMPLE_SIZE = 500
+
+
+def create_reingest_run(from_date=None, to_date=None, sender=None, platform=None, dry_run=0, chunk_size=None):
+    run = frappe.get_doc({
+        "doctype": REINGEST_RUN_DOCTYPE,
+        "from_date": from_date,
+        "to_date": to_date,
+        "sender": sender,
+        "platform": platform,
+        "dry_run": frappe.utils.cint(dry_run),
+        "chunk_size": chunk_size,
+    }).insert(ignore_permissions=True)
+    return run
+
+
+def enqueue_reingest_run(run_name, continuation=None):
+    """Run işini kuyruğa ekle
+
+    continuation: çalışan işin kendi devamı (imleç). Frappe deduplicate'i enqueue
+    anında kontrol eder; aynı job_id'li iş hâlâ çalışırken devam işi düşürülür.
+    Bu yüzden devam işi imleçle ayrı job_id alır, dedupe sadece başlat/devam et içindir.
+    """
+    job_id = f"invoice_reingest::{run_name}"
+    frappe.enqueue(
+        "invoice.api.invoice_reingest.run_invoice_reingest",
+        queue=REINGEST_QUEUE,
+        timeout=INGEST_JOB_TIMEOUT,
+        job_id=f"{job_id}::{continuation}" if continuation else job_id,
+        deduplicate=not continuation,
+        enqueue_after_commit=True,
+        run_name=run_name
+    )
+
+
+def run_invoice_reingest(run_name, time_limit=RUN_SLICE_SECONDS):
+    """Run'ı imleçten itibaren işle; süre dolarsa checkpoint alıp kendini tekrar kuyruğa ekle
+
+    time_limit=None: bitene kadar aynı process'te çalış (bench komutu)
+    """
+    run = frappe.get_doc(REINGEST_RUN_DOCTYPE, run_name)
+    if run.status == "Completed":
+        return run
+
+    run.db_set({"status": "Running", "started_at": run.started_at or frappe.utils.now(), "error": None})
+    frappe.db.commit()
+
+    report = json.loads(run.report or "{}") if run.dry_run else None
+    if report is not None:
+        report["note"] = DRY_RUN_NOTE
+    deadline = time.monotonic() + time_limit if time_limit else None
+
+    try:
+        while True:
+            rows = get_next_chunk(run)
+            if not rows:
+                run.db_set({"status": "Completed", "finished_at": frappe.utils.now()})
+                frappe.db.commit()
+                print(f"[INVOICE] Reingest tamamlandı: {run.name} ({run.scanned} email tarandı, {run.dispatched} kuyruğa eklendi)")
+                logger.info(f"Reingest tamamlandı: {run.name}")
+                return run
+
+            process_reingest_chunk(run, rows, report)
+
+            # Checkpoint: imleç ve sayaçlar her parçadan sonra kaydedilir
+            values = {
+                "cursor_creation": rows[-1].creation,
+                "cursor_name": rows[-1].name,
+                "scanned": run.scanned,
+                "matched": run.matched,
+                "dispatched": run.dispatched,
+                "pending_pdfs": run.pending_pdfs,
+            }
+            if report is not None:
+                values["report"] = json.dumps(report, indent=1, default=str)
+            run.db_set(values)
+            frappe.db.commit()
+
+            if not run.dry_run and is_ingest_backlogged():
+                # Attachment işleri yetişemiyor: imleç kayıtlı, biraz bekleyip sonra devam
+                logger.info(f"Reingest bekliyor, ingest kuyrukları dolu: {run.name}")
+                if deadline:
+                    time.sleep(BACKLOG_PAUSE)
+                    enqueue_reingest_run(run.name, continuation=run.cursor_name)
+                    return run
+                wait_for_ingest_backlog(run)
+
+            if deadline and time.monotonic() >= deadline:
+                enqueue_reingest_run(run.name, continuation=run.cursor_name)
+                return run
+
+    except Exception as e:
+        frappe.db.rollback()
+        run.db_set({"status": "Failed", "error": str(e)[:1000]})
+        frappe.db.commit()
+        frappe.log_error(
+            title="Invoice Reingest Error",
+            message=f"Run: {run.name}\nError: {str(e)}\n{frappe.get_traceback()}"
+        )
+        raise
+
+
+def wait_for_ingest_backlog(run, max_wait=BACKLOG_MAX_WAIT):
+    """Bench komutu: ingest kuyrukları boşalana kadar bekle (en fazla max_wait sn)"""
+    waited = 0
+    while is_ingest_backlogged():
+        if waited >= max_wait:
+            frappe.throw(
+                f"Ingest kuyrukları {max_wait // 60} dk içinde boşalmadı; "
+                f"run checkpoint'ten devam ettirilebilir (--resume {run.name})"
+            )
+        time.sleep(BACKLOG_PAUSE)
+        waited += BACKLOG_PAUSE
+
+
+def get_next_chunk(run):
+    """İmleçten sonraki Communication parçası (keyset pagination, (creation, name) sırası)"""
+    Communication = frappe.qb.DocType("Communication")
+    query = (
+        frappe.qb.from_(Communication)
+        .select(
+            Communication.name, Communication.creation, Communication.subject,
+            Communication.sender, Communication.communication_type, Communication.sent_or_received
+        )
+        .where(Communication.communication_type == "Communication")
+        .where(Communication.sent_or_received == "Received")
+        .orderby(Communication.creation)
+        .orderby(Communication.name)
+        .limit(run.chunk_size or 200)
+    )
+
+    if run.from_date:
+        query = query.where(Communication.creation >= frappe.utils.get_datetime(run.from_date))
+    if run.to_date:
+        query = query.where(Communication.creation < frappe.utils.add_days(frappe.utils.getdate(run.to_date), 1))
+    if run.sender:
+        query = query.where(Communication.sender.like(f"%{run.sender}%"))
+    if run.cursor_creation:
+        cursor = frappe.utils.get_datetime(run.cursor_creation)
+        query = query.where(
+            (Communication.creation > cursor)
+            | ((Communication.creation == cursor) & (Communication.name > run.cursor_name))
+        )
+
+    return query.run(as_dict=True)
+
+
+def process_reingest_chunk(run, rows, report=None):
+    """Parçadaki email'leri süz, bekleyen PDF'i olanları kuyruğa ekle (dry run: raporla)"""
+    from invoice.api.invoice_email_handler import EXTRACTOR_VERSION, detect_platform_from_filename
+
+    run.scanned = (run.scanned or 0) + len(rows)
+    wanted_platform = PLATFORM_KEYS.get(run.platform)
+
+    candidates = {}
+    for row in rows:
+        triage = triage_communication(row)
+        if triage["accept"]:
+            candidates[row.name] = (row, triage)
+    if not candidates:
+        return
+
+    # Parça başına tek File ve tek Ingest Log sorgusu
+    attachments = {}
+    for att in frappe.get_all("File",
+        filters={
+            "attached_to_doctype": "Communication",
+            "attached_to_name": ["in", list(candidates)],
+        },
+        fields=["name", "file_name", "content_hash", "attached_to_name"]
+    ):
+        if (att.file_name or "").lower().endswith(".pdf"):
+            attachments.setdefault(att.attached_to_name, []).append(att)
+
+    finished = {
+        log.name
+        for log in frappe.get_all(INGEST_LOG_DOCTYPE,
+            filters={
+                "communication": ["in", list(attachments)],
+                "extractor_version": EXTRACTOR_VERSION,
+                "state": ["in", FINISHED_STATES],
+            },
+            fields=["name"]
+        )
+    } if attachments else set()
+
+    for name, (row, triage) in candidates.items():
+        pending = [
+            att for att in attachments.get(name, [])
+            if get_ingest_log_name(name, att.name, att.content_hash) not in finished
+        ]
+        if not pending:
+            continue
+
+        platform = (
+            (triage["route"] or {}).get("platform")
+            or next(filter(None, (detect_platform_from_filename(att.file_name) for att in pending)), None)
+            or "unknown"
+        )
+        if wanted_platform and platform != wanted_platform:
+            continue
+
+        run.matched = (run.matched or 0) + 1
+        run.pending_pdfs = (run.pending_pdfs or 0) + len(pending)
+
+        if report is not None:
+            _add_to_report(report, row, platform, pending)
+            continue
+
+        if enqueue_invoice_email(name):
+            run.dispatched = (run.dispatched or 0) + 1
+
+
+def _add_to_report(report, row, platform, pending):
+    totals = report.setdefault("totals", {}).setdefault(platform, {"emails": 0, "pdfs": 0, "by_priority": {}})
+    totals["emails"] += 1
+    totals["pdfs"] += len(pending)
+    for att in pending:
+        priority = get_attachment_priority(att.file_name)
+        totals["by_priority"][priority] = totals["by_priority"].get(priority, 0) + 1
+
+    sample = report.setdefault("sample", [])
+    if len(sample) < REPORT_SAMPLE_SIZE:
+        sample.append({
+            "communication": row.name,
+            "creation": row.creation,
+            "subject": row.subject,
+            "platform": platform,
+            "pdfs": [att.file_name for att in pending],
+        })
+
+
+@frappe.whitelist()
+def start_invoice_reingest(from_date=None, to_date=None, sender=None, platform=None, dry_run=0, chunk_size=None):
+    """Server method: geçmiş email'leri yeniden işleme run'ı başlat"""
+    frappe.only_for("System Manager")
+    run = create_reingest_run(from_date, to_date, sender, platform, dry_run, chunk_size)
+    enqueue_reingest_run(run.name)
+    return run.name
+
+
+@frappe.whitelist()
+def resume_invoice_reingest(run_name):
+    """Server method: yarıda kalan / hata alan run'ı checkpoint'ten devam ettir"""
+    frappe.only_for("System Manager")
+    run = frappe.get_doc(REINGEST_RUN_DOCTYPE, run_name)
+    if run.status == "Completed":
+        frappe.throw(f"Run zaten tamamlanmış: {run_name}")
+    run.db_set("status", "Queued")
+    enqueue_reingest_run(run.name)
+    return run.name
@@ -0,0 +1,188 @@
+"""
+Fatura DocType'ları için önceden hesaplanmış alan şeması
+
+Her PDF için elle yazılmış mapping dict'leri kurmak ve her AI validasyonunda
+meta.fields üzerinde kuralları yeniden uygulamak yerine, DocType başına
+bir kez hesaplanıp cache'lenen alan listeleri kullanılır. DocType,
+Custom Field veya Property Setter değişince cache temizlenir (hooks.py).
+"""
+
+import frappe
+
+logger = frappe.logger("invoice.schema", allow_site=frappe.local.site)
+
+SCHEMA_CACHE_KEY = "invoice_doctype_schema"
+
+INVOICE_DOCTYPES = ("Lieferando Invoice", "Wolt Invoice", "Uber Eats Invoice")
+
+NO_VALUE_FIELDTYPES = ("Section Break", "Column Break", "Tab Break", "HTML", "Button", "Heading", "Fold")
+NUMERIC_FIELDTYPES = ("Currency", "Float", "Int", "Percent", "Check")
+AMOUNT_FIELDTYPES = ("Currency", "Float")
+
+# Extractor'dan değil, başka adımlardan (metadata, netting, AI, kullanıcı) yazılan alanlar
+NON_EXTRACTED_FIELDS = (
+    "status", "pdf_file", "notes", "amended_from",
+    "email_subject", "email_from", "received_date", "processed_date",
+)
+NON_EXTRACTED_PREFIXES = ("ai_validation_", "netting_")
+
+# AI'ya gönderilmeyen standart alanlar (raw_text mesajda ayrıca, sıkıştırılarak gönderilir)
+AI_EXCLUDED_FIELDS = ("name", "doctype", "owner", "creation", "modified", "modified_by", "raw_text")
+# AI'ya gönderilmeyen alan grupları (önceki validation sonucu modeli yönlendirmesin,
+# sonuç önbelleği anahtarı her validation'da değişmesin)
+AI_EXCLUDED_PREFIXES = ("ai_validation_",)
+
+# Default değerleri PDF'te olmayabilecek alanlar (AI'ya işaretli gönderilir)
+AI_DEFAULT_ONLY_FIELDS = ("supplier_email", "supplier_phone")
+
+# DocType alanı -> extractor anahtar(lar)ı; aynı isimli alanlar yazılmaz.
+# Birden fazla anahtar varsa ilk dolu olan kullanılır.
+SOURCE_KEYS = {
+    "Lieferando Invoice": {
+        "ausstehende_am_datum": ("invoice_date",),
+        "ausstehende_onlinebezahlungen_betrag": ("outstanding_balance", "total_revenue"),
+        "rechnungsausgleich_betrag": ("total_amount",),
+        "auszahlung_gesamt": ("payout_amount",),
+        "extraction_confidence": ("confidence",),
+    },
+    "Wolt Invoice": {
+        "extraction_confidence": ("confidence",),
+    },
+    "Uber Eats Invoice": {
+        "extraction_confidence": ("confidence",),
+    },
+}
+
+# Extractor değer bulamazsa kullanılacak sabit değerler
+# (Sayısal alanlar için DocType default'u, o da yoksa 0 kullanılır)
+FALLBACK_VALUES = {
+    "Lieferando Invoice": {
+        "supplier_name": "yd.yourdelivery GmbH",
+        "extraction_confidence": 50,
+    },
+    "Wolt Invoice": {
+        "supplier_name": "Wolt Enterprises Deutschland GmbH",
+        "extraction_confidence": 55,
+    },
+    "Uber Eats Invoice": {
+        "supplier_name": "Uber Eats Germany GmbH",
+        "extraction_confidence": 55,
+    },
+}
+
+# Email'e bağlı fallback'ler (Communication'dan okunur)
+COMMUNICATION_FALLBACKS = {
+    "Lieferando Invoice": {
+        "supplier_email": "sender",
+    },
+}
+
+
+def get_invoice_schema(doctype):
+    """DocType için cache'lenmiş şemayı döndür"""
+    return frappe.cache.hget(SCHEMA_CACHE_KEY, doctype, generator=lambda: build_invoice_schema(doctype))
+
+
+def build_invoice_schema(doctype):
+    """Meta üzerinden tek seferlik şema hesapla
+
+    Dönen yapı:
+        extract_fields: [(fieldname, source_keys, fallback)]
+        ai_fields: [(fieldname, default_only_value)]
+        currency_fields / percent_fields: tip listeleri
+    """
+    meta = frappe.get_meta(doctype)
+    source_keys = SOURCE_KEYS.get(doctype, {})
+    fallbacks = FALLBACK_VALUES.get(doctype, {})
+
+    extract_fields = []
+    ai_fields = []
+    currency_fields = []
+    percent_fields = []
+
+    for field in meta.fields:
+        fieldname = field.fieldname
+        fieldtype = field.fieldtype
+
+        if fieldtype in NO_VALUE_FIELDTYPES:
+            continue
+
+        if fieldtype in AMOUNT_FIELDTYPES:
+            currency_fields.append(fieldname)
+        elif fieldtype == "Percent":
+            percent_fields.append(fieldname)
+
+        if (
+            fieldtype != "Attach"
+            and not field.hidden
+            and fieldname not in AI_EXCLUDED_FIELDS
+            and not fieldname.startswith(AI_EXCLUDED_PREFIXES)
+        ):
+            default_only = field.default if fieldname in AI_DEFAULT_ONLY_FIELDS and field.default else None
+            ai_fields.append((fieldname, default_only))
+
+        if (
+            fieldtype in ("Attach", "Table", "Table MultiSelect")
+            or fieldname in NON_EXTRACTED_FIELDS
+            or fieldname.startswith(NON_EXTRACTED_PREFIXES)
+        ):
+            continue
+
+        fallback = fallbacks.get(fieldname)
+        if fallback is None and fieldtype in NUMERIC_FIELDTYPES:
+            fallback = frappe.utils.flt(field.default) if field.default else 0
+            if fieldtype in ("Int", "Check"):
+                fallback = int(fallback)
+
+        extract_fields.append((fieldname, tuple(source_keys.get(fieldname, (fieldname,))), fallback))
+
+    return {
+        "extract_fields": extract_fields,
+        "ai_fields": ai_fields,
+        "currency_fields": currency_fields,
+        "percent_fields": percent_fields,
+    }
+
+
+def build_invoice_values(doctype, extracted_data, communication_doc=None):
+    """Extractor çıktısından DocType alan değerlerini tek geçişte üret"""
+    schema = get_invoice_schema(doctype)
+    values = {}
+
+    for fieldname, keys, fallback in schema["extract_fields"]:
+        value = None
+        for key in keys:
+            value = extracted_data.get(key)
+            if value is not None and value != "":
+                break
+        if value is None or value == "":
+            value = fallback
+        values[fieldname] = value
+
+    if communication_doc is not None:
+        for fieldname, attr in COMMUNICATION_FALLBACKS.get(doctype, {}).items():
+            if not values.get(fieldname):
+                values[fieldname] = communication_doc.get(attr)
+
+    if not values.get("invoice_date"):
+        values["invoice_date"] = frappe.utils.today()
+
+    return values
+
+
+def clear_invoice_schema_cache(doc=None, method=None):
+    """doc_events: DocType / Custom Field / Property Setter değişince şemayı düşür"""
+    if doc is None:
+        frappe.cache.delete_value(SCHEMA_CACHE_KEY)
+        return
+
+    if doc.doctype == "DocType":
+        doctype = doc.name
+    elif doc.doctype == "Custom Field":
+        doctype = doc.dt
+    else:
+        doctype = doc.get("doc_type")
+
+    if doctype in INVOICE_DOCTYPES:
+        frappe.cache.hdel(SCHEMA_CACHE_KEY, doctype)
+        logger.info(f"Şema cache temizlendi: {doctype}")
@@ -0,0 +1,155 @@
+"""
+AI validation prompt'u için PDF metnini sıkıştırma
+
+raw_text token bütçesine sığıyorsa olduğu gibi gönderilir. Sığmıyorsa satırlar
+puanlanır: platformun bilinen etiketleri (extractor'ların aradığı başlıklar),
+doğrulanan alanların değerlerini içeren satırlar, belge başlığı ve tutar içeren
+satırlar öne çıkar. En yüksek puanlı satırlar bütçe dolana kadar seçilir ve
+orijinal sırasıyla, atlanan kısımlar "[...]" ile işaretlenerek döndürülür;
+sadece tutar içeren satırlar bütçe dolmasa da alınmaz.
+Böylece uzun ekstrelerde toplamlar bölümü kesilmez.
+"""
+
+import re
+
+import frappe
+
+from invoice.api.invoice_prevalidation import format_amount_candidates
+from invoice.api.invoice_schema import get_invoice_schema
+
+# site_config: invoice_ai_prompt_token_budget (PDF metni için)
+DEFAULT_TOKEN_BUDGET = 3000
+# Token tahmini (Almanca/İngilizce karışık metin için yaklaşık)
+CHARS_PER_TOKEN = 4
+# Belgenin ilk satırları (tedarikçi, fatura no, tarihler) her zaman öne çıkar
+HEADER_LINES = 25
+GAP_MARKER = "[...]"
+
+# Extractor'ların aradığı etiketler (invoice_email_handler.extract_*_fields)
+PLATFORM_LABELS = {
+    "Lieferando Invoice": (
+        "Rechnungsnummer", "Rechnungsdatum", "Kundennummer", "z.Hd.", "Bestellung", "Ihr Umsatz",
+        "Servicegebühr", "Verwaltungsgebühr", "Zwischensumme", "MwSt", "Gesamtbetrag dieser Rechnung",
+        "Verrechnet mit eingegangenen Onlinebezahlungen", "Offener Rechnungsbetrag",
+        "Ausstehende Onlinebezahlungen", "Auszahlung", "IBAN", "Bankkonto", "USt.-IdNr",
+    ),
+    "Wolt Invoice": (
+        "Rechnungsnummer", "Rechnungsdatum", "Leistungszeitraum", "Bill To", "USt.-ID", "Restaurant",
+        "Geschäfts-ID", "Summe verkaufte Waren", "Zwischensumme aller verkauften Waren",
+        "Zwischensumme Wolt Vertrieb", "Summe Nettopreis", "Endbetrag",
+    ),
+    "Uber Eats Invoice": (
+        "Rechnungsnummer", "Rechnungsdatum", "Steuerdatum", "Zeitraum", "Restaurant",
+        "Handelsregisternummer", "USt-IdNr", "St-Nr", "Bestellungen im Gesamtwert",
+        "Bruttoumsatz nach Rabatten", "Provision", "Uber Eats Gebühr", "MwSt", "Eingenommenes Bargeld",
+        "Gesamtauszahlung", "Gesamtnettobetrag", "Gesamtbetrag",
+    ),
+}
+
+# Satır puanları
+LABEL_SCORE = 5
+VALUE_SCORE = 4
+HEADER_SCORE = 2
+AMOUNT_SCORE = 1
+# Etiket satırının komşuları (tablo değerleri çoğu zaman alt satırda)
+NEIGHBOUR_SCORE = 2
+# Bütçe dolmasa da sadece tutar içeren (etiket / değer / başlık olmayan) satırlar alınmaz
+MIN_LINE_SCORE = 2
+
+AMOUNT_RE = re.compile(r"€|\d,\d{2}(?!\d)")
+
+# doctype -> derlenmiş etiket regex'i
+_label_patterns = {}
+
+
+def get_token_budget():
+    return frappe.utils.cint(frappe.conf.get("invoice_ai_prompt_token_budget", DEFAULT_TOKEN_BUDGET))
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def compact_raw_text(invoice_doc, raw_text, token_budget=None):
+    """raw_text'in bütçeye sığan, doğrulanan alanlarla ilgili satırları"""
+    token_budget = token_budget or get_token_budget()
+    lines = [" ".join(line.split()) for line in raw_text.splitlines()]
+    lines = [line for line in lines if line]
+    text = "\n".join(lines)
+    if estimate_tokens(text) <= token_budget:
+        return text
+
+    scores = score_lines(invoice_doc, lines)
+    budget = token_budget * CHARS_PER_TOKEN
+    selected = set()
+    # Eşit puanda belgedeki sıra korunur (başlık önce)
+    for index in sorted(range(len(lines)), key=lambda i: (-scores[i], i)):
+        if scores[index] < MIN_LINE_SCORE:
+            break
+        cost = len(lines[index]) + 1
+        if cost > budget:
+            continue
+        selected.add(index)
+        budget -= cost
+
+    output = []
+    previous = -1
+    for index in sorted(selected):
+        if index != previous + 1:
+            output.append(GAP_MARKER)
+        output.append(lines[index])
+        previous = index
+    if previous != len(lines) - 1:
+        output.append(GAP_MARKER)
+    return "\n".join(output)
+
+
+def score_lines(invoice_doc, lines):
+    label_re = get_label_pattern(invoice_doc.doctype)
+    value_re = get_value_pattern(invoice_doc)
+
+    scores = [0] * len(lines)
+    for index, line in enumerate(lines):
+        if label_re and label_re.search(line):
+            scores[index] += LABEL_SCORE
+            for neighbour in (index - 1, index + 1):
+                if 0 <= neighbour < len(lines):
+                    scores[neighbour] += NEIGHBOUR_SCORE
+        if value_re and value_re.search(line):
+            scores[index] += VALUE_SCORE
+        if index < HEADER_LINES:
+            scores[index] += HEADER_SCORE
+        if AMOUNT_RE.search(line):
+            scores[index] += AMOUNT_SCORE
+    return scores
+
+
+def get_label_pattern(doctype):
+    if doctype not in _label_patterns:
+        labels = PLATFORM_LABELS.get(doctype)
+        _label_patterns[doctype] = re.compile(
+            "|".join(re.escape(label) for label in labels), re.IGNORECASE
+        ) if labels else None
+    return _label_patterns[doctype]
+
+
+def get_value_pattern(invoice_doc):
+    """Doğrulanan alanların PDF'te görünebilecek yazımları (tutarlar + metin değerleri)"""
+    schema = get_invoice_schema(invoice_doc.doctype)
+    candidates = set()
+    for fieldname in schema["currency_fields"]:
+        value = frappe.utils.flt(invoice_doc.get(fieldname))
+        if value:
+            candidates.update(format_amount_candidates(value))
+    for fieldname, _default_only in schema["ai_fields"]:
+        value = invoice_doc.get(fieldname)
+        if isinstance(value, str) and 4 <= len(value) <= 80 and fieldname not in schema["currency_fields"]:
+            candidates.add(value.strip())
+
+    candidates.discard("")
+    if not candidates:
+        return None
+    # Rakam sınırı: "7,00" değeri "17,00" içinde eşleşmesin
+    return re.compile(
+        r"(?<![\d.,])(?:" + "|".join(re.escape(candidate) for candidate in sorted(candidates, key=len, reverse=True)) + r")(?!\d)"
+    )
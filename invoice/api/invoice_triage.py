@@ -0,0 +1,206 @@
+"""
+Gelen email'ler için ucuz ön eleme (triage)
+
+Gelen trafiğin büyük kısmı fatura değil. Communication hook'unda File
+tablosuna bakmadan / iş kuyruğa eklemeden önce sadece gönderen ve konu
+üzerinden karar verilir. Kurallar "Invoice Triage Rule" DocType'ından
+okunur, derlenmiş hali process içinde tutulur; kural değişince cache
+temizlenir. Değerlendirme sırasında DB'ye veya diske erişilmez.
+"""
+
+import hashlib
+import json
+import re
+
+import frappe
+
+logger = frappe.logger("invoice.triage", allow_site=frappe.local.site)
+
+TRIAGE_RULE_DOCTYPE = "Invoice Triage Rule"
+TRIAGE_CACHE_KEY = "invoice_triage_rules"
+
+# Email türleri (mail_kind)
+KIND_INVOICE = "Invoice"
+KIND_UBER_EATS_REPORT = "Uber Eats Report"
+KIND_WOLT_PAYOUT_REPORT = "Wolt Payout Report"
+
+# Tanımlı kurallardan sonra değerlendirilen varsayılan kurallar (mevcut konu işaretleri)
+DEFAULT_RULES = (
+    {
+        "rule_name": "Uber Eats Aktivitätsübersicht",
+        "action": "Accept",
+        "mail_kind": KIND_UBER_EATS_REPORT,
+        "sender_pattern": None,
+        "subject_pattern": r"ihre neue aktivitätsübersicht",
+    },
+    {
+        "rule_name": "Wolt payout report",
+        "action": "Accept",
+        "mail_kind": KIND_WOLT_PAYOUT_REPORT,
+        "sender_pattern": None,
+        "subject_pattern": r"wolt payout report",
+    },
+    {
+        "rule_name": "Fatura anahtar kelimeleri",
+        "action": "Accept",
+        "mail_kind": KIND_INVOICE,
+        "sender_pattern": None,
+        "subject_pattern": r"invoice|fatura|rechnung|facture|bill",
+    },
+)
+
+# Rule.platform -> iç platform anahtarı (create_invoice_from_pdf ile aynı)
+PLATFORM_KEYS = {
+    "Lieferando": "lieferando",
+    "Wolt": "wolt",
+    "Uber Eats": "uber_eats",
+}
+
+# Platformun gönderdiği belge türleri (Wolt payout email'lerinde netting raporu da gelir)
+PLATFORM_DOCUMENT_KINDS = {
+    "lieferando": ("invoice",),
+    "wolt": ("invoice", "netting_report"),
+    "uber_eats": ("invoice",),
+}
+
+# Bilinen platform gönderenleri; tanımlı kurallar (platform seçili) bunları ezer.
+# Domain eşleşmesi sadece extractor seçer; platform PDF içeriğiyle ayrıca doğrulanır
+# (uber.com yolculuk faturaları Uber Eats faturası sayılmaz).
+DEFAULT_SENDER_ROUTES = {
+    "wolt.com": "wolt",
+    "uber.com": "uber_eats",
+    "lieferando.de": "lieferando",
+    "yourdelivery.de": "lieferando",
+    "takeaway.com": "lieferando",
+}
+
+EMAIL_RE = re.compile(r"[\w.+'-]+@([\w-]+\.)+[\w-]+")
+
+# site -> (version, {rules, routes})
+_compiled_rules = {}
+
+
+def triage_communication(doc):
+    """Communication'ı sadece bellekteki alanlarla sınıflandır
+
+    Dönen dict: accept (bool), kind (mail_kind veya None), rule (eşleşen kural),
+    route (gönderene göre platform yönlendirmesi veya None)
+    """
+    sender = get_sender_address(doc.sender)
+    sender_domain = sender.rsplit("@", 1)[-1] if sender else ""
+    subject = (doc.subject or "").lower()
+    compiled = get_compiled_triage()
+
+    for rule in compiled["rules"]:
+        if rule["sender"] and not _sender_matches(rule["sender"], sender, sender_domain):
+            continue
+        if rule["subject"] and not rule["subject"].search(subject):
+            continue
+        accept = rule["action"] == "Accept"
+        return {
+            "accept": accept,
+            "kind": rule["kind"] if accept else None,
+            "rule": rule["name"],
+            "route": _lookup_route(compiled["routes"], sender, sender_domain) if accept else None,
+        }
+
+    return {"accept": False, "kind": None, "rule": None, "route": None}
+
+
+def get_sender_route(sender):
+    """Gönderen adresine göre platform yönlendirmesi: {"platform", "kinds"} veya None"""
+    sender = get_sender_address(sender)
+    if not sender:
+        return None
+    return _lookup_route(get_compiled_triage()["routes"], sender, sender.rsplit("@", 1)[-1])
+
+
+def _lookup_route(routes, sender, sender_domain):
+    # Önce tam adres, sonra domain ve üst domainler (a.b.wolt.com -> b.wolt.com -> wolt.com)
+    if not sender:
+        return None
+    route = routes.get(sender)
+    if route:
+        return route
+    parts = sender_domain.split(".")
+    for i in range(len(parts) - 1):
+        route = routes.get(".".join(parts[i:]))
+        if route:
+            return route
+    return None
+
+
+def get_sender_address(sender):
+    """'Ad <adres>' biçiminden küçük harfli email adresini çıkar"""
+    match = EMAIL_RE.search(sender or "")
+    return match.group(0).lower() if match else ""
+
+
+def _sender_matches(pattern, sender, sender_domain):
+    if "@" in pattern:
+        return sender == pattern
+    return sender_domain == pattern or sender_domain.endswith("." + pattern)
+
+
+def get_compiled_triage_rules():
+    """Derlenmiş kural listesi (öncelik sırasına göre, varsayılanlar en sonda)"""
+    return get_compiled_triage()["rules"]
+
+
+def get_compiled_triage():
+    """Derlenmiş kurallar ve gönderen -> platform yönlendirme tablosu
+
+    Kural satırları Redis'te, derlenmiş hali process içinde tutulur;
+    satırlar değişince version değişir ve process yeniden derler.
+    """
+    payload = frappe.cache.get_value(TRIAGE_CACHE_KEY, generator=load_triage_rules)
+    site = frappe.local.site
+    cached = _compiled_rules.get(site)
+    if cached and cached[0] == payload["version"]:
+        return cached[1]
+
+    compiled = []
+    routes = {
+        sender: {"platform": platform, "kinds": PLATFORM_DOCUMENT_KINDS[platform]}
+        for sender, platform in DEFAULT_SENDER_ROUTES.items()
+    }
+    # Düşük öncelikli kural önce yazılır, yüksek öncelikli olan ezer
+    for row in reversed(payload["rules"]):
+        platform = PLATFORM_KEYS.get(row.get("platform"))
+        sender = (row.get("sender_pattern") or "").strip().lower()
+        if row["action"] == "Accept" and platform and sender:
+            routes[sender] = {"platform": platform, "kinds": PLATFORM_DOCUMENT_KINDS[platform]}
+
+    for row in [*payload["rules"], *DEFAULT_RULES]:
+        try:
+            subject = re.compile(row["subject_pattern"], re.IGNORECASE) if row.get("subject_pattern") else None
+        except re.error as e:
+            logger.error(f"Triage kuralı atlandı ({row['rule_name']}): {str(e)}")
+            continue
+        compiled.append({
+            "name": row["rule_name"],
+            "action": row["action"],
+            "kind": row.get("mail_kind") or KIND_INVOICE,
+            "sender": (row.get("sender_pattern") or "").strip().lower() or None,
+            "subject": subject,
+        })
+
+    result = {"rules": compiled, "routes": routes}
+    _compiled_rules[site] = (payload["version"], result)
+    return result
+
+
+def load_triage_rules():
+    """Aktif kuralları DB'den oku (sadece cache boşken çalışır)"""
+    rules = frappe.get_all(TRIAGE_RULE_DOCTYPE,
+        filters={"enabled": 1},
+        fields=["rule_name", "action", "mail_kind", "platform", "sender_pattern", "subject_pattern"],
+        order_by="priority desc, creation asc"
+    )
+    rules = [dict(rule) for rule in rules]
+    version = hashlib.md5(json.dumps(rules, sort_keys=True, default=str).encode()).hexdigest()
+    return {"version": version, "rules": rules}
+
+
+def clear_triage_rules_cache():
+    frappe.cache.delete_value(TRIAGE_CACHE_KEY)
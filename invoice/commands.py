@@ -0,0 +1,73 @@
+import json
+
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("invoice-reingest")
+@click.option("--from-date", help="Başlangıç tarihi (YYYY-MM-DD)")
+@click.option("--to-date", help="Bitiş tarihi (YYYY-MM-DD, dahil)")
+@click.option("--sender", help="Gönderen adresi veya domain (içerir)")
+@click.option("--platform", type=click.Choice(["Lieferando", "Wolt", "Uber Eats"]), help="Sadece bu platform")
+@click.option("--chunk-size", type=int, default=200, help="Parça başına Communication sayısı")
+@click.option("--dry-run", is_flag=True, default=False, help="Kuyruğa ekleme, sadece bekleyen PDF'leri raporla")
+@click.option("--resume", "resume_run", help="Yarıda kalan Invoice Reingest Run'ı devam ettir")
+@click.option("--background", is_flag=True, default=False, help="Run'ı worker'da çalıştır, beklemeden çık")
+@pass_context
+def invoice_reingest(context, from_date=None, to_date=None, sender=None, platform=None,
+        chunk_size=200, dry_run=False, resume_run=None, background=False):
+	"""Geçmiş email'lerdeki faturaları checkpoint'li olarak yeniden işle"""
+	import frappe
+
+	from invoice.api.invoice_reingest import create_reingest_run, enqueue_reingest_run, run_invoice_reingest
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		if resume_run:
+			run = frappe.get_doc("Invoice Reingest Run", resume_run)
+		else:
+			run = create_reingest_run(from_date, to_date, sender, platform, dry_run, chunk_size)
+			frappe.db.commit()
+		click.echo(f"Run: {run.name}")
+
+		if background:
+			enqueue_reingest_run(run.name)
+			frappe.db.commit()
+			click.echo("Run kuyruğa eklendi")
+			return
+
+		# Taramayı bu process yapar, PDF işleri worker'lara dağıtılır
+		run = run_invoice_reingest(run.name, time_limit=None)
+		click.echo(
+			f"Taranan: {run.scanned}, eşleşen: {run.matched}, "
+			f"bekleyen PDF: {run.pending_pdfs}, kuyruğa eklenen: {run.dispatched}"
+		)
+		if run.dry_run and run.report:
+			report = json.loads(run.report)
+			click.echo(f"Dry run: {report.get('note')}")
+			click.echo(json.dumps(report.get("totals", {}), indent=1))
+	finally:
+		frappe.destroy()
+
+
+@click.command("invoice-imap-idle")
+@click.option("--account", "accounts", multiple=True, help="Sadece bu Email Account (tekrarlanabilir)")
+@pass_context
+def invoice_imap_idle(context, accounts=None):
+	"""Email Account'ları IMAP IDLE ile dinle (uzun süre çalışır, supervisor altında çalıştırın)"""
+	import frappe
+
+	from invoice.api.imap_idle import run_imap_idle_listener
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		run_imap_idle_listener(list(accounts) or None)
+	finally:
+		frappe.destroy()
+
+
+commands = [invoice_reingest, invoice_imap_idle]
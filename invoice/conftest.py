@@ -0,0 +1,10 @@
+"""
+Bench dışında pytest: frappe kurulu değilse bellek içi fake_frappe kullanılır
+"""
+
+try:
+    import frappe  # noqa: F401
+except ImportError:
+    from invoice.tools import fake_frappe
+
+    fake_frappe.install()
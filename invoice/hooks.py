@@ -249,14 +249,67 @@ doc_events = {
 	"Communication": {
 		"after_insert": "invoice.api.invoice_email_handler.process_invoice_email",
 		"on_update": "invoice.api.invoice_email_handler.process_invoice_email"
+	},
+	"Lieferando Invoice": {
+		"on_update": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_submit": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_update_after_submit": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_cancel": "invoice.api.invoice_ledger.remove_invoice_ledger",
+		"on_trash": "invoice.api.invoice_ledger.remove_invoice_ledger"
+	},
+	"Wolt Invoice": {
+		"after_insert": "invoice.api.invoice_netting.resolve_pending_netting",
+		"on_update": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_submit": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_update_after_submit": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_cancel": "invoice.api.invoice_ledger.remove_invoice_ledger",
+		"on_trash": "invoice.api.invoice_ledger.remove_invoice_ledger"
+	},
+	"Uber Eats Invoice": {
+		"on_update": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_submit": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_update_after_submit": "invoice.api.invoice_ledger.sync_invoice_ledger",
+		"on_cancel": "invoice.api.invoice_ledger.remove_invoice_ledger",
+		"on_trash": "invoice.api.invoice_ledger.remove_invoice_ledger"
+	},
+	"User": {
+		"after_insert": "invoice.api.invoice_notifications.clear_notification_recipients_cache",
+		"on_update": "invoice.api.invoice_notifications.clear_notification_recipients_cache",
+		"on_trash": "invoice.api.invoice_notifications.clear_notification_recipients_cache"
+	},
+	"DocType": {
+		"on_update": "invoice.api.invoice_schema.clear_invoice_schema_cache"
+	},
+	"Custom Field": {
+		"on_update": "invoice.api.invoice_schema.clear_invoice_schema_cache",
+		"on_trash": "invoice.api.invoice_schema.clear_invoice_schema_cache"
+	},
+	"Property Setter": {
+		"on_update": "invoice.api.invoice_schema.clear_invoice_schema_cache",
+		"on_trash": "invoice.api.invoice_schema.clear_invoice_schema_cache"
 	}
 }
 
+clear_cache = "invoice.api.invoice_schema.clear_invoice_schema_cache"
+
 # Scheduled Tasks
 # ---------------
 
 scheduler_events = {
 	"all": [
 		"invoice.api.email_tasks.sync_gmail_invoices"
-	]
+	],
+	"cron": {
+		"* * * * *": [
+			"invoice.api.invoice_notifications.flush_notification_digest",
+			"invoice.api.invoice_notifications.flush_ingest_progress",
+			"invoice.api.invoice_ingest.enqueue_due_ingest_retries"
+		],
+		"*/5 * * * *": [
+			"invoice.api.invoice_ai_batch.poll_validation_batches"
+		],
+		"30 1 * * *": [
+			"invoice.api.invoice_ai_batch.start_nightly_ai_validation"
+		]
+	}
 }
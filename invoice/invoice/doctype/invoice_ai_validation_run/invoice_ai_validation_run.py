@@ -0,0 +1,12 @@
+# Copyright (c) 2026, invoice and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class InvoiceAIValidationRun(Document):
+	def validate(self):
+		from invoice.api.invoice_ai_validation import MAX_CONCURRENCY, get_validation_concurrency
+
+		self.concurrency = min(max(frappe.utils.cint(self.concurrency) or get_validation_concurrency(), 1), MAX_CONCURRENCY)
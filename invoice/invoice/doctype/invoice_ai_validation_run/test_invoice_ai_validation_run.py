@@ -0,0 +1,145 @@
+# Copyright (c) 2026, invoice and Contributors
+# See license.txt
+
+import json
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_ai_validation import (
+	VALIDATION_RUN_DOCTYPE,
+	VALIDATION_RUN_QUEUE,
+	run_batch_ai_validation,
+)
+
+RUN_METHOD = "invoice.api.invoice_ai_validation.run_batch_ai_validation"
+
+MODEL_RESULTS = {
+	"gpt-4o-mini": {"status": "Valid", "confidence": 0.6, "summary": "Emin değil"},
+	"gpt-4o": {"status": "Issues Found", "confidence": 0.9, "summary": "Toplam PDF ile uyuşmuyor"},
+}
+
+
+class FakeCompletions:
+	def __init__(self):
+		self.models = []
+
+	async def create(self, model, **kwargs):
+		self.models.append(model)
+		return {
+			"choices": [{"message": {"content": json.dumps(MODEL_RESULTS[model])}}],
+			"usage": {"prompt_tokens": 100, "completion_tokens": 20},
+		}
+
+
+class FakeAsyncClient:
+	def __init__(self):
+		self.chat = frappe._dict(completions=FakeCompletions())
+
+	async def close(self):
+		pass
+
+
+def make_lieferando_invoice(invoice_number, total_amount=35.7, raw_text=None):
+	return frappe.get_doc({
+		"doctype": "Lieferando Invoice",
+		"invoice_number": invoice_number,
+		"invoice_date": "2026-02-01",
+		"supplier_name": "Takeaway.com",
+		"restaurant_name": "Test Restaurant",
+		"customer_number": "12345",
+		"subtotal": 30,
+		"tax_rate": 19,
+		"tax_amount": 5.7,
+		"total_amount": total_amount,
+		"outstanding_amount": total_amount,
+		"raw_text": raw_text or f"Rechnungsnummer: {invoice_number}\nGesamtbetrag € 35,70",
+	}).insert(ignore_permissions=True)
+
+
+def make_run(names, **values):
+	return frappe.get_doc({
+		"doctype": VALIDATION_RUN_DOCTYPE,
+		"invoice_doctype": "Lieferando Invoice",
+		"invoices": json.dumps(names),
+		"total": len(names),
+		"mode": "Realtime",
+		**values
+	}).insert(ignore_permissions=True)
+
+
+class TestInvoiceAIValidationRun(FrappeTestCase):
+	def test_rules_only_run_needs_no_client(self):
+		names = [make_lieferando_invoice(f"AIVAL-TEST-{i}").name for i in range(3)]
+		run = make_run(names)
+
+		with patch("invoice.api.invoice_ai_validation.get_async_openai_client") as get_client:
+			run_batch_ai_validation(run.name)
+		get_client.assert_not_called()
+
+		run.reload()
+		self.assertEqual(run.status, "Completed")
+		self.assertEqual((run.processed, run.valid), (3, 3))
+		self.assertFalse(run.model_calls)
+		for name in names:
+			self.assertEqual(frappe.db.get_value("Lieferando Invoice", name, "ai_validation_status"), "Valid")
+
+	def test_low_confidence_escalates(self):
+		# Toplam PDF metninde yok: kural kontrolü tutmaz, fatura modele gider
+		invoice = make_lieferando_invoice("AIVAL-TEST-ESC", raw_text="Gesamtbetrag € 99,00")
+		run = make_run([invoice.name], concurrency=2)
+		client = FakeAsyncClient()
+
+		with patch("invoice.api.invoice_ai_validation.get_async_openai_client", return_value=client):
+			run_batch_ai_validation(run.name)
+
+		self.assertEqual(client.chat.completions.models, ["gpt-4o-mini", "gpt-4o"])
+		run.reload()
+		self.assertEqual(run.status, "Completed")
+		self.assertEqual((run.issues_found, run.model_calls, run.escalations, run.tokens), (1, 1, 1, 240))
+
+		status, model = frappe.db.get_value("Lieferando Invoice", invoice.name,
+			["ai_validation_status", "ai_validation_model"]
+		)
+		self.assertEqual(status, "Issues Found")
+		self.assertEqual(model, "gpt-4o-mini → gpt-4o")
+
+	def test_slice_deadline_enqueues_continuation(self):
+		# concurrency=1: parça başına 4 fatura; süre ilk parçadan sonra dolar
+		names = [make_lieferando_invoice(f"AIVAL-SLICE-{i}").name for i in range(10)]
+		run = make_run(names, concurrency=1)
+
+		with patch("frappe.enqueue") as enqueue:
+			run_batch_ai_validation(run.name, time_limit=1e-9)
+
+		run.reload()
+		self.assertEqual(run.status, "Running")
+		self.assertEqual(run.processed, 4)
+
+		(continuation,) = [call for call in enqueue.call_args_list if call.args[0] == RUN_METHOD]
+		self.assertEqual(continuation.kwargs["job_id"], f"invoice_ai_validation::{run.name}::4")
+		self.assertFalse(continuation.kwargs["deduplicate"])
+
+		run_batch_ai_validation(run.name)
+		run.reload()
+		self.assertEqual(run.status, "Completed")
+		self.assertEqual((run.processed, run.valid), (10, 10))
+		self.assertTrue(run.finished_at)
+
+	@unittest.skipUnless(frappe.__name__ == "invoice.tools.fake_frappe", "Sadece fake_frappe ile çalışır")
+	def test_multi_slice_run_completes_from_queue(self):
+		names = [make_lieferando_invoice(f"AIVAL-QUEUE-{i}").name for i in range(10)]
+		run = make_run(names, concurrency=1)
+
+		# İlk dilim hemen süre aşımına düşer; devam işi varsayılan süreyle kalan faturaları bitirir
+		frappe.enqueue(RUN_METHOD, queue=VALIDATION_RUN_QUEUE, job_id=f"invoice_ai_validation::{run.name}",
+			deduplicate=True, run_name=run.name, time_limit=1e-9
+		)
+		self.assertEqual(frappe.run_jobs(), 2)
+		self.assertEqual(frappe.jobs.failed, [])
+
+		run.reload()
+		self.assertEqual(run.status, "Completed")
+		self.assertEqual(run.processed, 10)
@@ -0,0 +1,15 @@
+# Copyright (c) 2026, invoice and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class InvoiceIngestLog(Document):
+	def autoname(self):
+		# (Communication, File, içerik hash'i) -> tek kayıt
+		self.name = get_ingest_log_name(self.communication, self.file, self.content_hash)
+
+
+def get_ingest_log_name(communication, file, content_hash=None):
+	return f"{communication}::{file}::{content_hash or 'nohash'}"
@@ -0,0 +1,76 @@
+# Copyright (c) 2026, invoice and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_ingest import INGEST_LOG_DOCTYPE, get_pending_attachments, mark_ingest_state
+from invoice.invoice.doctype.invoice_ingest_log.invoice_ingest_log import get_ingest_log_name
+
+EXTRACTOR_VERSION = "test-1"
+
+
+class TestInvoiceIngestLog(FrappeTestCase):
+	def setUp(self):
+		# Giden email: Communication hook'u PDF işlemeden çıkar
+		self.communication = frappe.get_doc({
+			"doctype": "Communication",
+			"communication_type": "Communication",
+			"communication_medium": "Email",
+			"sent_or_received": "Sent",
+			"subject": "Ingest log test",
+		}).insert(ignore_permissions=True)
+		self.attachments = [self.make_attachment(f"rechnung_{i}.pdf") for i in range(3)]
+
+	def make_attachment(self, file_name):
+		file_doc = frappe.get_doc({
+			"doctype": "File",
+			"file_name": file_name,
+			"attached_to_doctype": "Communication",
+			"attached_to_name": self.communication.name,
+			"is_private": 1,
+			"content": f"{self.communication.name} {file_name}",
+		}).insert(ignore_permissions=True)
+		return frappe._dict(name=file_doc.name, file_name=file_name, content_hash=file_doc.content_hash)
+
+	def get_pending(self, attachments=None, extractor_version=EXTRACTOR_VERSION):
+		attachments = attachments or self.attachments
+		pending = get_pending_attachments(self.communication.name, attachments, extractor_version)
+		return [att.name for att in pending]
+
+	def test_finished_states_are_filtered(self):
+		done, skipped, failed = self.attachments
+		mark_ingest_state(self.communication.name, done, "Done", EXTRACTOR_VERSION)
+		mark_ingest_state(self.communication.name, skipped, "Skipped", EXTRACTOR_VERSION)
+		mark_ingest_state(self.communication.name, failed, "Failed", EXTRACTOR_VERSION, error="parse error")
+
+		self.assertEqual(self.get_pending(), [failed.name])
+
+	def test_new_extractor_version_is_pending(self):
+		for att in self.attachments:
+			mark_ingest_state(self.communication.name, att, "Done", EXTRACTOR_VERSION)
+
+		self.assertEqual(self.get_pending(), [])
+		self.assertEqual(len(self.get_pending(extractor_version="test-2")), 3)
+
+	def test_changed_content_hash_is_pending(self):
+		att = self.attachments[0]
+		mark_ingest_state(self.communication.name, att, "Done", EXTRACTOR_VERSION)
+
+		changed = frappe._dict(att, content_hash="changed")
+		pending = get_pending_attachments(self.communication.name, [att, changed], EXTRACTOR_VERSION)
+		self.assertEqual([p.content_hash for p in pending], ["changed"])
+
+	def test_attempts_increment(self):
+		att = self.attachments[0]
+		mark_ingest_state(self.communication.name, att, "Failed", EXTRACTOR_VERSION, error="parse error")
+		mark_ingest_state(self.communication.name, att, "Done", EXTRACTOR_VERSION)
+
+		log = frappe.db.get_value(INGEST_LOG_DOCTYPE,
+			get_ingest_log_name(self.communication.name, att.name, att.content_hash),
+			["state", "attempts", "error"],
+			as_dict=True
+		)
+		self.assertEqual(log.state, "Done")
+		self.assertEqual(log.attempts, 2)
+		self.assertFalse(log.error)
@@ -0,0 +1,20 @@
+# Copyright (c) 2026, invoice and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class InvoiceLedgerEntry(Document):
+	def autoname(self):
+		# Her fatura için tek satır: upsert'ler isimden O(1) bulunur
+		self.name = get_ledger_entry_name(self.invoice_doctype, self.invoice_name)
+
+
+def get_ledger_entry_name(invoice_doctype, invoice_name):
+	return f"{invoice_doctype}::{invoice_name}"
+
+
+def on_doctype_update():
+	frappe.db.add_index("Invoice Ledger Entry", ["period_month", "platform"])
+	frappe.db.add_index("Invoice Ledger Entry", ["restaurant_name", "period_month"])
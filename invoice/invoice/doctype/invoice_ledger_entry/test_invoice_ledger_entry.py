@@ -0,0 +1,70 @@
+# Copyright (c) 2026, invoice and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_ledger import LEDGER_DOCTYPE, build_ledger_values
+from invoice.invoice.doctype.invoice_ledger_entry.invoice_ledger_entry import get_ledger_entry_name
+
+
+def make_lieferando_invoice(invoice_number, **values):
+	return frappe.get_doc({
+		"doctype": "Lieferando Invoice",
+		"invoice_number": invoice_number,
+		"invoice_date": "2026-02-01",
+		"period_start": "2026-01-01",
+		"period_end": "2026-01-31",
+		"supplier_name": "Takeaway.com",
+		"restaurant_name": "Test Restaurant",
+		"customer_number": "12345",
+		"subtotal": 30,
+		"tax_amount": 5.7,
+		"total_amount": 35.7,
+		"total_revenue": 500,
+		"service_fee_amount": 25,
+		"admin_fee_amount": 5,
+		"auszahlung_gesamt": 464.3,
+		**values
+	}).insert(ignore_permissions=True)
+
+
+class TestInvoiceLedgerEntry(FrappeTestCase):
+	def test_fee_amount_sums_fee_fields(self):
+		values = build_ledger_values("Lieferando Invoice", frappe._dict(
+			service_fee_amount=25, admin_fee_amount=5, subtotal=99, period_end="2026-01-31"
+		))
+		self.assertEqual(values["fee_amount"], 30)
+		self.assertEqual(values["period_month"], "2026-01")
+
+	def test_insert_creates_entry(self):
+		invoice = make_lieferando_invoice("LEDGER-TEST-1")
+		entry_name = get_ledger_entry_name("Lieferando Invoice", invoice.name)
+
+		entry = frappe.db.get_value(LEDGER_DOCTYPE, entry_name,
+			["platform", "gross_amount", "fee_amount", "vat_amount", "payout_amount", "period_month"],
+			as_dict=True
+		)
+		self.assertEqual(entry.platform, "Lieferando")
+		self.assertEqual(entry.gross_amount, 500)
+		self.assertEqual(entry.fee_amount, 30)
+		self.assertEqual(entry.vat_amount, 5.7)
+		self.assertEqual(entry.payout_amount, 464.3)
+		self.assertEqual(entry.period_month, "2026-01")
+
+	def test_update_keeps_single_entry(self):
+		invoice = make_lieferando_invoice("LEDGER-TEST-2")
+		invoice.admin_fee_amount = 10
+		invoice.save(ignore_permissions=True)
+
+		self.assertEqual(frappe.db.count(LEDGER_DOCTYPE, {"invoice_name": invoice.name}), 1)
+		entry_name = get_ledger_entry_name("Lieferando Invoice", invoice.name)
+		self.assertEqual(frappe.db.get_value(LEDGER_DOCTYPE, entry_name, "fee_amount"), 35)
+
+	def test_delete_removes_entry(self):
+		invoice = make_lieferando_invoice("LEDGER-TEST-3")
+		entry_name = get_ledger_entry_name("Lieferando Invoice", invoice.name)
+		self.assertTrue(frappe.db.exists(LEDGER_DOCTYPE, entry_name))
+
+		frappe.delete_doc("Lieferando Invoice", invoice.name, ignore_permissions=True, force=True)
+		self.assertFalse(frappe.db.exists(LEDGER_DOCTYPE, entry_name))
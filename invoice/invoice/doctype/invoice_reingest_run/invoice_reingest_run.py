@@ -0,0 +1,13 @@
+# Copyright (c) 2026, invoice and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class InvoiceReingestRun(Document):
+	def validate(self):
+		if self.from_date and self.to_date and frappe.utils.getdate(self.from_date) > frappe.utils.getdate(self.to_date):
+			frappe.throw("From Date, To Date'ten sonra olamaz")
+
+		self.chunk_size = min(max(frappe.utils.cint(self.chunk_size) or 200, 10), 1000)
@@ -0,0 +1,157 @@
+# Copyright (c) 2026, invoice and Contributors
+# See license.txt
+
+import json
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_reingest import (
+	BACKLOG_PAUSE,
+	DRY_RUN_NOTE,
+	REINGEST_QUEUE,
+	create_reingest_run,
+	enqueue_reingest_run,
+	run_invoice_reingest,
+)
+
+RUN_METHOD = "invoice.api.invoice_reingest.run_invoice_reingest"
+EMAIL_COUNT = 12
+CHUNK_SIZE = 10
+
+
+def get_run_calls(enqueue):
+	return [call for call in enqueue.call_args_list if call.args and call.args[0] == RUN_METHOD]
+
+
+class TestInvoiceReingestRun(FrappeTestCase):
+	def setUp(self):
+		# Her test kendi göndereniyle filtreler (sitedeki diğer email'ler taranmaz)
+		self.sender = f"billing@reingest-{frappe.generate_hash(length=8)}.example"
+		for i in range(EMAIL_COUNT):
+			self.make_email(i)
+
+	def make_email(self, index):
+		communication = frappe.get_doc({
+			"doctype": "Communication",
+			"communication_type": "Communication",
+			"communication_medium": "Email",
+			"sent_or_received": "Received",
+			"subject": f"Rechnung {index}",
+			"sender": self.sender,
+		}).insert(ignore_permissions=True)
+		# Ek, Communication kaydedildikten sonra: hook PDF'i görmez, PDF bekleyen kalır
+		frappe.get_doc({
+			"doctype": "File",
+			"file_name": f"rechnung_und_gutschrift_{index}.pdf",
+			"attached_to_doctype": "Communication",
+			"attached_to_name": communication.name,
+			"is_private": 1,
+			"content": f"Lieferando Rechnung {self.sender} {index}",
+		}).insert(ignore_permissions=True)
+
+	def make_run(self, **values):
+		return create_reingest_run(sender=self.sender, chunk_size=CHUNK_SIZE, **values)
+
+	@patch("invoice.api.invoice_reingest.is_ingest_backlogged", return_value=False)
+	def test_checkpoint_and_resume(self, _backlogged):
+		run = self.make_run()
+
+		with patch("frappe.enqueue") as enqueue:
+			run_invoice_reingest(run.name, time_limit=1e-9)
+
+		run.reload()
+		self.assertEqual(run.status, "Running")
+		self.assertEqual((run.scanned, run.dispatched), (CHUNK_SIZE, CHUNK_SIZE))
+		self.assertTrue(run.cursor_name)
+
+		# Devam işi çalışan işten farklı job_id alır ve dedupe edilmez
+		(continuation,) = get_run_calls(enqueue)
+		self.assertEqual(continuation.kwargs["job_id"], f"invoice_reingest::{run.name}::{run.cursor_name}")
+		self.assertFalse(continuation.kwargs["deduplicate"])
+		self.assertEqual(continuation.kwargs["run_name"], run.name)
+
+		with patch("frappe.enqueue") as enqueue:
+			run_invoice_reingest(run.name)
+
+		run.reload()
+		self.assertEqual(run.status, "Completed")
+		self.assertEqual((run.scanned, run.dispatched), (EMAIL_COUNT, EMAIL_COUNT))
+		self.assertEqual(get_run_calls(enqueue), [])
+
+	def test_start_is_deduplicated(self):
+		run = self.make_run()
+		with patch("frappe.enqueue") as enqueue:
+			enqueue_reingest_run(run.name)
+
+		(start,) = get_run_calls(enqueue)
+		self.assertEqual(start.kwargs["job_id"], f"invoice_reingest::{run.name}")
+		self.assertTrue(start.kwargs["deduplicate"])
+
+	def test_dry_run_does_not_dispatch(self):
+		run = self.make_run(dry_run=1)
+
+		with patch("frappe.enqueue") as enqueue:
+			run_invoice_reingest(run.name)
+		enqueue.assert_not_called()
+
+		run.reload()
+		self.assertEqual(run.status, "Completed")
+		self.assertEqual((run.matched, run.pending_pdfs), (EMAIL_COUNT, EMAIL_COUNT))
+		self.assertFalse(run.dispatched)
+
+		report = json.loads(run.report)
+		self.assertEqual(report["note"], DRY_RUN_NOTE)
+		self.assertEqual(report["totals"]["lieferando"]["pdfs"], EMAIL_COUNT)
+		self.assertEqual(len(report["sample"]), EMAIL_COUNT)
+
+	@patch("invoice.api.invoice_reingest.is_ingest_backlogged", return_value=True)
+	def test_backlog_pauses_with_continuation(self, _backlogged):
+		run = self.make_run()
+
+		with patch("frappe.enqueue") as enqueue, patch("time.sleep") as sleep:
+			run_invoice_reingest(run.name)
+
+		sleep.assert_called_once_with(BACKLOG_PAUSE)
+		run.reload()
+		self.assertEqual(run.status, "Running")
+		self.assertEqual(run.dispatched, CHUNK_SIZE)
+
+		(continuation,) = get_run_calls(enqueue)
+		self.assertEqual(continuation.kwargs["job_id"], f"invoice_reingest::{run.name}::{run.cursor_name}")
+		self.assertFalse(continuation.kwargs["deduplicate"])
+
+	@patch("invoice.api.invoice_reingest.is_ingest_backlogged", return_value=True)
+	def test_backlog_wait_gives_up(self, _backlogged):
+		# Bench komutu (süre sınırı yok): kuyruklar boşalmazsa run checkpoint'te durur
+		run = self.make_run()
+
+		with patch("frappe.enqueue"), patch("time.sleep"):
+			self.assertRaises(frappe.ValidationError, run_invoice_reingest, run.name, time_limit=None)
+
+		run.reload()
+		self.assertEqual(run.status, "Failed")
+		self.assertIn("--resume", run.error)
+		self.assertEqual(run.scanned, CHUNK_SIZE)
+
+	@unittest.skipUnless(frappe.__name__ == "invoice.tools.fake_frappe", "Sadece fake_frappe ile çalışır")
+	def test_continuation_enqueued_while_running(self):
+		# frappe deduplicate'i çağrı anında, çalışan işe karşı da kontrol eder
+		run = self.make_run()
+		enqueue_reingest_run(run.name)
+		frappe.db.commit()
+
+		with patch("invoice.api.invoice_reingest.is_ingest_backlogged", return_value=True):
+			with patch("time.sleep"):
+				frappe.run_jobs(limit=1)
+
+		self.assertEqual(frappe.jobs.failed, [])
+		queued = [job for job in frappe.jobs.queues.get(REINGEST_QUEUE, ()) if job.method == RUN_METHOD]
+		self.assertEqual(len(queued), 1)
+
+		with patch("invoice.api.invoice_reingest.is_ingest_backlogged", return_value=False):
+			frappe.run_jobs()
+
+		self.assertEqual(frappe.db.get_value("Invoice Reingest Run", run.name, "status"), "Completed")
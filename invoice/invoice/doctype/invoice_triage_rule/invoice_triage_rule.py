@@ -0,0 +1,32 @@
+# Copyright (c) 2026, invoice and contributors
+# For license information, please see license.txt
+
+import re
+
+import frappe
+from frappe.model.document import Document
+
+
+class InvoiceTriageRule(Document):
+	def validate(self):
+		if not self.sender_pattern and not self.subject_pattern:
+			frappe.throw("Sender / Domain veya Subject Pattern alanlarından en az biri dolu olmalı")
+
+		if self.sender_pattern:
+			self.sender_pattern = self.sender_pattern.strip().lower()
+
+		if self.subject_pattern:
+			try:
+				re.compile(self.subject_pattern)
+			except re.error as e:
+				frappe.throw(f"Geçersiz Subject Pattern: {str(e)}")
+
+	def on_update(self):
+		from invoice.api.invoice_triage import clear_triage_rules_cache
+
+		clear_triage_rules_cache()
+
+	def on_trash(self):
+		from invoice.api.invoice_triage import clear_triage_rules_cache
+
+		clear_triage_rules_cache()
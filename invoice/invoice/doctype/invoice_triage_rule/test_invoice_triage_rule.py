@@ -0,0 +1,100 @@
+# Copyright (c) 2026, invoice and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_email_handler import create_invoice_from_pdf, route_matches_pdf
+from invoice.api.invoice_triage import (
+	KIND_INVOICE,
+	KIND_WOLT_PAYOUT_REPORT,
+	get_sender_route,
+	triage_communication,
+)
+
+
+def triage(subject, sender="info@example.com"):
+	return triage_communication(frappe._dict(subject=subject, sender=sender))
+
+
+def make_rule(rule_name, **values):
+	return frappe.get_doc({
+		"doctype": "Invoice Triage Rule",
+		"rule_name": rule_name,
+		"enabled": 1,
+		**values
+	}).insert(ignore_permissions=True)
+
+
+class TestInvoiceTriageRule(FrappeTestCase):
+	def test_default_rules(self):
+		result = triage("Ihre Rechnung für Januar", "Lieferando <noreply@lieferando.de>")
+		self.assertTrue(result["accept"])
+		self.assertEqual(result["kind"], KIND_INVOICE)
+		self.assertEqual(result["route"]["platform"], "lieferando")
+
+		self.assertFalse(triage("Weekly newsletter", "news@example.org")["accept"])
+
+	def test_wolt_payout_report(self):
+		result = triage("Wolt payout report 01.01.2026 - 15.01.2026", "payouts@wolt.com")
+		self.assertTrue(result["accept"])
+		self.assertEqual(result["kind"], KIND_WOLT_PAYOUT_REPORT)
+		self.assertEqual(result["route"]["platform"], "wolt")
+		self.assertIn("netting_report", result["route"]["kinds"])
+
+	def test_custom_reject_rule_wins(self):
+		make_rule("Spam faturaları", action="Reject", priority=10, sender_pattern="Spam.Example.com")
+
+		self.assertFalse(triage("Rechnung 123", "billing@mail.spam.example.com")["accept"])
+		self.assertTrue(triage("Rechnung 123", "billing@example.com")["accept"])
+
+	def test_custom_sender_route(self):
+		make_rule("Partner Wolt", action="Accept", platform="Wolt", sender_pattern="billing@partner.example",
+			subject_pattern="abrechnung")
+
+		result = triage("Abrechnung Januar", "billing@partner.example")
+		self.assertTrue(result["accept"])
+		self.assertEqual(result["route"]["platform"], "wolt")
+		self.assertIsNone(get_sender_route("other@partner.example"))
+
+	def test_validate(self):
+		self.assertRaises(frappe.ValidationError, make_rule, "Boş kural", action="Accept")
+		self.assertRaises(frappe.ValidationError, make_rule, "Bozuk regex",
+			action="Accept", subject_pattern="(rechnung"
+		)
+
+	def test_route_requires_matching_pdf(self):
+		# Domain yönlendirmesi sadece extractor seçer: uber.com yolculuk faturası Uber Eats değildir
+		self.assertFalse(route_matches_pdf("uber_eats", "receipt.pdf", "Uber B.V. Fahrtbeleg Gesamt 12,40"))
+		lieferando_text = "Lieferando Rechnung\nRechnungsnummer: 1234567"
+		self.assertTrue(route_matches_pdf("lieferando", "invoice.pdf", lieferando_text))
+		self.assertTrue(route_matches_pdf("lieferando", "rechnung_und_gutschrift.pdf", ""))
+
+	@unittest.skipUnless(frappe.__name__ == "invoice.tools.fake_frappe", "Sadece fake_frappe ile çalışır")
+	def test_unverified_route_reads_pdf_once(self):
+		# fake_frappe'nin PyPDF2 ara katmanı .txt içeriğini PDF metni gibi okur
+		import PyPDF2
+
+		communication = frappe.get_doc({
+			"doctype": "Communication",
+			"communication_type": "Communication",
+			"sent_or_received": "Sent",
+			"subject": "Rechnung",
+		}).insert(ignore_permissions=True)
+		file_doc = frappe.get_doc({
+			"doctype": "File",
+			"file_name": "invoice.pdf",
+			"attached_to_doctype": "Communication",
+			"attached_to_name": communication.name,
+			"content": "Lieferando Rechnung\nRechnungsnummer: 7654321\nGesamt 45,00",
+		}).insert(ignore_permissions=True)
+
+		ride_receipt_route = {"platform": "uber_eats"}
+		with patch.object(PyPDF2, "PdfReader", wraps=PyPDF2.PdfReader) as reader:
+			invoice = create_invoice_from_pdf(communication, frappe._dict(file_doc), route=ride_receipt_route)
+
+		self.assertEqual(reader.call_count, 1)
+		self.assertEqual(invoice.doctype, "Lieferando Invoice")
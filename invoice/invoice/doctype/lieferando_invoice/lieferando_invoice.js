@@ -5,31 +5,42 @@ frappe.ui.form.on("Lieferando Invoice", {
 	refresh(frm) {
 		if (!frm.is_new()) {
 			frm.add_custom_button(__("Recheck with AI"), function() {
-				frappe.call({
-					method: "invoice.api.invoice_ai_validation.recheck_invoice_with_ai",
-					args: {
-						doctype: frm.doctype,
-						name: frm.doc.name
-					},
-					freeze: true,
-					freeze_message: __("AI ile kontrol ediliyor..."),
-					callback: function(r) {
-						if (r.message) {
-							frm.reload_doc();
-							frappe.show_alert({
-								message: __("AI Validation tamamlandı"),
-								indicator: "green"
-							}, 3);
-						}
-					},
-					error: function(r) {
-						frappe.show_alert({
-							message: __("Hata: {0}", [r.message || "Bilinmeyen hata"]),
-							indicator: "red"
-						}, 5);
-					}
-				});
+				recheck_with_ai(frm, false);
+			}, __("Actions"));
+			// Aynı veri için önbellekteki sonucu kullanmadan modele tekrar sor
+			frm.add_custom_button(__("Recheck with AI (Skip Cache)"), function() {
+				recheck_with_ai(frm, true);
 			}, __("Actions"));
 		}
 	},
 });
+
+function recheck_with_ai(frm, force) {
+	frappe.call({
+		method: "invoice.api.invoice_ai_validation.recheck_invoice_with_ai",
+		args: {
+			doctype: frm.doctype,
+			name: frm.doc.name,
+			force: force ? 1 : 0
+		},
+		freeze: true,
+		freeze_message: __("AI ile kontrol ediliyor..."),
+		callback: function(r) {
+			if (r.message) {
+				frm.reload_doc();
+				let models = (r.message.routing || []).map(attempt => attempt.model).join(" → ");
+				let source = r.message.method === "rules" ? __(" (kural kontrolü)") : (r.message.cached ? __(" (önbellekten)") : (models ? ` (${models})` : ""));
+				frappe.show_alert({
+					message: __("AI Validation tamamlandı") + source,
+					indicator: "green"
+				}, 3);
+			}
+		},
+		error: function(r) {
+			frappe.show_alert({
+				message: __("Hata: {0}", [r.message || "Bilinmeyen hata"]),
+				indicator: "red"
+			}, 5);
+		}
+	});
+}
@@ -1,5 +1,7 @@
 frappe.listview_settings['Lieferando Invoice'] = {
     onload: function(listview) {
+        setup_ingest_progress(listview);
+
         // Batch AI Validation butonu (toolbar)
         listview.page.add_button(__("Batch AI Validation"), function() {
             show_batch_validation_dialog("Lieferando Invoice", listview);
@@ -22,6 +24,20 @@ function show_batch_validation_dialog(doctype, listview) {
     let dialog = new frappe.ui.Dialog({
         title: __('Batch AI Validation'),
         fields: [
+            {
+                label: __('Mode'),
+                fieldname: 'mode',
+                fieldtype: 'Select',
+                options: 'Realtime\nBatch File',
+                default: 'Realtime',
+                description: __('Batch File: daha ucuz, sonuçlar 24 saate kadar sürebilir (gece doğrulaması için)')
+            },
+            {
+                label: __('Skip Cache'),
+                fieldname: 'force',
+                fieldtype: 'Check',
+                description: __('Önbellekteki sonuçları kullanma, her faturayı modele tekrar gönder')
+            },
             {
                 label: __('Progress'),
                 fieldname: 'progress_section',
@@ -30,84 +46,144 @@ function show_batch_validation_dialog(doctype, listview) {
             {
                 fieldname: 'progress_html',
                 fieldtype: 'HTML',
-                options: '<div style="padding: 10px; text-align: center; color: #999;">Hazır...</div>'
+                options: '<div style="padding: 10px; text-align: center; color: #999;">Hazır... Seçim yoksa mevcut filtreye uyan tüm invoice\'lar doğrulanır.</div>'
             }
         ],
         primary_action_label: __('Start Validation'),
         primary_action: function() {
             let checked_items = listview.get_checked_items(true); // only names
-            if (!checked_items || checked_items.length === 0) {
-                frappe.msgprint({
-                    title: __('Uyarı'),
-                    message: __('Lütfen validasyon yapmak istediğiniz invoice\'ları seçin.'),
-                    indicator: 'orange'
-                });
+            if (checked_items && checked_items.length) {
+                start_batch_validation(doctype, dialog, listview, { names: checked_items });
                 return;
             }
-            start_batch_validation(doctype, dialog, listview, checked_items);
+            frappe.confirm(
+                __('Seçim yok. Mevcut filtreye uyan tüm invoice\'lar doğrulansın mı?'),
+                function() {
+                    start_batch_validation(doctype, dialog, listview, { filters: listview.get_filters_for_args() });
+                }
+            );
         }
     });
     dialog.show();
 }
 
-function start_batch_validation(doctype, dialog, listview, selected_items) {
+function start_batch_validation(doctype, dialog, listview, selection) {
+    // Doğrulama sunucuda tek bir arka plan işinde çalışır; sekme kapansa da devam eder
     dialog.get_primary_btn().prop('disabled', true);
-    let invoices = selected_items.map(function(name) {
-        return { name: name, invoice_number: name };
-    });
     let progress_html = dialog.fields_dict.progress_html;
-    if (progress_html) {
-        progress_html.$wrapper.html(`<div style="padding: 10px; text-align: center; color: #666;"><strong>${selected_items.length} seçili invoice validasyon edilecek...</strong></div>`);
-    }
-    process_invoices_sequentially(doctype, invoices, 0, invoices.length, dialog, listview);
-}
+    progress_html.$wrapper.html('<div style="padding: 10px; text-align: center; color: #666;"><strong>Kuyruğa ekleniyor...</strong></div>');
 
-function process_invoices_sequentially(doctype, invoices, current_index, total_count, dialog, listview) {
-    if (current_index >= invoices.length) {
-        let progress_html = dialog.fields_dict.progress_html;
-        if (progress_html) {
-            progress_html.$wrapper.html('<div style="padding: 10px; text-align: center; color: green;"><strong>✅ Tamamlandı! List view yenileniyor...</strong></div>');
-        }
-        dialog.get_primary_btn().prop('disabled', false);
-        setTimeout(function() {
-            dialog.hide();
-            if (listview) {
-                listview.refresh();
-            } else {
-                frappe.set_route('List', doctype);
-            }
-            frappe.show_alert({
-                message: `${total_count} invoice validasyonu tamamlandı. Sonuçlar list view'da görüntüleniyor.`,
-                indicator: 'green'
-            }, 5);
-        }, 500);
-        return;
-    }
-    let invoice = invoices[current_index];
-    let progress = ((current_index / total_count) * 100).toFixed(1);
-    let progress_html = dialog.fields_dict.progress_html;
-    if (progress_html) {
-        progress_html.$wrapper.html(`<div style="padding: 10px; text-align: center;"><strong>İşleniyor: ${current_index + 1}/${total_count} (${progress}%)</strong><br><small>${invoice.invoice_number || invoice.name}</small></div>`);
-    }
     frappe.call({
-        method: 'invoice.api.invoice_ai_validation.recheck_invoice_with_ai',
+        method: 'invoice.api.invoice_ai_validation.start_batch_ai_validation',
         args: {
             doctype: doctype,
-            name: invoice.name,
-            show_message: false
+            names: selection.names,
+            filters: selection.filters,
+            force: dialog.get_value('force') ? 1 : 0,
+            mode: dialog.get_value('mode')
         },
         callback: function(r) {
-            setTimeout(function() {
-                process_invoices_sequentially(doctype, invoices, current_index + 1, total_count, dialog, listview);
-            }, 100);
+            if (!r.message) return;
+            let run_name = r.message;
+            frappe.realtime.off('invoice_ai_validation_progress');
+            frappe.realtime.on('invoice_ai_validation_progress', function(data) {
+                if (data.run !== run_name) return;
+                render_batch_validation_progress(data, dialog, listview);
+            });
+            frappe.call({
+                method: 'invoice.api.invoice_ai_validation.get_batch_ai_validation_status',
+                args: { run_name: run_name },
+                callback: function(status) {
+                    if (status.message) render_batch_validation_progress(status.message, dialog, listview);
+                }
+            });
         },
-        error: function(r) {
-            setTimeout(function() {
-                process_invoices_sequentially(doctype, invoices, current_index + 1, total_count, dialog, listview);
-            }, 100);
+        error: function() {
+            dialog.get_primary_btn().prop('disabled', false);
         }
     });
 }
 
+function render_batch_validation_progress(data, dialog, listview) {
+    let progress = data.total ? ((data.processed / data.total) * 100).toFixed(1) : '0.0';
+    let counts = `✅ ${data.valid} geçerli, ⚠️ ${data.issues_found} sorunlu, ❌ ${data.errors} hata, 🤖 ${data.model_calls} model çağrısı (⬆️ ${data.escalations} üst model)`;
+    let link = `<a href="/app/invoice-ai-validation-run/${data.run}">${data.run}</a>`;
+
+    if (data.status === 'Submitted') {
+        // Batch File: sonuçlar sağlayıcıda hazırlanıyor, scheduler hazır olunca uygular
+        frappe.realtime.off('invoice_ai_validation_progress');
+        dialog.fields_dict.progress_html.$wrapper.html(`<div style="padding: 10px; text-align: center; color: #666;"><strong>📦 Batch gönderildi: ${data.model_calls} fatura</strong><br><small>${counts}</small><br><small>${link} — sonuçlar hazır olunca otomatik uygulanır.</small></div>`);
+        dialog.get_primary_btn().prop('disabled', false);
+        listview.refresh();
+        return;
+    }
+
+    if (!data.finished) {
+        dialog.fields_dict.progress_html.$wrapper.html(`<div style="padding: 10px; text-align: center;"><strong>İşleniyor: ${data.processed}/${data.total} (${progress}%)</strong><br><small>${counts}</small><br><small style="color: #999;">${link} — pencereyi kapatabilirsiniz, doğrulama arka planda devam eder.</small></div>`);
+        return;
+    }
+
+    frappe.realtime.off('invoice_ai_validation_progress');
+    let failed = data.status === 'Failed';
+    dialog.fields_dict.progress_html.$wrapper.html(`<div style="padding: 10px; text-align: center; color: ${failed ? 'red' : 'green'};"><strong>${failed ? '❌ Durdu' : '✅ Tamamlandı'}: ${data.processed}/${data.total}</strong><br><small>${counts}</small><br><small>${link}</small></div>`);
+    dialog.get_primary_btn().prop('disabled', false);
+    listview.refresh();
+    frappe.show_alert({
+        message: `${data.processed} invoice validasyonu ${failed ? 'durdu' : 'tamamlandı'} (${counts})`,
+        indicator: failed ? 'red' : 'green'
+    }, 8);
+}
+
+function setup_ingest_progress(listview) {
+    // Fatura işleme ilerlemesi: tek realtime kanalı, tek canlı toast
+    frappe.realtime.off('invoice_ingest_progress');
+    frappe.realtime.on('invoice_ingest_progress', function(data) {
+        let state = frappe.invoice_ingest_progress = frappe.invoice_ingest_progress || { emails: {} };
+        (data.emails || []).forEach(function(email) {
+            let previous = state.emails[email.communication];
+            // Paralel işlerden gelen eski durum sayacı geri almasın
+            if (previous && !email.finished) {
+                email.done = Math.max(previous.done, email.done);
+            }
+            state.emails[email.communication] = email;
+        });
+        render_ingest_progress(state, listview);
+    });
+}
+
+function render_ingest_progress(state, listview) {
+    let emails = Object.values(state.emails);
+    let totals = { files: 0, done: 0, new: 0, errors: 0 };
+    emails.forEach(function(email) {
+        totals.files += email.files;
+        totals.done += email.done;
+        totals.new += email.new;
+        totals.errors += email.errors;
+    });
+    let running = emails.filter(function(email) { return !email.finished; }).length;
 
+    let message = running
+        ? `📧 ${running} email işleniyor — ${totals.done}/${totals.files} PDF, ${totals.new} yeni fatura`
+        : `✅ ${emails.length} email işlendi — ${totals.new} yeni fatura`;
+    if (totals.errors) {
+        message += `, ${totals.errors} hata`;
+    }
 
+    if (running) {
+        if (state.$toast && state.$toast.is(':visible')) {
+            state.$toast.find('.alert-message').html(message);
+        } else {
+            state.$toast = frappe.show_alert({ message: message, indicator: 'blue' }, 600);
+        }
+        return;
+    }
+
+    // Hepsi bitti: canlı toast yerine son durum, liste yenilenir
+    if (state.$toast) {
+        state.$toast.remove();
+    }
+    state.$toast = null;
+    state.emails = {};
+    frappe.show_alert({ message: message, indicator: totals.errors ? 'red' : 'green' }, 8);
+    listview.refresh();
+}
@@ -0,0 +1,70 @@
+# Copyright (c) 2026, invoice and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_netting import PENDING_NETTING_DOCTYPE, link_netting_report
+
+NETTING_VALUES = {"netting_net_payout": 123.45, "netting_wolt_gross": 20.5}
+
+
+class TestWoltNettingPendingLink(FrappeTestCase):
+	def setUp(self):
+		# Giden email: Communication hook'u PDF işlemeden çıkar
+		self.communication = frappe.get_doc({
+			"doctype": "Communication",
+			"communication_type": "Communication",
+			"communication_medium": "Email",
+			"sent_or_received": "Sent",
+			"subject": "Wolt payout report",
+		}).insert(ignore_permissions=True)
+
+	def make_netting_pdf(self, file_name):
+		file_doc = frappe.get_doc({
+			"doctype": "File",
+			"file_name": file_name,
+			"attached_to_doctype": "Communication",
+			"attached_to_name": self.communication.name,
+			"is_private": 1,
+			"content": f"netting report {file_name}",
+		}).insert(ignore_permissions=True)
+		return frappe._dict(name=file_doc.name, file_name=file_name)
+
+	def make_wolt_invoice(self, invoice_number):
+		return frappe.get_doc({
+			"doctype": "Wolt Invoice",
+			"invoice_number": invoice_number,
+			"invoice_date": "2026-01-31",
+		}).insert(ignore_permissions=True)
+
+	def test_pending_link_resolved_on_invoice_insert(self):
+		pdf = self.make_netting_pdf("R__netting_report__semi_monthly__2026-01-16__2026-02-01.pdf")
+		linked = link_netting_report(self.communication, pdf, "deu/26/hrb1/1/7", NETTING_VALUES)
+		self.assertIsNone(linked)
+
+		# Kayıt adı normalize Rechnungsnummer
+		pending = frappe.get_doc(PENDING_NETTING_DOCTYPE, "DEU/26/HRB1/1/7")
+		self.assertEqual(pending.status, "Pending")
+		self.assertEqual(pending.file, pdf.name)
+		self.assertEqual(json.loads(pending.netting_values), NETTING_VALUES)
+
+		invoice = self.make_wolt_invoice("DEU/26/HRB1/1/7")
+
+		pending.reload()
+		self.assertEqual(pending.status, "Linked")
+		self.assertEqual(pending.linked_invoice, invoice.name)
+		invoice.reload()
+		self.assertEqual(invoice.netting_net_payout, 123.45)
+		self.assertTrue(invoice.netting_report_pdf)
+
+	def test_existing_invoice_linked_directly(self):
+		invoice = self.make_wolt_invoice("DEU/26/HRB1/1/8")
+		pdf = self.make_netting_pdf("R__netting_report__semi_monthly__2026-02-01__2026-02-16.pdf")
+
+		linked = link_netting_report(self.communication, pdf, invoice.invoice_number, NETTING_VALUES)
+		self.assertEqual(linked, invoice.name)
+		self.assertFalse(frappe.db.exists(PENDING_NETTING_DOCTYPE, "DEU/26/HRB1/1/8"))
+		self.assertEqual(frappe.db.get_value("Wolt Invoice", invoice.name, "netting_wolt_gross"), 20.5)
@@ -0,0 +1,14 @@
+# Copyright (c) 2026, invoice and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+from invoice.api.invoice_locks import canonical_invoice_number
+
+
+class WoltNettingPendingLink(Document):
+	def autoname(self):
+		# Rechnungsnummer başına tek kayıt: Wolt Invoice oluşunca tek PK sorgusu yeterli
+		self.invoice_number = canonical_invoice_number(self.invoice_number)
+		self.name = self.invoice_number
@@ -0,0 +1,5 @@
+from invoice.api.invoice_ledger import backfill_invoice_ledger
+
+
+def execute():
+    backfill_invoice_ledger()
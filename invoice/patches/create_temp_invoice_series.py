@@ -0,0 +1,10 @@
+import frappe
+
+from invoice.api.invoice_email_handler import TEMP_INVOICE_SERIES
+
+
+def execute():
+    # Seri satırı önceden var olursa getseries hiçbir zaman INSERT yoluna düşmez
+    # (ilk çağrıda iki worker'ın aynı anda INSERT yapıp çakışmasını önler)
+    if not frappe.db.sql("select name from `tabSeries` where name=%s", TEMP_INVOICE_SERIES):
+        frappe.db.sql("insert into `tabSeries` (`name`, `current`) values (%s, 0)", TEMP_INVOICE_SERIES)
@@ -0,0 +1,6 @@
+from invoice.api.invoice_ledger import backfill_invoice_ledger
+
+
+def execute():
+    # fee_amount önceden Lieferando'nun subtotal alanından yazılıyordu
+    backfill_invoice_ledger(doctypes=("Lieferando Invoice",))
@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from invoice.api.imap_client import ImapIdleListener
+from invoice.tools.imap_stub import StubMailbox, make_message, start_stub_server
+
+IDLE_TIMEOUT = 0.2
+WAIT = 5
+
+
+class TestImapIdleListener(unittest.IsolatedAsyncioTestCase):
+    """Gerçek ImapIdleListener, yerel stub sunucuya (SSL'siz) karşı"""
+
+    async def asyncSetUp(self):
+        self.mailbox = StubMailbox()
+        # Listener başlamadan önce gelen mesaj: çekilmemeli
+        self.mailbox.deliver(make_message(0))
+        self.server = await start_stub_server(self.mailbox)
+        self.received = asyncio.Queue()
+        self.states = []
+        self.gaps = []
+        self.listener = None
+
+    async def asyncTearDown(self):
+        if self.listener:
+            self.listener.stop()
+            await asyncio.wait_for(self.task, WAIT)
+        self.server.close()
+        await self.server.wait_closed()
+
+    def start_listener(self, **kwargs):
+        port = self.server.sockets[0].getsockname()[1]
+        self.listener = ImapIdleListener(
+            {"host": "127.0.0.1", "port": port, "use_ssl": False, "user": "stub", "password": "stub"},
+            on_messages=lambda messages: [self.received.put_nowait(uid) for uid, _raw in messages],
+            on_state=self.states.append,
+            on_gap=lambda: self.gaps.append(True),
+            idle_timeout=IDLE_TIMEOUT,
+            **kwargs,
+        )
+        self.task = asyncio.create_task(self.listener.run())
+
+    async def wait_until(self, condition):
+        async def poll():
+            while not condition():
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(poll(), WAIT)
+
+    async def wait_idle(self):
+        await self.wait_until(lambda: any(session.idling for session in self.mailbox.sessions))
+
+    async def test_receives_only_new_messages(self):
+        self.start_listener()
+        await self.wait_idle()
+
+        for i in range(1, 4):
+            uid = self.mailbox.deliver(make_message(i))
+            self.assertEqual(await asyncio.wait_for(self.received.get(), WAIT), uid)
+            if i == 2:
+                # IDLE yenilemesinden sonra da mesaj gelmeli
+                await asyncio.sleep(IDLE_TIMEOUT * 2)
+            await self.wait_idle()
+
+        self.assertEqual(self.mailbox.fetched_uids, [2, 3, 4])
+        self.assertEqual(self.gaps, [True])
+        self.assertEqual(self.listener.last_uid, 4)
+
+    async def test_reconnects_after_disconnect(self):
+        with patch("invoice.api.imap_client.RECONNECT_MIN_DELAY", 0.05):
+            self.start_listener()
+            await self.wait_idle()
+            uid = self.mailbox.deliver(make_message(1))
+            self.assertEqual(await asyncio.wait_for(self.received.get(), WAIT), uid)
+            await self.wait_idle()
+
+            # Sunucu tarafında bağlantıyı kopar; kopukken gelen mesaj yeniden bağlanınca alınmalı
+            for session in list(self.mailbox.sessions):
+                session.writer.close()
+            await self.wait_until(lambda: any(state.get("error") for state in self.states))
+            missed_uid = self.mailbox.deliver(make_message(2))
+
+            self.assertEqual(await asyncio.wait_for(self.received.get(), WAIT), missed_uid)
+            await self.wait_idle()
+            uid = self.mailbox.deliver(make_message(3))
+            self.assertEqual(await asyncio.wait_for(self.received.get(), WAIT), uid)
+
+        disconnected = [state for state in self.states if state.get("connected") is False]
+        self.assertTrue(disconnected)
+        self.assertTrue(self.states[-1]["connected"])
+        self.assertEqual(self.mailbox.fetched_uids, [2, 3, 4])
+        # Aynı UIDVALIDITY: yeniden bağlanmada catch-up poll gerekmez
+        self.assertEqual(self.gaps, [True])
+
+    async def test_uidvalidity_change_restarts_tracking(self):
+        self.start_listener(last_uid=10, uidvalidity=99)
+        await self.wait_idle()
+
+        self.assertEqual(self.gaps, [True])
+        self.assertEqual((self.listener.uidvalidity, self.listener.last_uid), (1, 1))
+        uid = self.mailbox.deliver(make_message(1))
+        self.assertEqual(await asyncio.wait_for(self.received.get(), WAIT), uid)
+        self.assertEqual(self.mailbox.fetched_uids, [2])
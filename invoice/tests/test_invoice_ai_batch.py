@@ -0,0 +1,189 @@
+import json
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_ai_batch import BATCH_MODE, apply_validation_batch, poll_validation_batches
+from invoice.api.invoice_ai_validation import VALIDATION_RUN_DOCTYPE, run_batch_ai_validation
+from invoice.tools.fake_openai import DEFAULT_RESULT, StubOpenAIServer
+
+APPLY_METHOD = "invoice.api.invoice_ai_batch.apply_validation_batch"
+
+
+class StubBatchClient:
+    """fake_openai sunucusunun dosya / batch mantığı, HTTP olmadan (SDK'nın kullanılan kısmı)"""
+
+    def __init__(self, server):
+        self.server = server
+        self.files = frappe._dict(create=self.create_file, content=self.get_file_content)
+        self.batches = frappe._dict(create=self.create_batch, retrieve=self.retrieve_batch)
+
+    def create_file(self, file, purpose):
+        return frappe._dict(self.server.add_file(file.read(), "batch.jsonl", purpose))
+
+    def get_file_content(self, file_id):
+        return frappe._dict(text=self.server.files[file_id]["content"].decode())
+
+    def create_batch(self, **kwargs):
+        return frappe._dict(self.server.create_batch(kwargs))
+
+    def retrieve_batch(self, batch_id):
+        return frappe._dict(self.server.get_batch(batch_id))
+
+    def get_requests(self, batch_id):
+        """Batch'e gönderilen satırlar: {custom_id: istek gövdesi}"""
+        content = self.server.files[self.server.batches[batch_id]["input_file_id"]]["content"]
+        return {line["custom_id"]: line["body"] for line in map(json.loads, content.decode().splitlines())}
+
+    def complete_batch(self, batch_id, lines):
+        """Batch'i verilen sonuç satırlarıyla tamamla"""
+        content = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        output = self.server.add_file(content, f"{batch_id}_output.jsonl", "batch_output")
+        self.server.batches[batch_id].update({"status": "completed", "output_file_id": output["id"]})
+
+
+def make_line(custom_id, result=None, status_code=200):
+    body = {
+        "choices": [{"message": {"content": json.dumps(result or DEFAULT_RESULT)}}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 20},
+    }
+    if status_code != 200:
+        body = {"error": {"message": "Rate limit"}}
+    return {"custom_id": custom_id, "response": {"status_code": status_code, "body": body}, "error": None}
+
+
+def make_invoice(invoice_number, raw_text="Gesamtbetrag € 99,00"):
+    # Toplam PDF metninde yok: kural kontrolü tutmaz, fatura batch'e girer
+    return frappe.get_doc({
+        "doctype": "Lieferando Invoice",
+        "invoice_number": invoice_number,
+        "invoice_date": "2026-02-01",
+        "supplier_name": "Takeaway.com",
+        "restaurant_name": "Test Restaurant",
+        "customer_number": "12345",
+        "subtotal": 30,
+        "tax_rate": 19,
+        "tax_amount": 5.7,
+        "total_amount": 35.7,
+        "outstanding_amount": 35.7,
+        "raw_text": raw_text,
+    }).insert(ignore_permissions=True)
+
+
+class TestInvoiceAIBatch(FrappeTestCase):
+    def setUp(self):
+        self.server = StubOpenAIServer(("127.0.0.1", 0))
+        self.addCleanup(self.server.server_close)
+        self.client = StubBatchClient(self.server)
+        client = patch("invoice.api.invoice_ai_batch.get_openai_client", return_value=self.client)
+        client.start()
+        self.addCleanup(client.stop)
+
+    def make_run(self, count, rules_passing=0):
+        prefix = f"AIBATCH-{frappe.generate_hash(length=6)}"
+        self.names = [make_invoice(f"{prefix}-{i}").name for i in range(count)]
+        # Kural kontrolü tutan faturalar batch'e girmez
+        self.rules_names = [
+            make_invoice(f"{prefix}-R{i}", raw_text="Gesamtbetrag € 35,70").name
+            for i in range(rules_passing)
+        ]
+        names = self.names + self.rules_names
+        return frappe.get_doc({
+            "doctype": VALIDATION_RUN_DOCTYPE,
+            "invoice_doctype": "Lieferando Invoice",
+            "invoices": json.dumps(names),
+            "total": len(names),
+            "mode": BATCH_MODE,
+        }).insert(ignore_permissions=True)
+
+    def submit(self, run):
+        run_batch_ai_validation(run.name)
+        run.reload()
+        self.assertEqual(run.status, "Submitted")
+        return run
+
+    def get_invoice(self, name):
+        return frappe.db.get_value("Lieferando Invoice", name,
+            ["ai_validation_status", "ai_validation_summary", "ai_validation_model"], as_dict=True
+        )
+
+    def test_submit_poll_and_apply(self):
+        run = self.submit(self.make_run(3, rules_passing=1))
+
+        requests = self.client.get_requests(run.batch_id)
+        self.assertEqual(sorted(requests), sorted(self.names))
+        self.assertEqual({body["model"] for body in requests.values()}, {"gpt-4o-mini"})
+        self.assertEqual(sorted(json.loads(run.batch_requests)), sorted(self.names))
+        self.assertEqual((run.processed, run.valid, run.model_calls), (1, 1, 3))
+
+        with patch("frappe.enqueue") as enqueue:
+            poll_validation_batches()
+        (apply_job,) = [call for call in enqueue.call_args_list if call.kwargs.get("run_name") == run.name]
+        self.assertEqual(apply_job.args[0], APPLY_METHOD)
+
+        apply_validation_batch(run.name)
+        run.reload()
+        self.assertEqual(run.status, "Completed")
+        self.assertEqual(run.batch_status, "completed")
+        self.assertEqual((run.processed, run.valid, run.errors), (4, 4, 0))
+        for name in self.names:
+            self.assertEqual(self.get_invoice(name).ai_validation_model, "gpt-4o-mini")
+
+    def test_apply_matches_results_by_custom_id(self):
+        with patch.dict(frappe.conf, {"invoice_ai_validation_models": "gpt-4o"}):
+            run = self.submit(self.make_run(4))
+            valid, issues, failed, missing = self.names
+            issues_result = dict(DEFAULT_RESULT, status="Issues Found", summary="Toplam uyuşmuyor")
+
+            # Sonuç dosyası istek sırasını korumaz; bilinmeyen custom_id atlanır
+            self.client.complete_batch(run.batch_id, [
+                make_line(failed, status_code=429),
+                make_line("UNKNOWN-INVOICE"),
+                make_line(issues, issues_result),
+                make_line(valid),
+            ])
+            apply_validation_batch(run.name)
+
+        run.reload()
+        self.assertEqual(run.status, "Completed")
+        self.assertEqual((run.processed, run.valid, run.issues_found, run.errors), (4, 1, 1, 2))
+
+        self.assertEqual(self.get_invoice(valid).ai_validation_status, "Valid")
+        self.assertEqual(self.get_invoice(issues).ai_validation_summary, "Toplam uyuşmuyor")
+        self.assertEqual(self.get_invoice(failed).ai_validation_status, "Error")
+        self.assertIn("Rate limit", self.get_invoice(failed).ai_validation_summary)
+        self.assertEqual(self.get_invoice(missing).ai_validation_status, "Error")
+        self.assertIn("Batch sonucu yok", self.get_invoice(missing).ai_validation_summary)
+
+        # Tekrar uygulama bir şey değiştirmez
+        apply_validation_batch(run.name)
+        run.reload()
+        self.assertEqual(run.processed, 4)
+
+    def test_low_confidence_goes_to_escalation_batch(self):
+        run = self.submit(self.make_run(2))
+        first_batch = run.batch_id
+        escalated, kept = self.names
+        self.client.complete_batch(first_batch, [
+            make_line(escalated, dict(DEFAULT_RESULT, confidence=0.6)),
+            make_line(kept),
+        ])
+
+        apply_validation_batch(run.name)
+        run.reload()
+        self.assertEqual(run.status, "Submitted")
+        self.assertNotEqual(run.batch_id, first_batch)
+        self.assertEqual(self.client.get_requests(run.batch_id)[escalated]["model"], "gpt-4o")
+        self.assertEqual(list(self.client.get_requests(run.batch_id)), [escalated])
+        (attempt,) = json.loads(run.batch_requests)[escalated]["attempts"]
+        self.assertEqual(attempt["model"], "gpt-4o-mini")
+        self.assertIn("confidence", attempt["escalation"])
+        self.assertEqual(run.processed, 1)
+
+        apply_validation_batch(run.name)
+        run.reload()
+        self.assertEqual(run.status, "Completed")
+        self.assertEqual((run.processed, run.valid, run.model_calls, run.escalations), (2, 2, 3, 1))
+        self.assertEqual(self.get_invoice(escalated).ai_validation_model, "gpt-4o-mini → gpt-4o")
+        self.assertEqual(self.get_invoice(kept).ai_validation_model, "gpt-4o-mini")
@@ -0,0 +1,366 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api import invoice_ai_validation as validation
+from invoice.api.invoice_ai_validation import (
+    ESCALATION_CONFIDENCE,
+    RESULT_CACHE_INDEX_KEY,
+    VALIDATION_RUN_DOCTYPE,
+    OpenAI,
+    cache_validation_result,
+    get_cached_validation,
+    get_routing_summary,
+    get_validation_cache_key,
+    prepare_invoice_data_for_ai,
+    request_validation,
+    request_validation_async,
+    run_batch_ai_validation,
+    validate_invoice_with_ai,
+)
+
+SINGLE_MODEL = {"models": ("gpt-4o",), "min_confidence": 0.85}
+
+MODEL_RESULTS = {
+    "gpt-4o-mini": {"status": "Valid", "confidence": 0.97, "summary": "Tutarlı"},
+    "gpt-4o": {"status": "Valid", "confidence": 0.99, "summary": "Tutarlı"},
+}
+
+
+def make_response(model, results=None):
+    result = (results or MODEL_RESULTS)[model]
+    return {
+        "choices": [{"message": {"content": result if isinstance(result, str) else json.dumps(result)}}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 20},
+    }
+
+
+class FakeCompletions:
+    def __init__(self, results=None):
+        self.models = []
+        self.results = results
+
+    def create(self, model, **kwargs):
+        self.models.append(model)
+        if isinstance((self.results or {}).get(model), Exception):
+            raise self.results[model]
+        return make_response(model, self.results)
+
+
+class FakeClient:
+    def __init__(self, results=None):
+        self.chat = frappe._dict(completions=FakeCompletions(results))
+
+
+class FakeAsyncCompletions:
+    """Aynı anda kaç çağrının beklediğini sayar"""
+
+    def __init__(self):
+        self.models = []
+        self.in_flight = 0
+        self.peak = 0
+
+    async def create(self, model, **kwargs):
+        self.models.append(model)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        return make_response(model)
+
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.chat = frappe._dict(completions=FakeAsyncCompletions())
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def make_invoice(invoice_number, raw_text="Gesamtbetrag € 99,00"):
+    # Toplam PDF metninde yok: kural kontrolü tutmaz, fatura modele gider
+    return frappe.get_doc({
+        "doctype": "Lieferando Invoice",
+        "invoice_number": invoice_number,
+        "invoice_date": "2026-02-01",
+        "supplier_name": "Takeaway.com",
+        "restaurant_name": "Test Restaurant",
+        "customer_number": "12345",
+        "subtotal": 30,
+        "tax_rate": 19,
+        "tax_amount": 5.7,
+        "total_amount": 35.7,
+        "outstanding_amount": 35.7,
+        "raw_text": raw_text,
+    }).insert(ignore_permissions=True)
+
+
+class TestModelRouting(FrappeTestCase):
+    messages = [{"role": "user", "content": "stub"}]
+
+    def route(self, small_result, large_result=None, conf=None):
+        client = FakeClient({
+            "gpt-4o-mini": small_result,
+            "gpt-4o": large_result or {"status": "Issues Found", "confidence": 0.9, "summary": "Üst model"},
+        })
+        with patch.dict(frappe.conf, conf or {}):
+            result = request_validation(client, self.messages)
+        return client.chat.completions.models, result
+
+    def test_confident_small_model_is_final(self):
+        models, result = self.route({"status": "Valid", "confidence": ESCALATION_CONFIDENCE})
+        self.assertEqual(models, ["gpt-4o-mini"])
+        self.assertEqual(result["status"], "Valid")
+        (attempt,) = result["routing"]
+        self.assertEqual(attempt["model"], "gpt-4o-mini")
+        self.assertEqual((attempt["prompt_tokens"], attempt["completion_tokens"]), (100, 20))
+        self.assertNotIn("escalation", attempt)
+
+    def test_low_confidence_escalates(self):
+        models, result = self.route({"status": "Valid", "confidence": ESCALATION_CONFIDENCE - 0.01})
+        self.assertEqual(models, ["gpt-4o-mini", "gpt-4o"])
+        self.assertEqual((result["status"], result["summary"]), ("Issues Found", "Üst model"))
+        small, large = result["routing"]
+        self.assertIn("Düşük confidence", small["escalation"])
+        self.assertNotIn("escalation", large)
+        latency_ms = small["latency_ms"] + large["latency_ms"]
+        self.assertEqual(get_routing_summary(result), ("gpt-4o-mini → gpt-4o", latency_ms, 240))
+
+    def test_issues_and_unparseable_answers_escalate(self):
+        models, result = self.route({"status": "Issues Found", "confidence": 0.99})
+        self.assertEqual(models, ["gpt-4o-mini", "gpt-4o"])
+        self.assertEqual(result["routing"][0]["escalation"], "Status: Issues Found")
+
+        models, result = self.route("not json")
+        self.assertEqual(models, ["gpt-4o-mini", "gpt-4o"])
+        self.assertIn("parse", result["routing"][0]["escalation"])
+
+        models, result = self.route(ValueError("timeout"))
+        self.assertEqual(models, ["gpt-4o-mini", "gpt-4o"])
+        self.assertEqual(result["routing"][0]["escalation"], "timeout")
+
+    def test_last_model_is_final(self):
+        # Son modelin düşük confidence'ı da sonuçtur; hatası yükseltilir
+        models, result = self.route({"status": "Issues Found"}, {"status": "Valid", "confidence": 0.5})
+        self.assertEqual((models, result["status"]), (["gpt-4o-mini", "gpt-4o"], "Valid"))
+
+        with self.assertRaises(ValueError):
+            self.route({"status": "Issues Found"}, "not json")
+
+    def test_site_config(self):
+        models, _result = self.route({"status": "Valid", "confidence": 0.8},
+            conf={"invoice_ai_escalation_confidence": 0.75}
+        )
+        self.assertEqual(models, ["gpt-4o-mini"])
+
+        # Tek model: routing kapalı
+        models, result = self.route({"status": "Valid"}, {"status": "Valid", "confidence": 0.1},
+            conf={"invoice_ai_validation_models": "gpt-4o"}
+        )
+        self.assertEqual((models, result["confidence"]), (["gpt-4o"], 0.1))
+
+
+class TestValidationResultCache(FrappeTestCase):
+    def setUp(self):
+        frappe.cache.delete(frappe.cache.make_key(RESULT_CACHE_INDEX_KEY))
+
+    def validate(self, invoice, client, force=False):
+        with patch.object(validation, "get_openai_client", return_value=client):
+            return validate_invoice_with_ai(invoice.doctype, invoice.name, force=force)
+
+    def get_model(self, invoice):
+        return frappe.db.get_value(invoice.doctype, invoice.name, "ai_validation_model")
+
+    def test_miss_hit_and_force(self):
+        invoice = make_invoice(f"AIVAL-CACHE-{frappe.generate_hash(length=8)}")
+        client = FakeClient()
+
+        first = self.validate(invoice, client)
+        self.assertFalse(first["cached"])
+        self.assertEqual(client.chat.completions.models, ["gpt-4o-mini"])
+
+        second = self.validate(invoice, client)
+        self.assertTrue(second["cached"])
+        self.assertEqual((second["status"], second["method"]), ("Valid", "cache"))
+        self.assertEqual(client.chat.completions.models, ["gpt-4o-mini"])
+        self.assertEqual(self.get_model(invoice), "cache (gpt-4o-mini)")
+
+        forced = self.validate(invoice, client, force=True)
+        self.assertFalse(forced["cached"])
+        self.assertEqual(client.chat.completions.models, ["gpt-4o-mini", "gpt-4o-mini"])
+        self.assertEqual(self.get_model(invoice), "gpt-4o-mini")
+
+    def test_changed_invoice_misses(self):
+        invoice = make_invoice(f"AIVAL-CACHE-{frappe.generate_hash(length=8)}")
+        client = FakeClient()
+        self.validate(invoice, client)
+
+        frappe.db.set_value(invoice.doctype, invoice.name, "raw_text", "Gesamtbetrag € 98,00")
+        invoice.reload()
+        self.assertFalse(self.validate(invoice, client)["cached"])
+        self.assertEqual(len(client.chat.completions.models), 2)
+
+    def test_key_composition(self):
+        invoice = make_invoice(f"AIVAL-CACHE-{frappe.generate_hash(length=8)}")
+        data = prepare_invoice_data_for_ai(invoice)
+        routing = {"models": ("gpt-4o-mini", "gpt-4o"), "min_confidence": 0.85}
+
+        def key(**changes):
+            doc = frappe._dict(invoice.as_dict(), **changes.pop("doc", {}))
+            return get_validation_cache_key(doc, changes.pop("data", data), changes.pop("routing", routing))
+
+        base = key()
+        self.assertEqual(key(), base)
+        keys = [
+            key(data=dict(data, total_amount="36.7")),
+            key(doc={"raw_text": "Gesamtbetrag € 98,00"}),
+            key(doc={"doctype": "Wolt Invoice"}),
+            key(routing={"models": ("gpt-4o",), "min_confidence": 0.85}),
+            key(routing={"models": ("gpt-4o-mini", "gpt-4o"), "min_confidence": 0.9}),
+        ]
+        with patch.object(validation, "PROMPT_VERSION", validation.PROMPT_VERSION + 1):
+            keys.append(key())
+        with patch.dict(frappe.conf, {"invoice_ai_prompt_token_budget": 123}):
+            keys.append(key())
+
+        self.assertNotIn(base, keys)
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_eviction_beyond_cache_size(self):
+        keys = [f"evict-{frappe.generate_hash(length=8)}" for _i in range(3)]
+        result = {"status": "Valid", "confidence": 0.97}
+
+        with patch.dict(frappe.conf, {"invoice_ai_validation_cache_size": 2}):
+            for i, cache_key in enumerate(keys):
+                with patch.object(validation.time, "time", return_value=1_800_000_000 + i):
+                    cache_validation_result(cache_key, result)
+
+        self.assertIsNone(get_cached_validation(keys[0]))
+        self.assertEqual(get_cached_validation(keys[1]), result)
+        self.assertEqual(get_cached_validation(keys[2]), result)
+
+    def test_only_final_results_are_cached(self):
+        error_key, disabled_key = (f"final-{frappe.generate_hash(length=8)}" for _i in range(2))
+        cache_validation_result(error_key, {"status": "Error"})
+        self.assertIsNone(get_cached_validation(error_key))
+
+        with patch.dict(frappe.conf, {"invoice_ai_validation_cache_ttl": 0}):
+            cache_validation_result(disabled_key, {"status": "Valid"})
+        self.assertIsNone(get_cached_validation(disabled_key))
+
+
+class TestAsyncConcurrencyLimit(FrappeTestCase):
+    def test_semaphore_limits_in_flight_calls(self):
+        client = FakeAsyncClient()
+        messages = [{"role": "user", "content": "stub"}]
+
+        async def run():
+            semaphore = asyncio.Semaphore(3)
+            return await asyncio.gather(*(
+                request_validation_async(client, messages, semaphore, SINGLE_MODEL) for _i in range(10)
+            ))
+
+        results = asyncio.run(run())
+        self.assertEqual([result["status"] for result in results], ["Valid"] * 10)
+        self.assertEqual(client.chat.completions.peak, 3)
+
+    def test_run_uses_one_client_with_run_concurrency(self):
+        names = [make_invoice(f"AIVAL-LIMIT-{i}").name for i in range(6)]
+        run = frappe.get_doc({
+            "doctype": VALIDATION_RUN_DOCTYPE,
+            "invoice_doctype": "Lieferando Invoice",
+            "invoices": json.dumps(names),
+            "total": len(names),
+            "concurrency": 2,
+            "mode": "Realtime",
+        }).insert(ignore_permissions=True)
+        client = FakeAsyncClient()
+
+        with patch.object(validation, "get_async_openai_client", return_value=client) as get_client:
+            run_batch_ai_validation(run.name)
+
+        get_client.assert_called_once_with(2)
+        self.assertEqual(client.chat.completions.peak, 2)
+        self.assertTrue(client.closed)
+        run.reload()
+        self.assertEqual((run.status, run.valid, run.model_calls), ("Completed", 6, 6))
+
+
+@unittest.skipIf(OpenAI is None, "openai paketi yüklü değil")
+class TestOpenAIClientPool(FrappeTestCase):
+    """Gerçek SDK client'ları, yerel OpenAI stub sunucusuna (invoice.tools.fake_openai) karşı"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from invoice.tools.fake_openai import start_stub_server
+
+        cls.server = start_stub_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        conf = patch.dict(frappe.conf, {
+            "openai_api_key": "stub",
+            "invoice_openai_base_url": self.server.base_url,
+        })
+        conf.start()
+        self.addCleanup(conf.stop)
+        self.addCleanup(self.close_clients)
+
+    def close_clients(self):
+        for client in validation._openai_clients.values():
+            client.close()
+        validation._openai_clients.clear()
+
+    def test_sync_client_is_shared_and_kept_alive(self):
+        connections = self.server.connections
+        client = validation.get_openai_client()
+        messages = [{"role": "user", "content": "stub"}]
+
+        for _i in range(3):
+            result = request_validation(validation.get_openai_client(), messages, SINGLE_MODEL)
+            self.assertEqual(result["status"], "Valid")
+
+        self.assertIs(validation.get_openai_client(), client)
+        self.assertEqual(self.server.connections - connections, 1)
+
+    def test_client_per_base_url(self):
+        client = validation.get_openai_client()
+        with patch.dict(frappe.conf, {"invoice_openai_base_url": "http://127.0.0.1:1/v1"}):
+            self.assertIsNot(validation.get_openai_client(), client)
+        self.assertIs(validation.get_openai_client(), client)
+
+    def test_async_client_connection_limit(self):
+        limits = validation.get_http_limits(3)
+        self.assertEqual((limits.max_connections, limits.max_keepalive_connections), (3, 3))
+        self.assertEqual(limits.keepalive_expiry, validation.OPENAI_KEEPALIVE)
+
+        messages = [{"role": "user", "content": "stub"}]
+        connections = self.server.connections
+
+        async def run():
+            client = validation.get_async_openai_client(3)
+            semaphore = asyncio.Semaphore(3)
+            try:
+                return await asyncio.gather(*(
+                    request_validation_async(client, messages, semaphore, SINGLE_MODEL) for _i in range(9)
+                ))
+            finally:
+                await client.close()
+
+        with patch.object(self.server, "latency", 0.05):
+            results = asyncio.run(run())
+        self.assertEqual(len(results), 9)
+        self.assertLessEqual(self.server.connections - connections, 3)
@@ -0,0 +1,68 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_prevalidation import (
+    build_prevalidation_result,
+    format_amount_candidates,
+    format_failed_checks,
+    run_prevalidation,
+)
+
+
+def make_invoice(**values):
+    invoice = frappe._dict(
+        doctype="Lieferando Invoice",
+        subtotal=1000,
+        tax_rate=19,
+        tax_amount=190,
+        total_amount=1190,
+        outstanding_amount=1190,
+        raw_text="Zwischensumme € 1.000,00\nMwSt (19%) € 190,00\nGesamtbetrag dieser Rechnung € 1.190,00",
+    )
+    invoice.update(values)
+    return invoice
+
+
+class TestInvoicePrevalidation(FrappeTestCase):
+    def test_consistent_invoice_passes(self):
+        outcome = run_prevalidation(make_invoice())
+        self.assertTrue(outcome["passed"])
+        self.assertEqual(outcome["failed"], [])
+
+        result = build_prevalidation_result(outcome)
+        self.assertEqual((result["status"], result["method"]), ("Valid", "rules"))
+
+    def test_sum_mismatch_fails(self):
+        outcome = run_prevalidation(make_invoice(tax_amount=180))
+        self.assertFalse(outcome["passed"])
+        failed = {check["rule"] for check in outcome["failed"]}
+        self.assertIn("total_amount = subtotal + tax_amount", failed)
+        self.assertIn("tax_amount = subtotal × 19%", failed)
+        self.assertIn("expected 1180", format_failed_checks(outcome))
+
+    def test_vat_tolerance(self):
+        # Sipariş bazında yuvarlanan KDV birkaç cent sapabilir
+        outcome = run_prevalidation(make_invoice(
+            tax_amount=190.04, total_amount=1190.04, outstanding_amount=1190.04,
+            raw_text="Gesamtbetrag dieser Rechnung € 1.190,04",
+        ))
+        self.assertTrue(outcome["passed"])
+
+    def test_total_must_appear_in_text(self):
+        outcome = run_prevalidation(make_invoice(raw_text="Gesamtbetrag dieser Rechnung € 11.190,00"))
+        self.assertFalse(outcome["passed"])
+        self.assertEqual([check["field"] for check in outcome["failed"]], ["total_amount"])
+
+    def test_missing_total_fails(self):
+        outcome = run_prevalidation(make_invoice(
+            subtotal=0, tax_amount=0, total_amount=0, outstanding_amount=0
+        ))
+        self.assertFalse(outcome["passed"])
+        self.assertIn("total_amount", outcome["reason"])
+
+    def test_unknown_doctype(self):
+        self.assertFalse(run_prevalidation(frappe._dict(doctype="Sales Invoice"))["passed"])
+
+    def test_format_amount_candidates(self):
+        self.assertEqual(format_amount_candidates(1234.5), {"1.234,50", "1234,50", "1,234.50", "1234.50"})
+        self.assertEqual(format_amount_candidates(-7), {"7,00", "7.00"})
@@ -0,0 +1,45 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice.api.invoice_text_compaction import CHARS_PER_TOKEN, GAP_MARKER, compact_raw_text
+
+TOKEN_BUDGET = 100
+
+
+def make_invoice():
+    return frappe._dict(doctype="Lieferando Invoice", invoice_number="9876543", total_amount=1190)
+
+
+def make_statement(orders=300):
+    header = ["Takeaway.com Express GmbH", "Rechnungsnummer: 9876543", "Rechnungsdatum: 01.02.2026"]
+    filler = [f"Artikel {i:04d} Pizza Margherita" for i in range(25)]
+    order_lines = [f"{i:04d} 12:{i % 60:02d} € {i % 50 + 1},50" for i in range(orders)]
+    totals = ["Zwischensumme € 1.000,00", "MwSt (19%) € 190,00", "Gesamtbetrag dieser Rechnung € 1.190,00"]
+    return "\n".join(header + filler + order_lines + totals)
+
+
+class TestInvoiceTextCompaction(FrappeTestCase):
+    def test_short_text_unchanged(self):
+        raw_text = "Rechnungsnummer:   9876543\n\n  Gesamtbetrag € 1.190,00 "
+        self.assertEqual(
+            compact_raw_text(make_invoice(), raw_text, TOKEN_BUDGET),
+            "Rechnungsnummer: 9876543\nGesamtbetrag € 1.190,00",
+        )
+
+    def test_long_text_keeps_labels_and_totals(self):
+        compacted = compact_raw_text(make_invoice(), make_statement(), TOKEN_BUDGET)
+        lines = compacted.splitlines()
+
+        self.assertIn("Rechnungsnummer: 9876543", lines)
+        self.assertIn("Gesamtbetrag dieser Rechnung € 1.190,00", lines)
+        self.assertIn(GAP_MARKER, lines)
+
+        kept = [line for line in lines if line != GAP_MARKER]
+        self.assertLessEqual(sum(len(line) + 1 for line in kept), TOKEN_BUDGET * CHARS_PER_TOKEN)
+
+    def test_amount_only_lines_skipped(self):
+        # Bütçe dolmasa da sadece tutar içeren satırlar alınmaz
+        compacted = compact_raw_text(make_invoice(), make_statement(orders=100), token_budget=500)
+        self.assertIn(GAP_MARKER, compacted)
+        order_lines = [line for line in compacted.splitlines() if "12:" in line]
+        self.assertLessEqual(len(order_lines), 1)
@@ -0,0 +1,40 @@
+import os
+import unittest
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+MAX_LATENCY_MS = 1000
+
+
+@unittest.skipUnless(frappe.__name__ == "invoice.tools.fake_frappe", "Sadece fake_frappe ile çalışır")
+class TestReplay(FrappeTestCase):
+    """Bundled fixture'lar pipeline'dan geçer: fatura, ledger ve gecikme kontrolü"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from invoice.tools import replay
+
+        replay.seed_users(2)
+        cls.results, cls.summary = replay.replay(replay.load_fixtures(FIXTURE_DIR))
+
+    def test_invoices_created(self):
+        created = self.summary["created"]
+        self.assertEqual(created.get("Lieferando Invoice"), 2)
+        self.assertEqual(created.get("Wolt Invoice"), 1)
+        self.assertEqual(created.get("Invoice Ledger Entry"), 3)
+
+    def test_no_failed_jobs(self):
+        self.assertEqual(self.summary["failed_jobs"], [])
+        self.assertEqual(self.summary["emails"], 4)
+
+    def test_newsletter_skipped(self):
+        newsletter = next(r for r in self.results if r["fixture"] == "newsletter.txt")
+        logs = frappe.db.count("Invoice Ingest Log", {"communication": newsletter["communication"]})
+        self.assertEqual(logs, 0)
+
+    def test_latency(self):
+        # Worker içinde bekleme (sleep) olmamalı
+        self.assertLess(self.summary["latency_ms"]["max"], MAX_LATENCY_MS)
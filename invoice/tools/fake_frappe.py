@@ -0,0 +1,1130 @@
+"""
+Bellek içi Frappe yerine geçen modül (replay harness ve bench dışında pytest için)
+
+Fatura pipeline'ının kullandığı API yüzeyini (get_all, get_doc, db, cache,
+enqueue, publish_realtime, File depolama, hooks.doc_events) MariaDB, Redis
+ve RQ olmadan taklit eder. install() bu modülü sys.modules["frappe"] olarak
+kaydeder; invoice.api modülleri install()'dan sonra import edilmelidir.
+
+Her DB çağrısı sayılır (stats). Arka plan işleri kuyrukta bekler ve
+run_jobs() ile öncelik sırasına göre (short > default > long) çalıştırılır;
+now=True ile eklenen işler frappe'deki gibi hemen çalışır.
+
+frappe.tests.utils.FrappeTestCase da sunulur: uygulama testleri bench
+olmadan (invoice/conftest.py) her test sınıfı boş bir sitede çalışır.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import traceback
+import types
+import unittest
+import uuid
+from collections import Counter, deque
+from datetime import date, datetime, timedelta
+from importlib import import_module
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUEUE_ORDER = ("short", "default", "long")
+
+
+# ---------------------------------------------------------------------------
+# Temel tipler
+# ---------------------------------------------------------------------------
+
+
+class _dict(dict):
+    __getattr__ = dict.get
+    __setattr__ = dict.__setitem__
+    __delattr__ = dict.__delitem__
+
+    def copy(self):
+        return _dict(self)
+
+
+class ValidationError(Exception):
+    pass
+
+
+class DoesNotExistError(ValidationError):
+    pass
+
+
+class DuplicateEntryError(Exception):
+    pass
+
+
+def _(text, *args, **kwargs):
+    return text
+
+
+def scrub(text):
+    return (text or "").replace(" ", "_").replace("-", "_").lower()
+
+
+# ---------------------------------------------------------------------------
+# Durum
+# ---------------------------------------------------------------------------
+
+local = _dict(site="replay.local", flags=_dict(in_test=False))
+flags = local.flags
+session = _dict(user="Administrator")
+conf = _dict()
+
+stats = Counter()
+error_log = []
+
+_data = {}  # doctype -> name -> dict
+_meta = {}
+_series = Counter()
+_storage_dir = None
+
+
+def reset(site="replay.local", site_conf=None, storage_dir=None):
+    """Tüm bellek içi durumu sıfırla"""
+    global _storage_dir
+    local.site = site
+    flags.in_test = False
+    conf.clear()
+    conf.update(site_conf or {})
+    stats.clear()
+    error_log.clear()
+    _data.clear()
+    _series.clear()
+    db.after_commit.clear()
+    cache.clear()
+    jobs.clear()
+    _storage_dir = storage_dir or tempfile.mkdtemp(prefix="invoice-replay-")
+
+
+def _table(doctype):
+    return _data.setdefault(doctype, {})
+
+
+# ---------------------------------------------------------------------------
+# Filtreler
+# ---------------------------------------------------------------------------
+
+
+def _normalize_filters(filters):
+    if not filters:
+        return []
+    if isinstance(filters, dict):
+        items = filters.items()
+    else:
+        items = [(f[-3], [f[-2], f[-1]]) for f in filters]
+
+    normalized = []
+    for field, cond in items:
+        if isinstance(cond, (list, tuple)):
+            normalized.append((field, cond[0].lower(), cond[1]))
+        else:
+            normalized.append((field, "=", cond))
+    return normalized
+
+
+def _coerce(a, b):
+    # MariaDB gibi: tarih/sayı karşılaştırmaları string'e indirgenir
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a, b
+    return str(a), str(b)
+
+
+def _compare(value, op, expected):
+    if op in ("=", "=="):
+        return value == expected or (value is not None and str(value) == str(expected))
+    if op == "!=":
+        return not _compare(value, "=", expected)
+    if op == "in":
+        return any(_compare(value, "=", e) for e in expected)
+    if op == "not in":
+        return not _compare(value, "in", expected)
+    if op == "like":
+        pattern = "^" + re.escape(str(expected)).replace("%", ".*").replace("_", ".") + "$"
+        return value is not None and re.match(pattern, str(value), re.IGNORECASE) is not None
+    if op == "is":
+        return (value not in (None, "")) == (expected == "set")
+    if value is None:
+        return False
+    a, b = _coerce(value, expected)
+    return {">": a > b, ">=": a >= b, "<": a < b, "<=": a <= b}[op]
+
+
+def _matches(row, filters):
+    return all(_compare(row.get(field), op, value) for field, op, value in filters)
+
+
+def _find(doctype, filters):
+    filters = _normalize_filters(filters)
+    return [row for row in _table(doctype).values() if _matches(row, filters)]
+
+
+# ---------------------------------------------------------------------------
+# Document
+# ---------------------------------------------------------------------------
+
+
+class Document(_dict):
+    """frappe.model.document.Document yerine (uygulama controller'ları bundan türer)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Instance attribute: kayda yazılmaz (frappe'deki doc.flags gibi)
+        object.__setattr__(self, "flags", _dict())
+
+    def insert(self, ignore_permissions=False, ignore_mandatory=False, **kwargs):
+        if callable(getattr(type(self), "autoname", None)):
+            self.autoname()
+        if not self.get("name"):
+            self.name = _autoname(self)
+        _run_method(self, "validate")
+
+        table = _table(self.doctype)
+        if self.name in table:
+            raise DuplicateEntryError(f"{self.doctype} {self.name} zaten var")
+
+        now_value = utils.now()
+        self.setdefault("creation", now_value)
+        self.modified = now_value
+        self.owner = self.get("owner") or session.user
+        self._store()
+
+        _run_method(self, "after_insert")
+        _run_method(self, "on_update")
+        return self
+
+    def save(self, ignore_permissions=False, **kwargs):
+        if self.name not in _table(self.doctype):
+            return self.insert(ignore_permissions=ignore_permissions)
+        _run_method(self, "validate")
+        self.modified = utils.now()
+        self._store()
+        _run_method(self, "on_update")
+        return self
+
+    def db_set(self, fieldname, value=None, update_modified=True, **kwargs):
+        values = fieldname if isinstance(fieldname, dict) else {fieldname: value}
+        self.update(values)
+        db.set_value(self.doctype, self.name, values)
+
+    def reload(self):
+        self.update(_table(self.doctype)[self.name])
+        return self
+
+    def as_dict(self, **kwargs):
+        return _dict(self)
+
+    def delete(self, ignore_permissions=False, **kwargs):
+        delete_doc(self.doctype, self.name)
+
+    def _store(self):
+        stats["writes"] += 1
+        _table(self.doctype)[self.name] = _dict(self)
+
+
+class File(Document):
+    def insert(self, **kwargs):
+        content = self.pop("content", None)
+        if content is not None:
+            if isinstance(content, str):
+                content = content.encode()
+            self.name = self.get("name") or uuid.uuid4().hex[:10]
+            path = os.path.join(_storage_dir, f"{self.name}-{os.path.basename(self.file_name or 'file')}")
+            with open(path, "wb") as f:
+                f.write(content)
+            self.file_url = f"/files/{os.path.basename(path)}"
+            self.file_size = len(content)
+            self.content_hash = self.get("content_hash") or hashlib.md5(content).hexdigest()
+        return super().insert(**kwargs)
+
+    def get_full_path(self):
+        return os.path.join(_storage_dir, os.path.basename(self.file_url or ""))
+
+    def get_content(self):
+        with open(self.get_full_path(), "rb") as f:
+            return f.read()
+
+
+CORE_CONTROLLERS = {"File": File}
+
+
+def _controller(doctype):
+    if doctype in CORE_CONTROLLERS:
+        return CORE_CONTROLLERS[doctype]
+    module_name = scrub(doctype)
+    try:
+        module = import_module(f"invoice.invoice.doctype.{module_name}.{module_name}")
+    except ImportError:
+        return Document
+    return getattr(module, doctype.replace(" ", "").replace("-", ""), Document)
+
+
+def _autoname(doc):
+    autoname = (get_meta(doc.doctype).get("autoname") or "") if _has_meta(doc.doctype) else ""
+    if autoname.startswith("field:"):
+        return doc.get(autoname[6:])
+    if autoname.startswith("format:"):
+        def replace(match):
+            digits = len(match.group(1))
+            _series[autoname] += 1
+            return str(_series[autoname]).zfill(digits)
+        return re.sub(r"\{(#+)\}", replace, autoname[7:])
+    return uuid.uuid4().hex[:10]
+
+
+def _run_method(doc, method):
+    if callable(getattr(type(doc), method, None)):
+        getattr(doc, method)()
+    if method in ("validate",):
+        return
+
+    from invoice.hooks import doc_events
+
+    for key in (doc.doctype, "*"):
+        handlers = (doc_events.get(key) or {}).get(method) or []
+        for handler in [handlers] if isinstance(handlers, str) else handlers:
+            _resolve(handler)(doc, method)
+
+
+def _resolve(path):
+    module, attr = path.rsplit(".", 1)
+    return getattr(import_module(module), attr)
+
+
+# ---------------------------------------------------------------------------
+# Meta
+# ---------------------------------------------------------------------------
+
+
+def _meta_path(doctype):
+    name = scrub(doctype)
+    return os.path.join(APP_ROOT, "invoice", "doctype", name, f"{name}.json")
+
+
+def _has_meta(doctype):
+    return doctype in _meta or os.path.exists(_meta_path(doctype))
+
+
+def get_meta(doctype):
+    if doctype not in _meta:
+        with open(_meta_path(doctype)) as f:
+            meta = _dict(json.load(f))
+        meta.fields = [_dict(field) for field in meta.get("fields", [])]
+        _meta[doctype] = meta
+    return _meta[doctype]
+
+
+# ---------------------------------------------------------------------------
+# Sorgular
+# ---------------------------------------------------------------------------
+
+
+def get_all(doctype, filters=None, fields=None, order_by=None, limit=None, limit_page_length=None,
+        pluck=None, or_filters=None, **kwargs):
+    stats["reads"] += 1
+    rows = _find(doctype, filters)
+    if or_filters:
+        alternatives = _normalize_filters(or_filters)
+        rows = [row for row in rows if any(_matches(row, [alt]) for alt in alternatives)]
+
+    for part in reversed([p.strip() for p in (order_by or "").split(",") if p.strip()]):
+        field, _sep, direction = part.partition(" ")
+        field = field.split(".")[-1].strip("`")
+        rows.sort(key=lambda r: (r.get(field) is None, str(r.get(field) or "")), reverse=direction.lower() == "desc")
+
+    limit = limit or limit_page_length
+    if limit:
+        rows = rows[: int(limit)]
+
+    if pluck:
+        return [row.get(pluck) for row in rows]
+
+    fields = fields or ["name"]
+    if fields == "*" or "*" in fields:
+        return [_dict(row) for row in rows]
+    return [_dict({f: row.get(f) for f in fields}) for row in rows]
+
+
+get_list = get_all
+
+
+def get_doc(*args, **kwargs):
+    if args and isinstance(args[0], dict):
+        values = _dict(args[0])
+        return _controller(values.doctype)(values)
+
+    doctype, name = args[0], args[1]
+    stats["reads"] += 1
+    row = _table(doctype).get(name)
+    if row is None:
+        raise DoesNotExistError(f"{doctype} {name} bulunamadı")
+    return _controller(doctype)(_dict(row))
+
+
+def new_doc(doctype):
+    return get_doc({"doctype": doctype})
+
+
+def delete_doc(doctype, name, ignore_permissions=False, force=False, **kwargs):
+    row = _table(doctype).get(name)
+    if row is None:
+        return
+    _run_method(_controller(doctype)(_dict(row)), "on_trash")
+    stats["writes"] += 1
+    _table(doctype).pop(name, None)
+
+
+class _DB:
+    def __init__(self):
+        self.after_commit = _Callbacks()
+
+    def exists(self, doctype, name=None, **kwargs):
+        stats["reads"] += 1
+        if isinstance(name, dict):
+            rows = _find(doctype, name)
+            return rows[0]["name"] if rows else None
+        return name if name in _table(doctype) else None
+
+    def get_value(self, doctype, filters=None, fieldname="name", as_dict=False, **kwargs):
+        stats["reads"] += 1
+        if isinstance(filters, dict):
+            rows = _find(doctype, filters)
+            row = rows[0] if rows else None
+        else:
+            row = _table(doctype).get(filters)
+        if row is None:
+            return None
+        if isinstance(fieldname, (list, tuple)):
+            values = _dict({f: row.get(f) for f in fieldname})
+            return values if as_dict else tuple(values.values())
+        return row.get(fieldname)
+
+    def set_value(self, doctype, name, fieldname, value=None, update_modified=True, **kwargs):
+        stats["writes"] += 1
+        values = fieldname if isinstance(fieldname, dict) else {fieldname: value}
+        rows = _find(doctype, name) if isinstance(name, dict) else [_table(doctype).get(name)]
+        for row in filter(None, rows):
+            row.update(values)
+            if update_modified:
+                row["modified"] = utils.now()
+
+    def bulk_insert(self, doctype, fields, values, ignore_duplicates=False, chunk_size=10000):
+        stats["writes"] += 1
+        table = _table(doctype)
+        for row in values:
+            row = _dict(zip(fields, row))
+            if row.name in table and not ignore_duplicates:
+                raise DuplicateEntryError(f"{doctype} {row.name} zaten var")
+            table.setdefault(row.name, row)
+
+    def count(self, doctype, filters=None, **kwargs):
+        stats["reads"] += 1
+        return len(_find(doctype, filters))
+
+    def savepoint(self, name):
+        pass
+
+    def commit(self):
+        stats["commits"] += 1
+        self.after_commit.run()
+
+    def rollback(self, save_point=None, **kwargs):
+        # Yazmalar geri alınmaz; duplicate insert'ler zaten kayıt yazmadan hata verir
+        stats["rollbacks"] += 1
+        if not save_point:
+            self.after_commit.clear()
+
+    def sql(self, *args, **kwargs):
+        raise NotImplementedError("Replay harness raw SQL desteklemiyor")
+
+
+class _Callbacks:
+    def __init__(self):
+        self._callbacks = []
+
+    def add(self, callback):
+        self._callbacks.append(callback)
+
+    def run(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def clear(self):
+        self._callbacks = []
+
+
+db = _DB()
+
+
+# ---------------------------------------------------------------------------
+# Redis
+# ---------------------------------------------------------------------------
+
+
+def _b(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class _Lock:
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+
+    def acquire(self, blocking=True, **kwargs):
+        # Tek thread: kilit tutuluyorsa beklemek kilitlenmeye yol açar
+        if self.name in self.cache.locks:
+            stats["lock_contention"] += 1
+            return False
+        self.cache.locks.add(self.name)
+        self.cache.raw[self.name] = b"1"
+        return True
+
+    def reacquire(self):
+        return True
+
+    def release(self):
+        self.cache.locks.discard(self.name)
+        self.cache.raw.pop(self.name, None)
+
+
+class _Pipeline:
+    def __init__(self, cache):
+        self.cache = cache
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.cache, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class _Script:
+    """register_script: Lua yerine aynı işi yapan Python karşılığı (tek thread, zaten atomik)"""
+
+    def __init__(self, cache, script):
+        self.cache = cache
+        self.script = script
+
+    def __call__(self, keys=(), args=(), client=None):
+        from invoice.api.invoice_ingest import RECORD_RESULT_SCRIPT
+
+        emulations = {RECORD_RESULT_SCRIPT: self._record_attachment_result}
+        if self.script not in emulations:
+            raise NotImplementedError("fake_frappe: bu Lua script'inin Python karşılığı yok")
+        return emulations[self.script](list(keys), list(args))
+
+    def _record_attachment_result(self, keys, args):
+        batch, invoices, netting = keys
+        if not self.cache.exists(batch):
+            return None
+        for field, amount in zip(args[3::2], args[4::2]):
+            self.cache.hincrby(batch, field, amount)
+        if args[1]:
+            self.cache.rpush(invoices, args[1])
+        if args[2]:
+            self.cache.rpush(netting, args[2])
+        return self.cache.hincrby(batch, "remaining", -1)
+
+
+class _Cache:
+    """frappe.cache (RedisWrapper) yerine: nesne API'si + kullanılan ham Redis komutları"""
+
+    def __init__(self):
+        self.objects = {}
+        self.hashes = {}
+        self.raw = {}
+        self.locks = set()
+
+    def clear(self):
+        self.objects.clear()
+        self.hashes.clear()
+        self.raw.clear()
+        self.locks.clear()
+
+    def make_key(self, key, user=None, shared=False):
+        return f"{local.site}|{key}"
+
+    # RedisWrapper nesne API'si
+    def get_value(self, key, generator=None, user=None, expires=False, shared=False):
+        if key not in self.objects and generator:
+            self.objects[key] = generator()
+        return self.objects.get(key)
+
+    def set_value(self, key, val, user=None, expires_in_sec=None, shared=False):
+        self.objects[key] = val
+
+    def delete_value(self, keys, user=None, make_keys=True, shared=False):
+        for key in [keys] if isinstance(keys, str) else keys:
+            self.objects.pop(key, None)
+            self.hashes.pop(key, None)
+
+    def hget(self, name, key, generator=None, shared=False):
+        values = self.hashes.setdefault(name, {})
+        if key not in values and generator:
+            values[key] = generator()
+        return values.get(key)
+
+    def hset(self, name, key=None, value=None, shared=False, mapping=None):
+        if mapping is not None:
+            target = self.raw.setdefault(name, {})
+            target.update({_b(k): _b(v) for k, v in mapping.items()})
+            return len(mapping)
+        self.hashes.setdefault(name, {})[key] = value
+
+    def hgetall(self, name):
+        if name in self.raw:
+            return dict(self.raw[name])
+        # RedisWrapper gibi: anahtarlar bytes, değerler unpickle edilmiş
+        return {_b(key): value for key, value in self.hashes.get(name, {}).items()}
+
+    def hdel(self, name, key, shared=False):
+        self.hashes.get(name, {}).pop(key, None)
+
+    def lock(self, name, timeout=None, blocking_timeout=None, **kwargs):
+        return _Lock(self, name)
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+    def register_script(self, script):
+        return _Script(self, script)
+
+    # Ham Redis komutları (anahtarlar make_key ile hazırlanmış)
+    def hsetnx(self, name, key, value):
+        target = self.raw.setdefault(name, {})
+        if _b(key) in target:
+            return 0
+        target[_b(key)] = _b(value)
+        return 1
+
+    def hincrby(self, name, key, amount=1):
+        target = self.raw.setdefault(name, {})
+        value = int(target.get(_b(key), b"0")) + int(amount)
+        target[_b(key)] = _b(value)
+        return value
+
+    def rpush(self, name, *values):
+        target = self.raw.setdefault(name, [])
+        target.extend(_b(v) for v in values)
+        return len(target)
+
+    def lrange(self, name, start, end):
+        values = self.raw.get(name, [])
+        return list(values[start:] if end == -1 else values[start : end + 1])
+
+    def expire(self, name, seconds):
+        return 1
+
+    def exists(self, *names):
+        return sum(1 for name in names if name in self.raw)
+
+    def delete(self, *names):
+        for name in names:
+            self.raw.pop(name, None)
+
+    # Sorted set: {member: score}
+    def _zsorted(self, name):
+        return sorted(self.raw.get(name, {}).items(), key=lambda item: (item[1], item[0]))
+
+    def zadd(self, name, mapping):
+        target = self.raw.setdefault(name, {})
+        added = sum(1 for member in mapping if _b(member) not in target)
+        target.update({_b(member): float(score) for member, score in mapping.items()})
+        return added
+
+    def zcard(self, name):
+        return len(self.raw.get(name, {}))
+
+    def zrange(self, name, start, end):
+        members = [member for member, _score in self._zsorted(name)]
+        return members[start:] if end == -1 else members[start : end + 1]
+
+    def zrangebyscore(self, name, low, high):
+        return [member for member, score in self._zsorted(name) if low <= score <= high]
+
+    def zrem(self, name, *members):
+        target = self.raw.get(name, {})
+        return sum(1 for member in members if target.pop(_b(member), None) is not None)
+
+    def zremrangebyrank(self, name, start, end):
+        members = self.zrange(name, start, end)
+        for member in members:
+            self.raw[name].pop(member)
+        return len(members)
+
+    def zremrangebyscore(self, name, low, high):
+        members = [member for member, score in self._zsorted(name) if low <= score <= high]
+        for member in members:
+            self.raw[name].pop(member)
+        return len(members)
+
+
+cache = _Cache()
+
+
+# ---------------------------------------------------------------------------
+# Arka plan işleri
+# ---------------------------------------------------------------------------
+
+
+class _Jobs:
+    def __init__(self):
+        self.queues = {}
+        self.ids = set()
+        # Çalışan işin job_id'si (frappe'de status "started")
+        self.running = set()
+        self.by_method = Counter()
+        self.failed = []
+
+    def clear(self):
+        self.queues.clear()
+        self.ids.clear()
+        self.running.clear()
+        self.by_method.clear()
+        self.failed.clear()
+
+    def push(self, job, deduplicate=False):
+        # RQ gibi: dedupe kontrolü işin gerçekten kuyruğa girdiği anda yapılır
+        if deduplicate and job.job_id and job.job_id in self.ids:
+            return
+        stats["enqueued"] += 1
+        self.queues.setdefault(job.queue, deque()).append(job)
+        if job.job_id:
+            self.ids.add(job.job_id)
+
+    def pop(self):
+        order = [*QUEUE_ORDER, *sorted(set(self.queues) - set(QUEUE_ORDER))]
+        for name in order:
+            if self.queues.get(name):
+                job = self.queues[name].popleft()
+                self.ids.discard(job.job_id)
+                return job
+        return None
+
+    def count(self, queue):
+        return len(self.queues.get(queue, ()))
+
+
+jobs = _Jobs()
+
+
+def enqueue(method, queue="default", timeout=None, job_id=None, deduplicate=False,
+        enqueue_after_commit=False, now=False, at_front=False, **kwargs):
+    if now:
+        return (_resolve(method) if isinstance(method, str) else method)(**kwargs)
+    # frappe gibi: deduplicate çağrı anında kontrol edilir; kuyrukta bekleyen veya
+    # çalışmakta olan aynı job_id'li iş varsa yeni iş düşürülür
+    if deduplicate and job_id and (job_id in jobs.ids or job_id in jobs.running):
+        stats["deduplicated"] += 1
+        return None
+    job = _dict(method=method, queue=queue, job_id=job_id, kwargs=kwargs)
+    if enqueue_after_commit:
+        db.after_commit.add(lambda: jobs.push(job, deduplicate))
+    else:
+        jobs.push(job, deduplicate)
+    return job
+
+
+def run_jobs(limit=None):
+    """Kuyruktaki işleri öncelik sırasıyla çalıştır; çalışan iş sayısını döndür"""
+    count = 0
+    while limit is None or count < limit:
+        job = jobs.pop()
+        if job is None:
+            break
+        count += 1
+        jobs.by_method[job.method] += 1
+        method = _resolve(job.method) if isinstance(job.method, str) else job.method
+        if job.job_id:
+            jobs.running.add(job.job_id)
+        try:
+            method(**job.kwargs)
+            db.commit()
+        except Exception:
+            db.rollback()
+            jobs.failed.append((job.method, traceback.format_exc()))
+        finally:
+            jobs.running.discard(job.job_id)
+    return count
+
+
+# ---------------------------------------------------------------------------
+# frappe.qb (sadece uygulamanın kullandığı alt küme: where / orderby / limit)
+# ---------------------------------------------------------------------------
+
+
+class _Criterion:
+    def __init__(self, test):
+        self.test = test
+
+    def __and__(self, other):
+        return _Criterion(lambda row: self.test(row) and other.test(row))
+
+    def __or__(self, other):
+        return _Criterion(lambda row: self.test(row) or other.test(row))
+
+
+class _Field:
+    def __init__(self, name):
+        self.name = name
+
+    def _criterion(self, op, value):
+        # Kayıtlardaki tarih alanları utils.now() biçiminde string
+        if isinstance(value, datetime):
+            value = value.strftime("%Y-%m-%d %H:%M:%S.%f")
+        elif isinstance(value, date):
+            value = value.strftime("%Y-%m-%d")
+        return _Criterion(lambda row: _compare(row.get(self.name), op, value))
+
+    def __eq__(self, value):
+        return self._criterion("=", value)
+
+    def __ne__(self, value):
+        return self._criterion("!=", value)
+
+    def __gt__(self, value):
+        return self._criterion(">", value)
+
+    def __ge__(self, value):
+        return self._criterion(">=", value)
+
+    def __lt__(self, value):
+        return self._criterion("<", value)
+
+    def __le__(self, value):
+        return self._criterion("<=", value)
+
+    def like(self, pattern):
+        return self._criterion("like", pattern)
+
+    __hash__ = object.__hash__
+
+
+class _Table:
+    def __init__(self, doctype):
+        self._doctype = doctype
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Field(name)
+
+
+class _Query:
+    def __init__(self, table):
+        self.table = table
+        self.fields = []
+        self.criteria = []
+        self.order = []
+        self.limit_value = None
+
+    def select(self, *fields):
+        self.fields.extend(field.name for field in fields)
+        return self
+
+    def where(self, criterion):
+        self.criteria.append(criterion)
+        return self
+
+    def orderby(self, field, order=None):
+        self.order.append((field.name, str(order or "").lower().endswith("desc")))
+        return self
+
+    def limit(self, value):
+        self.limit_value = value
+        return self
+
+    def run(self, as_dict=False, **kwargs):
+        stats["reads"] += 1
+        rows = [
+            row for row in _table(self.table._doctype).values()
+            if all(criterion.test(row) for criterion in self.criteria)
+        ]
+        for field, reverse in reversed(self.order):
+            rows.sort(key=lambda r: (r.get(field) is None, str(r.get(field) or "")), reverse=reverse)
+        if self.limit_value:
+            rows = rows[: int(self.limit_value)]
+
+        fields = self.fields or ["name"]
+        if as_dict:
+            return [_dict({f: row.get(f) for f in fields}) for row in rows]
+        return [tuple(row.get(f) for f in fields) for row in rows]
+
+
+# ---------------------------------------------------------------------------
+# Diğer API'ler
+# ---------------------------------------------------------------------------
+
+
+def publish_realtime(event=None, message=None, room=None, user=None, doctype=None, docname=None,
+        after_commit=False, **kwargs):
+    stats[f"realtime:{event}"] += 1
+
+
+def msgprint(msg, *args, **kwargs):
+    stats["msgprint"] += 1
+
+
+def throw(msg, exc=ValidationError, *args, **kwargs):
+    raise exc(msg)
+
+
+def log_error(title=None, message=None, **kwargs):
+    error_log.append(_dict(title=title, message=message))
+
+
+def get_traceback(*args, **kwargs):
+    return traceback.format_exc()
+
+
+def safe_decode(param, encoding="utf-8", **kwargs):
+    return param.decode(encoding) if isinstance(param, bytes) else param
+
+
+def generate_hash(txt=None, length=56):
+    return uuid.uuid4().hex[:length]
+
+
+def whitelist(*args, **kwargs):
+    if args and callable(args[0]):
+        return args[0]
+    return lambda fn: fn
+
+
+def only_for(roles, message=False):
+    pass
+
+
+def has_permission(*args, **kwargs):
+    return True
+
+
+def logger(module=None, with_more_info=False, allow_site=True, filter=None, max_size=None, file_count=None):
+    return logging.getLogger(module or "frappe")
+
+
+# ---------------------------------------------------------------------------
+# Alt modüller
+# ---------------------------------------------------------------------------
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _getdate(value=None):
+    if value is None:
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def _get_datetime(value=None):
+    if value is None:
+        return datetime.now()
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    value = str(value)
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def _add_to_date(value, days=0, hours=0, minutes=0, seconds=0, as_string=False, as_datetime=False):
+    result = _get_datetime(value) + timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+    if not as_string:
+        return result
+    return result.strftime("%Y-%m-%d %H:%M:%S.%f") if as_datetime else result.strftime("%Y-%m-%d")
+
+
+def _flt(value, precision=None):
+    try:
+        number = float(value or 0)
+    except (TypeError, ValueError):
+        number = 0.0
+    return round(number, precision) if precision is not None else number
+
+
+def _cint(value):
+    try:
+        return int(float(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _getseries(key, digits):
+    stats["writes"] += 1
+    _series[key] += 1
+    return str(_series[key]).zfill(digits)
+
+
+def _get_url_to_form(doctype, name):
+    return f"/app/{scrub(doctype).replace('_', '-')}/{name}"
+
+
+def _enqueue_create_notification(users, doc):
+    users = [users] if isinstance(users, str) else list(users)
+    stats["notifications"] += len(users)
+
+
+def _get_queues_timeout():
+    workers = conf.get("workers") or {}
+    return {"short": 300, "default": 300, "long": 1500, **{name: w.get("timeout", 300) for name, w in workers.items()}}
+
+
+class _Queue:
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def count(self):
+        return jobs.count(self.name)
+
+
+utils = _module(
+    "frappe.utils",
+    now=_now,
+    now_datetime=datetime.now,
+    today=lambda: date.today().isoformat(),
+    nowdate=lambda: date.today().isoformat(),
+    getdate=_getdate,
+    get_datetime=_get_datetime,
+    add_days=lambda value, days: _getdate(value) + timedelta(days=days),
+    add_to_date=_add_to_date,
+    flt=_flt,
+    cint=_cint,
+)
+utils.data = _module("frappe.utils.data", get_url_to_form=_get_url_to_form)
+utils.background_jobs = _module(
+    "frappe.utils.background_jobs",
+    is_job_enqueued=lambda job_id: job_id in jobs.ids,
+    get_queue=lambda qtype="default", is_async=True: _Queue(qtype),
+    get_queues_timeout=_get_queues_timeout,
+)
+model = _module("frappe.model")
+model.naming = _module("frappe.model.naming", getseries=_getseries)
+model.document = _module("frappe.model.document", Document=Document)
+desk = _module("frappe.desk")
+desk.doctype = _module("frappe.desk.doctype")
+desk.doctype.notification_log = _module("frappe.desk.doctype.notification_log")
+desk.doctype.notification_log.notification_log = _module(
+    "frappe.desk.doctype.notification_log.notification_log",
+    enqueue_create_notification=_enqueue_create_notification,
+)
+desk.doctype.notification_settings = _module("frappe.desk.doctype.notification_settings")
+desk.doctype.notification_settings.notification_settings = _module(
+    "frappe.desk.doctype.notification_settings.notification_settings",
+    is_notifications_enabled=lambda user: True,
+)
+
+
+
+
+class FrappeTestCase(unittest.TestCase):
+    """frappe.tests.utils.FrappeTestCase yerine: her test sınıfı boş bir sitede başlar"""
+
+    @classmethod
+    def setUpClass(cls):
+        reset(site=f"test-{scrub(cls.__name__)}.local")
+        flags.in_test = True
+        super().setUpClass()
+
+
+qb = _module("frappe.qb", DocType=_Table, from_=_Query)
+tests = _module("frappe.tests")
+tests.utils = _module("frappe.tests.utils", FrappeTestCase=FrappeTestCase)
+
+
+# ---------------------------------------------------------------------------
+# PyPDF2 ara katmanı: metin fixture'ları PDF gibi okunur
+# ---------------------------------------------------------------------------
+
+
+class _TextPage:
+    def __init__(self, text):
+        self.text = text
+
+    def extract_text(self, *args, **kwargs):
+        return self.text
+
+
+class PdfReader:
+    """Gerçek PDF'ler (PyPDF2 kuruluysa) ona, düz metin fixture'lar sayfa listesine (\\f ile ayrılmış)"""
+
+    def __init__(self, stream, *args, **kwargs):
+        data = stream.read()
+        if data.startswith(b"%PDF") and _real_pypdf2 is not None:
+            self.pages = _real_pypdf2.PdfReader(io.BytesIO(data)).pages
+        else:
+            self.pages = [_TextPage(page) for page in data.decode("utf-8", "replace").split("\f")]
+
+
+_real_pypdf2 = None
+
+
+def install(site="replay.local", site_conf=None, storage_dir=None):
+    """Bu modülü frappe olarak (ve PyPDF2 ara katmanını) sys.modules'a kaydet"""
+    global _real_pypdf2
+    if not getattr(sys.modules.get("PyPDF2"), "_replay_shim", False):
+        try:
+            _real_pypdf2 = import_module("PyPDF2")
+        except ImportError:
+            _real_pypdf2 = None
+
+    this = sys.modules[__name__]
+    sys.modules["frappe"] = this
+    for name, module in (
+        ("frappe.utils", utils),
+        ("frappe.utils.data", utils.data),
+        ("frappe.utils.background_jobs", utils.background_jobs),
+        ("frappe.model", model),
+        ("frappe.model.naming", model.naming),
+        ("frappe.model.document", model.document),
+        ("frappe.qb", qb),
+        ("frappe.tests", tests),
+        ("frappe.tests.utils", tests.utils),
+        ("frappe.desk", desk),
+        ("frappe.desk.doctype", desk.doctype),
+        ("frappe.desk.doctype.notification_log", desk.doctype.notification_log),
+        ("frappe.desk.doctype.notification_log.notification_log", desk.doctype.notification_log.notification_log),
+        ("frappe.desk.doctype.notification_settings", desk.doctype.notification_settings),
+        (
+            "frappe.desk.doctype.notification_settings.notification_settings",
+            desk.doctype.notification_settings.notification_settings,
+        ),
+    ):
+        sys.modules[name] = module
+    sys.modules["PyPDF2"] = _module("PyPDF2", PdfReader=PdfReader, _replay_shim=True)
+
+    reset(site=site, site_conf=site_conf, storage_dir=storage_dir)
+    return this
+
+
+def has_real_pdf_reader():
+    return _real_pypdf2 is not None
@@ -0,0 +1,328 @@
+"""
+Yerel OpenAI uyumlu stub sunucu (AI validation'ı ağsız / ücretsiz denemek için)
+
+Kullanım:
+    python -m invoice.tools.fake_openai --port 8765 [--latency 0.5]
+    python -m invoice.tools.fake_openai --check [--requests 16] [--latency 0.2]
+
+site_config'te "invoice_openai_base_url": "http://127.0.0.1:8765/v1" ayarlanınca
+gerçek client'lar bu sunucuya bağlanır. POST /v1/chat/completions her istekte
+--latency kadar bekleyip geçerli bir validation JSON'u döndürür.
+
+Batch API (invoice_ai_batch): POST /v1/files, POST /v1/batches,
+GET /v1/batches/{id}, GET /v1/files/{id}/content. Batch, oluşturulduktan
+--batch-delay saniye sonra ilk sorguda tamamlanır; her satır chat completion
+ile aynı yanıtı alır.
+
+model_results ({model: sonuç}) ile modele göre farklı yanıt verilir (routing denemesi).
+
+--check: stub'ı rastgele portta açar; gerçek sync client ile ardışık çağrıların
+tek bağlantıyı (keep-alive) kullandığını, async client ile de throughput'un
+eşzamanlılıkla ölçeklendiğini, üst modele geçişi ve batch akışını doğrular. openai paketi gerekir.
+"""
+
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESULT = {
+    "status": "Valid",
+    "confidence": 0.97,
+    "summary": "Stub: tüm alanlar PDF ile uyumlu",
+    "details": {"missing_fields": [], "incorrect_fields": [], "extras_in_pdf": [], "field_comparisons": []},
+    "recommendations": [],
+}
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, result=None, batch_delay=0.0, model_results=None):
+        super().__init__(address, StubOpenAIHandler)
+        self.latency = latency
+        self.result = result or DEFAULT_RESULT
+        self.model_results = model_results or {}
+        self.batch_delay = batch_delay
+        self.connections = 0
+        self.requests = 0
+        self.files = {}  # id -> {"object": {...}, "content": bytes}
+        self.batches = {}  # id -> batch nesnesi
+        self.stats_lock = threading.Lock()
+
+    def get_result(self, request_body):
+        return self.model_results.get(request_body.get("model"), self.result)
+
+    def count(self, field):
+        with self.stats_lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def add_file(self, content, filename, purpose):
+        file_id = f"file-stub-{len(self.files) + 1}"
+        self.files[file_id] = {
+            "object": {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+            },
+            "content": content,
+        }
+        return self.files[file_id]["object"]
+
+    def create_batch(self, body):
+        batch_id = f"batch_stub_{len(self.batches) + 1}"
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body.get("input_file_id"),
+            "completion_window": body.get("completion_window"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "metadata": body.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        return self.batches[batch_id]
+
+    def get_batch(self, batch_id):
+        """Süre dolduysa batch'i işle: her satır için chat completion yanıtı"""
+        batch = self.batches[batch_id]
+        if batch["status"] != "completed" and time.time() - batch["created_at"] >= self.batch_delay:
+            output = []
+            for line in self.files[batch["input_file_id"]]["content"].decode().splitlines():
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                self.count("requests")
+                output.append(json.dumps({
+                    "id": f"batch_req_{len(output) + 1}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": f"req_{len(output) + 1}",
+                        "body": build_completion(request["body"], self.get_result(request["body"])),
+                    },
+                    "error": None,
+                }, ensure_ascii=False))
+            output_file = self.add_file(("\n".join(output) + "\n").encode(), f"{batch_id}_output.jsonl", "batch_output")
+            batch.update({
+                "status": "completed",
+                "output_file_id": output_file["id"],
+                "completed_at": int(time.time()),
+                "request_counts": {"total": len(output), "completed": len(output), "failed": 0},
+            })
+        return batch
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    # Keep-alive: aynı TCP bağlantısında birden çok istek
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = self.path.rstrip("/")
+
+        if path.endswith("/files"):
+            fields = parse_multipart(self.headers.get("Content-Type"), raw)
+            content, filename = fields.get("file", (b"", None))
+            return self.send_json(200, self.server.add_file(content, filename, fields.get("purpose", (b"", None))[0].decode()))
+
+        body = json.loads(raw or b"{}")
+        if path.endswith("/batches"):
+            return self.send_json(200, self.server.create_batch(body))
+        if not path.endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": f"Bilinmeyen endpoint: {self.path}"}})
+
+        self.server.count("requests")
+        time.sleep(self.server.latency)
+        self.send_json(200, build_completion(body, self.server.get_result(body)))
+
+    def do_GET(self):
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in self.server.batches:
+            return self.send_json(200, self.server.get_batch(parts[-1]))
+        if len(parts) >= 3 and parts[-1] == "content" and parts[-2] in self.server.files:
+            content = self.server.files[parts[-2]]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            return self.wfile.write(content)
+        self.send_json(404, {"error": {"message": f"Bilinmeyen endpoint: {self.path}"}})
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def parse_multipart(content_type, body):
+    """multipart/form-data -> {alan: (içerik, dosya adı)}"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (part.get_payload(decode=True), part.get_filename())
+        for part in message.iter_parts()
+    }
+
+
+def build_completion(request_body, result):
+    content = json.dumps(result, ensure_ascii=False)
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in request_body.get("messages", [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-stub-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request_body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, result=None, batch_delay=0.0, model_results=None):
+    """Sunucuyu arka plan thread'inde başlat (shutdown() ile durdurulur)"""
+    server = StubOpenAIServer((host, port), latency=latency, result=result, batch_delay=batch_delay, model_results=model_results)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_check(request_count, latency):
+    from invoice.tools import fake_frappe
+
+    server = start_stub_server(latency=latency)
+    fake_frappe.install()
+    fake_frappe.reset(site_conf={"openai_api_key": "stub", "invoice_openai_base_url": server.base_url})
+
+    from invoice.api import invoice_ai_validation as validation
+
+    messages = [{"role": "user", "content": "stub"}]
+
+    # Sync: process genelinde tek client, ardışık çağrılar tek bağlantı
+    for _i in range(3):
+        assert validation.request_validation(validation.get_openai_client(), messages)["status"] == "Valid"
+    assert validation.get_openai_client() is validation.get_openai_client(), "Sync client paylaşılmıyor"
+    assert server.connections == 1, f"Keep-alive çalışmıyor: 3 istek, {server.connections} bağlantı"
+    print(f"OK: sync client 3 istek, {server.connections} bağlantı")
+
+    # Routing: küçük modelin düşük confidence'lı yanıtı üst modele geçer
+    small, large = validation.VALIDATION_MODELS
+    server.model_results = {small: dict(DEFAULT_RESULT, confidence=0.5)}
+    result = validation.request_validation(validation.get_openai_client(), messages)
+    assert [attempt["model"] for attempt in result["routing"]] == [small, large], result["routing"]
+    assert result["routing"][0]["escalation"] and result["routing"][1]["completion_tokens"] > 0
+    server.model_results = {}
+    print(f"OK: routing {validation.get_routing_summary(result)}")
+
+    async def run_async(concurrency):
+        client = validation.get_async_openai_client(concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+        try:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(
+                validation.request_validation_async(client, messages, semaphore)
+                for _i in range(request_count)
+            ))
+            return time.perf_counter() - started, results
+        finally:
+            await client.close()
+
+    timings = {}
+    for concurrency in (1, validation.MAX_CONCURRENCY // 2):
+        connections = server.connections
+        elapsed, results = asyncio.run(run_async(concurrency))
+        assert all(result["status"] == "Valid" for result in results)
+        timings[concurrency] = elapsed
+        print(
+            f"Async eşzamanlılık {concurrency}: {request_count} istek {elapsed:.2f} sn "
+            f"({request_count / elapsed:.1f} istek/sn, {server.connections - connections} yeni bağlantı)"
+        )
+
+    low, high = sorted(timings)
+    assert timings[high] < timings[low] / 2, "Throughput eşzamanlılıkla ölçeklenmiyor"
+
+    # Batch API: yükle, başlat, sonucu indir (invoice_ai_batch ile aynı çağrılar)
+    client = validation.get_openai_client()
+    lines = "".join(
+        json.dumps({"custom_id": f"INV-{i}", "method": "POST", "url": "/v1/chat/completions",
+            "body": validation.get_completion_args(messages)}) + "\n"
+        for i in range(request_count)
+    )
+    input_file = client.files.create(file=("batch.jsonl", lines.encode()), purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    batch = client.batches.retrieve(batch.id)
+    assert batch.status == "completed", f"Batch durumu: {batch.status}"
+    output = [json.loads(line) for line in client.files.content(batch.output_file_id).text.splitlines()]
+    assert sorted(line["custom_id"] for line in output) == sorted(f"INV-{i}" for i in range(request_count))
+    assert all(
+        validation.parse_validation_response(line["response"]["body"]["choices"][0]["message"]["content"])["status"] == "Valid"
+        for line in output
+    )
+    print(f"OK: batch {batch.id}, {len(output)} sonuç, 4 API çağrısı")
+    server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI validation için yerel OpenAI uyumlu stub sunucu")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, help="Her yanıttan önce bekleme (sn); varsayılan 0.5, --check ile 0.2")
+    parser.add_argument("--check", action="store_true", help="Client havuzunu stub'a karşı doğrula ve çık")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Batch'in tamamlanma süresi (sn)")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        run_check(args.requests, 0.2 if args.latency is None else args.latency)
+        return 0
+
+    server = StubOpenAIServer(
+        (args.host, args.port),
+        latency=0.5 if args.latency is None else args.latency,
+        batch_delay=args.batch_delay
+    )
+    print(f"OpenAI stub {server.base_url} üzerinde")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Yerel IMAP stub sunucusu (IDLE listener'ı ağsız denemek için)
+
+Kullanım:
+    python -m invoice.tools.imap_stub --check [--messages 5]
+    python -m invoice.tools.imap_stub --port 1143 [FIXTURE_DIR]
+
+--check: stub'ı rastgele portta açar, gerçek ImapIdleListener'ı (SSL'siz)
+bağlar, mesajları aralıklı teslim eder ve her birinin listener'a ulaşma
+süresini, sadece yeni UID'lerin çekildiğini ve IDLE yenilemesini doğrular.
+
+Desteklenen komutlar: CAPABILITY, LOGIN, SELECT, UID SEARCH UID n:*,
+UID FETCH (BODY[] / BODY.PEEK[]), NOOP, IDLE/DONE, LOGOUT.
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from email.message import EmailMessage
+
+from invoice.api.imap_client import ImapIdleListener
+
+
+class StubMailbox:
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = []  # [(uid, raw)]
+        self.next_uid = 1
+        self.sessions = set()
+        self.fetched_uids = []
+
+    def deliver(self, raw):
+        """Mesajı kutuya ekle ve IDLE'daki oturumlara EXISTS gönder"""
+        self.messages.append((self.next_uid, raw))
+        self.next_uid += 1
+        for session in list(self.sessions):
+            session.notify_exists()
+        return self.next_uid - 1
+
+
+class StubSession:
+    def __init__(self, mailbox, reader, writer):
+        self.mailbox = mailbox
+        self.reader = reader
+        self.writer = writer
+        self.idling = False
+
+    def send(self, line):
+        self.writer.write(line if isinstance(line, bytes) else f"{line}\r\n".encode())
+
+    def notify_exists(self):
+        if self.idling:
+            self.send(f"* {len(self.mailbox.messages)} EXISTS")
+
+    async def run(self):
+        self.mailbox.sessions.add(self)
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE] invoice stub ready")
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    return
+                tag, _sep, command = line.decode().strip().partition(" ")
+                if not await self.handle(tag, command):
+                    return
+                await self.writer.drain()
+        finally:
+            self.mailbox.sessions.discard(self)
+            self.writer.close()
+
+    async def handle(self, tag, command):
+        verb = command.split(" ", 1)[0].upper()
+        mailbox = self.mailbox
+
+        if verb == "CAPABILITY":
+            self.send("* CAPABILITY IMAP4rev1 IDLE")
+        elif verb == "LOGIN" or verb == "NOOP":
+            pass
+        elif verb == "SELECT":
+            self.send(f"* {len(mailbox.messages)} EXISTS")
+            self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+            self.send(f"* OK [UIDNEXT {mailbox.next_uid}] Predicted next UID")
+            self.send(f"{tag} OK [READ-WRITE] SELECT completed")
+            return True
+        elif verb == "IDLE":
+            self.idling = True
+            self.send("+ idling")
+            await self.writer.drain()
+            line = await self.reader.readline()
+            while line and line.strip().upper() != b"DONE":
+                line = await self.reader.readline()
+            self.idling = False
+            if not line:
+                # Bağlantı IDLE sırasında koptu
+                return False
+        elif verb == "LOGOUT":
+            self.send("* BYE")
+            self.send(f"{tag} OK LOGOUT completed")
+            await self.writer.drain()
+            return False
+        elif command.upper().startswith("UID SEARCH UID"):
+            start = int(re.search(r"UID (\d+):\*", command, re.IGNORECASE).group(1))
+            uids = [uid for uid, _raw in mailbox.messages if uid >= start] or [mailbox.next_uid - 1]
+            self.send("* SEARCH " + " ".join(str(uid) for uid in uids if uid > 0))
+        elif command.upper().startswith("UID FETCH"):
+            uid_set = {int(uid) for uid in command.split()[2].split(",")}
+            for seq, (uid, raw) in enumerate(mailbox.messages, start=1):
+                if uid in uid_set:
+                    mailbox.fetched_uids.append(uid)
+                    self.send(f"* {seq} FETCH (UID {uid} BODY[] {{{len(raw)}}}\r\n".encode() + raw + b")\r\n")
+        else:
+            self.send(f"{tag} BAD unknown command")
+            return True
+
+        self.send(f"{tag} OK {verb} completed")
+        return True
+
+
+async def start_stub_server(mailbox, host="127.0.0.1", port=0):
+    async def on_connect(reader, writer):
+        await StubSession(mailbox, reader, writer).run()
+
+    return await asyncio.start_server(on_connect, host, port)
+
+
+def make_message(index):
+    message = EmailMessage()
+    message["From"] = "billing@wolt.com"
+    message["To"] = "invoices@example.com"
+    message["Subject"] = f"Your Wolt invoice {index}"
+    message["Message-ID"] = f"<stub-{index}-{time.time_ns()}@example.com>"
+    message.set_content("Rechnung im Anhang")
+    return bytes(message).replace(b"\n", b"\r\n")
+
+
+async def run_check(count, delay):
+    mailbox = StubMailbox()
+    # Listener başlamadan önce gelen mesaj: tekrar çekilmemeli (sadece yeni UID'ler)
+    mailbox.deliver(make_message(0))
+
+    server = await start_stub_server(mailbox)
+    port = server.sockets[0].getsockname()[1]
+    received = asyncio.Queue()
+    gaps = []
+
+    listener = ImapIdleListener(
+        {"host": "127.0.0.1", "port": port, "use_ssl": False, "user": "stub", "password": "stub"},
+        on_messages=lambda messages: [received.put_nowait((uid, time.perf_counter())) for uid, _raw in messages],
+        on_gap=lambda: gaps.append(True),
+        idle_timeout=delay * 2,
+    )
+    task = asyncio.create_task(listener.run())
+    await asyncio.sleep(0.2)
+
+    latencies = []
+    for i in range(1, count + 1):
+        sent = time.perf_counter()
+        uid = mailbox.deliver(make_message(i))
+        got_uid, got_at = await asyncio.wait_for(received.get(), 5)
+        assert got_uid == uid, f"Beklenen UID {uid}, gelen {got_uid}"
+        latencies.append((got_at - sent) * 1000)
+        # IDLE yenilemesinin de denenmesi için bazen timeout'tan uzun bekle
+        await asyncio.sleep(delay * (3 if i % 2 else 1))
+
+    listener.stop()
+    await asyncio.wait_for(task, 5)
+    server.close()
+    await server.wait_closed()
+
+    assert 1 not in mailbox.fetched_uids, "Listener öncesi mesaj tekrar çekildi"
+    assert sorted(mailbox.fetched_uids) == list(range(2, count + 2)), f"Çekilen UID'ler: {mailbox.fetched_uids}"
+    assert gaps == [True], "İlk bağlantıda catch-up poll bir kez istenmeli"
+
+    print(f"OK: {count} mesaj, sadece yeni UID'ler çekildi: {mailbox.fetched_uids}")
+    print(f"Teslim gecikmesi (ms): min={min(latencies):.1f} max={max(latencies):.1f}")
+
+
+async def serve(port, fixture_dir=None):
+    mailbox = StubMailbox()
+    server = await start_stub_server(mailbox, port=port)
+    print(f"IMAP stub 127.0.0.1:{port} üzerinde (SSL'siz)")
+    if fixture_dir:
+        for file_name in sorted(os.listdir(fixture_dir)):
+            if file_name.endswith(".eml"):
+                await asyncio.sleep(1)
+                with open(os.path.join(fixture_dir, file_name), "rb") as f:
+                    print(f"Teslim edildi: {file_name} (UID {mailbox.deliver(f.read())})")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="IMAP IDLE listener için yerel stub sunucu")
+    parser.add_argument("fixture_dir", nargs="?", help="Sırayla teslim edilecek .eml dosyaları")
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--check", action="store_true", help="Listener'ı stub'a karşı doğrula ve çık")
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=0.2, help="Mesajlar arası bekleme (sn)")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        asyncio.run(run_check(args.messages, args.delay))
+        return 0
+    try:
+        asyncio.run(serve(args.port, args.fixture_dir))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Offline uçtan uca replay: fixture email'leri gerçek pipeline'dan geçir
+
+Kullanım:
+    python -m invoice.tools.replay FIXTURE_DIR [--sender ...] [--subject ...] [--json]
+
+FIXTURE_DIR içindeki her .eml bir email'dir (PDF ekleri attachment olur).
+Tek başına duran .pdf / .txt dosyalarının her biri ayrı bir email olur;
+yanında aynı isimli .json varsa ondan subject/sender okunur. .txt dosyaları
+PDF metni gibi okunur (sayfalar \\f ile ayrılır) - PyPDF2 kurulu olmadan da
+extractor'ları çalıştırmak için.
+
+Frappe yerine invoice.tools.fake_frappe kullanılır: ağ, MariaDB, Redis ve
+worker gerekmez. Her email için gecikme, DB okuma/yazma ve çalışan iş sayısı,
+sonda throughput ve p50/p95 raporlanır.
+"""
+
+import argparse
+import contextlib
+import email
+import email.policy
+import email.utils
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+from invoice.tools import fake_frappe
+
+FIXTURE_ATTACHMENTS = (".pdf", ".txt")
+DEFAULT_SENDER = "invoices@example.com"
+DEFAULT_SUBJECT = "Rechnung"
+
+
+def load_fixtures(path, sender=None, subject=None):
+    """Klasördeki fixture'ları [{subject, sender, attachments: [(file_name, bytes)]}] olarak döndür"""
+    emails = []
+    for file_name in sorted(os.listdir(path)):
+        full_path = os.path.join(path, file_name)
+        stem, ext = os.path.splitext(file_name)
+        ext = ext.lower()
+
+        if ext == ".eml":
+            with open(full_path, "rb") as f:
+                message = email.message_from_binary_file(f, policy=email.policy.default)
+            attachments = [
+                (as_pdf_name(part.get_filename()), part.get_payload(decode=True))
+                for part in message.iter_attachments()
+                if (part.get_filename() or "").lower().endswith(FIXTURE_ATTACHMENTS)
+            ]
+            emails.append({
+                "fixture": file_name,
+                "subject": str(message.get("subject") or subject or DEFAULT_SUBJECT),
+                "sender": email.utils.parseaddr(str(message.get("from") or ""))[1] or sender or DEFAULT_SENDER,
+                "attachments": attachments,
+            })
+
+        elif ext in FIXTURE_ATTACHMENTS:
+            meta = {}
+            sidecar = os.path.join(path, f"{stem}.json")
+            if os.path.exists(sidecar):
+                with open(sidecar) as f:
+                    meta = json.load(f)
+            with open(full_path, "rb") as f:
+                content = f.read()
+            emails.append({
+                "fixture": file_name,
+                "subject": meta.get("subject") or subject or DEFAULT_SUBJECT,
+                "sender": meta.get("sender") or sender or DEFAULT_SENDER,
+                "attachments": [(as_pdf_name(file_name), content)],
+            })
+
+    return emails
+
+
+def as_pdf_name(file_name):
+    # Pipeline sadece .pdf uzantılı ekleri işler
+    stem, ext = os.path.splitext(file_name or "attachment.pdf")
+    return file_name if ext.lower() == ".pdf" else f"{stem}.pdf"
+
+
+def seed_users(count):
+    for i in range(count):
+        fake_frappe.get_doc({
+            "doctype": "User",
+            "name": f"user{i + 1}@example.com",
+            "enabled": 1,
+            "user_type": "System User",
+        }).insert()
+
+
+def receive_email(fixture):
+    """Email hesabı gibi: Communication + ekler, sonra commit (hook işleri commit'te kuyruğa girer)"""
+    frappe = fake_frappe
+    comm = frappe.get_doc({
+        "doctype": "Communication",
+        "communication_type": "Communication",
+        "communication_medium": "Email",
+        "sent_or_received": "Received",
+        "subject": fixture["subject"],
+        "sender": fixture["sender"],
+    }).insert(ignore_permissions=True)
+
+    for file_name, content in fixture["attachments"]:
+        frappe.get_doc({
+            "doctype": "File",
+            "file_name": file_name,
+            "attached_to_doctype": "Communication",
+            "attached_to_name": comm.name,
+            "is_private": 1,
+            "content": content,
+        }).insert()
+
+    # Ekler kaydedildikten sonra Communication güncellenir (on_update hook'u)
+    comm.save()
+    frappe.db.commit()
+    return comm
+
+
+def replay(fixtures, quiet=True):
+    frappe = fake_frappe
+    results = []
+    started = time.perf_counter()
+
+    for fixture in fixtures:
+        before = Counter(frappe.stats)
+        jobs_before = sum(frappe.jobs.by_method.values())
+        errors_before = len(frappe.error_log)
+        failed_before = len(frappe.jobs.failed)
+
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, "w")) if quiet else contextlib.nullcontext():
+            comm = receive_email(fixture)
+            frappe.run_jobs()
+        latency = time.perf_counter() - t0
+
+        delta = Counter(frappe.stats)
+        delta.subtract(before)
+        results.append({
+            "fixture": fixture["fixture"],
+            "communication": comm.name,
+            "pdfs": len(fixture["attachments"]),
+            "latency_ms": round(latency * 1000, 2),
+            "reads": delta["reads"],
+            "writes": delta["writes"],
+            "commits": delta["commits"],
+            "jobs": sum(frappe.jobs.by_method.values()) - jobs_before,
+            "realtime": sum(v for k, v in delta.items() if k.startswith("realtime:")),
+            "errors": len(frappe.error_log) - errors_before,
+            "failed_jobs": len(frappe.jobs.failed) - failed_before,
+        })
+
+    elapsed = time.perf_counter() - started
+    return results, summarize(results, elapsed)
+
+
+def summarize(results, elapsed):
+    frappe = fake_frappe
+    latencies = sorted(r["latency_ms"] for r in results)
+    pdfs = sum(r["pdfs"] for r in results)
+
+    def percentile(p):
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))]
+
+    created = {
+        doctype: len(rows)
+        for doctype, rows in frappe._data.items()
+        if doctype not in ("Communication", "File", "User") and rows
+    }
+
+    return {
+        "emails": len(results),
+        "pdfs": pdfs,
+        "elapsed_s": round(elapsed, 3),
+        "emails_per_s": round(len(results) / elapsed, 2) if elapsed else 0,
+        "pdfs_per_s": round(pdfs / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "max": latencies[-1] if latencies else 0,
+            "mean": round(statistics.mean(latencies), 2) if latencies else 0,
+        },
+        "reads": sum(r["reads"] for r in results),
+        "writes": sum(r["writes"] for r in results),
+        "reads_per_email": round(sum(r["reads"] for r in results) / len(results), 1) if results else 0,
+        "jobs": dict(frappe.jobs.by_method),
+        "created": created,
+        "lock_contention": frappe.stats["lock_contention"],
+        "notifications": frappe.stats["notifications"],
+        "errors": [e.title for e in frappe.error_log],
+        "failed_jobs": [method for method, _tb in frappe.jobs.failed],
+    }
+
+
+def print_report(results, summary):
+    header = f"{'fixture':<40} {'pdfs':>4} {'ms':>9} {'reads':>6} {'writes':>6} {'jobs':>5} {'rt':>4} {'err':>4}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['fixture'][:40]:<40} {r['pdfs']:>4} {r['latency_ms']:>9.2f} {r['reads']:>6} "
+            f"{r['writes']:>6} {r['jobs']:>5} {r['realtime']:>4} {r['errors'] + r['failed_jobs']:>4}"
+        )
+    print()
+    print(f"Email: {summary['emails']}, PDF: {summary['pdfs']}, süre: {summary['elapsed_s']} sn")
+    print(f"Throughput: {summary['emails_per_s']} email/sn, {summary['pdfs_per_s']} PDF/sn")
+    latency = summary["latency_ms"]
+    print(f"Gecikme (ms): p50={latency['p50']} p95={latency['p95']} max={latency['max']} ort={latency['mean']}")
+    print(f"DB: {summary['reads']} okuma ({summary['reads_per_email']}/email), {summary['writes']} yazma")
+    print(f"İşler: {json.dumps(summary['jobs'], indent=1)}")
+    print(f"Oluşturulan: {json.dumps(summary['created'], indent=1)}")
+    if summary["errors"] or summary["failed_jobs"]:
+        print(f"Hatalar: {Counter(summary['errors'])} / başarısız işler: {Counter(summary['failed_jobs'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fatura pipeline'ını offline fixture'larla çalıştır")
+    parser.add_argument("fixture_dir")
+    parser.add_argument("--sender", help="Tek başına duran PDF'ler için gönderen")
+    parser.add_argument("--subject", help="Tek başına duran PDF'ler için konu")
+    parser.add_argument("--users", type=int, default=3, help="Bildirim alacak System User sayısı")
+    parser.add_argument("--repeat", type=int, default=1, help="Fixture setini N kez gönder (tekrar/duplicate yolu)")
+    parser.add_argument("--conf", help="site_config değerleri (JSON), örn. '{\"invoice_ingest_platform_concurrency\": 2}'")
+    parser.add_argument("--verbose", action="store_true", help="Pipeline print çıktısını göster")
+    parser.add_argument("--json", action="store_true", help="Raporu JSON olarak yaz")
+    args = parser.parse_args(argv)
+
+    fake_frappe.install(site_conf=json.loads(args.conf) if args.conf else None)
+    fixtures = load_fixtures(args.fixture_dir, sender=args.sender, subject=args.subject)
+    if not fixtures:
+        parser.error(f"Fixture bulunamadı: {args.fixture_dir}")
+    if not fake_frappe.has_real_pdf_reader() and any(
+        content.startswith(b"%PDF") for f in fixtures for _name, content in f["attachments"]
+    ):
+        print("Uyarı: PyPDF2 kurulu değil, gerçek PDF fixture'larından metin çıkarılamaz", file=sys.stderr)
+
+    seed_users(args.users)
+    results, summary = replay(fixtures * args.repeat, quiet=not args.verbose)
+
+    if args.json:
+        print(json.dumps({"emails": results, "summary": summary}, indent=1, default=str))
+    else:
+        print_report(results, summary)
+    return 1 if summary["failed_jobs"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())